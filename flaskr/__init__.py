@@ -1,21 +1,36 @@
+from flaskr.startup import StartupTimer
+# Started before the other imports so they are timed
+import_timer = StartupTimer()
 from flaskr import pages
 from flask import Flask
+from werkzeug.middleware.proxy_fix import ProxyFix
 from flaskr.backend import Backend
 import logging
-from flaskr.backend import Backend
+import time
+from flaskr.uploads import UploadRequest
 logging.basicConfig(level=logging.DEBUG)
+import_timer.mark('import')
 
 
 # The flask terminal command inside "run-flask.sh" searches for
 # this method inside of __init__.py (containing flaskr module
 # properties) as we set "FLASK_APP=flaskr" before running "flask".
 def create_app(test_config=None, backend=Backend):
+    started = time.perf_counter()
     # Create and configure the app.
     app = Flask(__name__, instance_relative_config=True)
+    # Uploaded files are spooled, hashed and checked as they are received
+    app.request_class = UploadRequest
 
     # This is the default secret key used for login sessions
     # By default the dev environment uses the key 'dev'
-    app.config.from_mapping(SECRET_KEY='dev',)
+    # Request bodies (a .zip included) are limited to 256 MB
+    # Requests come through one proxy, App Engine's front end, which
+    # adds the client's address to X-Forwarded-For. Set PROXY_FIX_X_FOR
+    # to the number of proxies trusted, 0 when serving clients directly.
+    app.config.from_mapping(SECRET_KEY='dev',
+                            MAX_CONTENT_LENGTH=256 * 1024 * 1024,
+                            PROXY_FIX_X_FOR=1)
 
     if test_config is None:
         # Load the instance config, if it exists, when not testing.
@@ -25,10 +40,22 @@ def create_app(test_config=None, backend=Backend):
         # Load the test config if passed in.
         app.config.from_mapping(test_config)
 
+    # request.remote_addr is then the client's address, not the proxy's,
+    # for the login throttle
+    if app.config['PROXY_FIX_X_FOR']:
+        app.wsgi_app = ProxyFix(app.wsgi_app,
+                                x_for=app.config['PROXY_FIX_X_FOR'])
+
     # TODO(Project 1): Make additional modifications here for logging in, backends
     # and additional endpoints.
     pages.make_endpoints(app, backend)
 
     # """For login and sign up in backend.py"""
     app.secret_key = 'temp_key'
+
+    # Cold start report: import, create_app and first request times
+    timer = StartupTimer()
+    timer.time('import', import_timer.steps['import'])
+    timer.time('create_app', time.perf_counter() - started)
+    timer.watch_first_request(app)
     return app
@@ -0,0 +1,187 @@
+"""
+Storage for the page popularity analytics.
+
+Two formats are understood. The legacy csv has one `page,views` row per
+page. The JSON-lines format starts with a header line carrying the format
+version, followed by one `{"page": ..., "views": ...}` object per line.
+Both are parsed a line at a time with a cost linear in the file size.
+"""
+import csv
+import io
+import json
+
+LEGACY_CSV_BLOB = "Dictionary by Popularity.csv"
+JSONL_BLOB = "page_analytics.jsonl"
+FORMAT_NAME = "page-analytics"
+FORMAT_VERSION = 1
+CSV = "csv"
+JSONL = "jsonl"
+
+
+class PageAnalytics(dict):
+    """
+    Number of views by page name, in the order pages were first recorded.
+    """
+
+    def add(self, page_name, views=1):
+        """
+        Args:
+            - Sub page name (str), number of views (int)
+        """
+        self[page_name] = self.get(page_name, 0) + views
+
+    def merge(self, other):
+        """
+        Args:
+            - Page name to number of views (dict)
+        """
+        for page_name, views in other.items():
+            self.add(page_name, views)
+
+
+def read_csv(lines):
+    """
+    Args:
+        - Lines of the legacy csv (iterable of str)
+    Returns:
+        - Pairs of page name (str) and views (int) (generator)
+    """
+    for row in csv.reader(lines):
+        if len(row) < 2 or not row[0]:
+            continue
+        yield row[0], int(row[1])
+
+
+def write_csv(analytics, out):
+    """
+    Args:
+        - Views by page (dict), text file to write to (IO)
+    """
+    writer = csv.writer(out)
+    for page_name, views in analytics.items():
+        writer.writerow([page_name, views])
+
+
+def read_jsonl(lines):
+    """
+    Args:
+        - Lines of the JSON-lines format (iterable of str)
+    Returns:
+        - Pairs of page name (str) and views (int) (generator)
+    Raises:
+        - ValueError if the header is missing or of a newer version
+    """
+    lines = iter(lines)
+    header = json.loads(next(lines, '{}'))
+    if header.get('format') != FORMAT_NAME:
+        raise ValueError('Not a page analytics file')
+    if header.get('version', 0) > FORMAT_VERSION:
+        raise ValueError(f'Unsupported analytics version {header["version"]}')
+
+    for line in lines:
+        if not line.strip():
+            continue
+        row = json.loads(line)
+        yield row['page'], int(row['views'])
+
+
+def write_jsonl(analytics, out):
+    """
+    Args:
+        - Views by page (dict), text file to write to (IO)
+    """
+    out.write(json.dumps({'format': FORMAT_NAME, 'version': FORMAT_VERSION}))
+    out.write('\n')
+    for page_name, views in analytics.items():
+        out.write(json.dumps({'page': page_name, 'views': views}))
+        out.write('\n')
+
+
+READERS = {CSV: read_csv, JSONL: read_jsonl}
+WRITERS = {CSV: write_csv, JSONL: write_jsonl}
+CONTENT_TYPES = {CSV: 'text/csv', JSONL: 'application/jsonl'}
+
+
+class AnalyticsStore:
+    """
+    Reads and writes the popularity analytics in a bucket.
+
+    The JSON-lines blob is used once it exists, otherwise the legacy csv.
+    migrate() converts the csv in one shot.
+
+    Attributes:
+        bucket: Bucket holding the analytics
+        csv_name: Name of the legacy csv blob (str)
+        jsonl_name: Name of the JSON-lines blob (str)
+    """
+
+    def __init__(self, bucket, csv_name=LEGACY_CSV_BLOB, jsonl_name=JSONL_BLOB):
+        self.bucket = bucket
+        self.csv_name = csv_name
+        self.jsonl_name = jsonl_name
+
+    def load(self):
+        """
+        Returns:
+            - Stored views (PageAnalytics), the blob they were read from
+              and its format (str). The blob is None if nothing is stored.
+        """
+        for name, fmt in ((self.jsonl_name, JSONL), (self.csv_name, CSV)):
+            blob = self.bucket.get_blob(name)
+            if blob is not None:
+                return self._parse(blob, fmt), blob, fmt
+        return PageAnalytics(), None, CSV
+
+    def read(self):
+        """
+        Returns:
+            - Stored views (PageAnalytics)
+        """
+        return self.load()[0]
+
+    def save(self, analytics, blob=None, fmt=CSV):
+        """
+        Writes the analytics, only if the blob they were loaded from
+        is unchanged (raises PreconditionFailed otherwise).\n
+        Args:
+            - Views by page (dict), blob returned by load (or None),
+              format returned by load (str)
+        """
+        if blob is None:
+            blob = self.bucket.blob(self.jsonl_name if fmt ==
+                                    JSONL else self.csv_name)
+        out = io.StringIO()
+        WRITERS[fmt](analytics, out)
+        blob.upload_from_string(out.getvalue(),
+                                content_type=CONTENT_TYPES[fmt],
+                                if_generation_match=blob.generation or 0)
+
+    def migrate(self):
+        """
+        Converts the legacy csv to the JSON-lines format, keeping a copy
+        of the csv under a .bak name. Does nothing if already migrated.\n
+        Returns:
+            - (Boolean) True if a csv was converted
+        """
+        if self.bucket.get_blob(self.jsonl_name) is not None:
+            return False
+        csv_blob = self.bucket.get_blob(self.csv_name)
+        if csv_blob is None:
+            return False
+
+        text = csv_blob.download_as_text(encoding="utf-8")
+        analytics = PageAnalytics(read_csv(io.StringIO(text, newline='')))
+        self.save(analytics, self.bucket.blob(self.jsonl_name), JSONL)
+        self.bucket.blob(f'{self.csv_name}.bak').upload_from_string(
+            text, content_type=CONTENT_TYPES[CSV])
+        # Writers still holding the csv generation now fail their
+        # precondition, retry and pick up the JSON-lines blob.
+        csv_blob.delete()
+        return True
+
+    def _parse(self, blob, fmt):
+        text = blob.download_as_text(encoding="utf-8")
+        analytics = PageAnalytics()
+        for page_name, views in READERS[fmt](io.StringIO(text, newline='')):
+            analytics.add(page_name, views)
+        return analytics
@@ -0,0 +1,74 @@
+from flaskr.analytics import AnalyticsStore, PageAnalytics, JSONL
+from flaskr.analytics import read_csv, write_csv, read_jsonl, write_jsonl
+from flaskr.backend_test import storage_client_mock
+import io
+import pytest
+
+
+@pytest.fixture
+def bucket():
+    test_info = {"Dictionary by Popularity.csv": 'chord,3\r\npitch,1\r\n'}
+    return storage_client_mock(blob_data=test_info).bucket('analytics')
+
+
+def test_csv_round_trip_names_with_commas():
+    analytics = PageAnalytics({'chord': 3, 'major, minor': 2})
+    out = io.StringIO()
+    write_csv(analytics, out)
+    out.seek(0)
+    assert dict(read_csv(out)) == analytics
+
+
+def test_jsonl_round_trip():
+    analytics = PageAnalytics({'chord': 3, 'major, minor': 2})
+    out = io.StringIO()
+    write_jsonl(analytics, out)
+    out.seek(0)
+    assert out.readline() == '{"format": "page-analytics", "version": 1}\n'
+    out.seek(0)
+    assert dict(read_jsonl(out)) == analytics
+
+
+def test_jsonl_newer_version_rejected():
+    lines = ['{"format": "page-analytics", "version": 99}']
+    with pytest.raises(ValueError):
+        list(read_jsonl(lines))
+
+
+def test_page_analytics_merge():
+    analytics = PageAnalytics({'chord': 3})
+    analytics.merge({'chord': 1, 'pitch': 2})
+    assert analytics == {'chord': 4, 'pitch': 2}
+
+
+def test_store_reads_csv(bucket):
+    assert AnalyticsStore(bucket).read() == {'chord': 3, 'pitch': 1}
+
+
+def test_store_missing_blob():
+    bucket = storage_client_mock().bucket('analytics')
+    analytics, blob, fmt = AnalyticsStore(bucket).load()
+    assert analytics == {}
+    assert blob is None
+
+
+def test_migrate(bucket):
+    store = AnalyticsStore(bucket)
+    assert store.migrate()
+
+    analytics, blob, fmt = store.load()
+    assert fmt == JSONL
+    assert analytics == {'chord': 3, 'pitch': 1}
+    assert bucket.get_blob("Dictionary by Popularity.csv") is None
+    assert bucket.get_blob("Dictionary by Popularity.csv.bak") is not None
+    assert not store.migrate()
+
+
+def test_save_after_migrate_writes_jsonl(bucket):
+    store = AnalyticsStore(bucket)
+    store.migrate()
+    analytics, blob, fmt = store.load()
+    analytics.add('scales')
+    store.save(analytics, blob, fmt)
+
+    assert store.read() == {'chord': 3, 'pitch': 1, 'scales': 1}
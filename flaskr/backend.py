@@ -1,59 +1,121 @@
-from google.cloud import storage
-from flask import Flask, render_template, redirect, request, url_for
-from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required
 from datetime import datetime
-#Hasing password
-import bcrypt  #gensalt, hashpw, checkpw
-import base64
-import hashlib
 import os
-# from markdown import markdown
-import markdown
 import re
 # for csv methods
 import csv
 from collections import deque
+import heapq
+import logging
 
 import time
 from datetime import datetime
+from google.api_core.exceptions import NotFound, PreconditionFailed
+from flaskr.page_cache import RenderedPageCache, DEFAULT_MAX_ENTRIES, DEFAULT_MAX_BYTES
+from flaskr.popularity import PopularityCounter, DEFAULT_FLUSH_INTERVAL, DEFAULT_FLUSH_THRESHOLD
+from flaskr.analytics import AnalyticsStore
+from flaskr.catalog import BlobCatalog, DEFAULT_TTL as CATALOG_TTL
+from flaskr.thumbnails import ThumbnailPipeline, derivative_name, DERIVATIVE_PREFIX, THUMB, MEDIUM
+from flaskr.thumbnails import DEFAULT_QUEUE_SIZE as THUMBNAIL_QUEUE_SIZE
+from flaskr.zip_ingest import ingest_zip, DEFAULT_WORKERS as ZIP_WORKERS, DEFAULT_MAX_MEMBERS as ZIP_MAX_MEMBERS
+from flaskr.zip_ingest import DEFAULT_MAX_TOTAL_SIZE as ZIP_MAX_TOTAL_SIZE
+from flaskr.comment_log import CommentLog, CommentCache, DEFAULT_PERIOD as COMMENT_PERIOD, DEFAULT_HOT_LIMIT as COMMENT_HOT_LIMIT
+from flaskr.comment_log import DEFAULT_CACHE_SIZE as COMMENT_CACHE_SIZE, DEFAULT_REFRESH_INTERVAL as COMMENT_REFRESH_INTERVAL
+from flaskr.history import HistoryLog, DEFAULT_FLUSH_INTERVAL as HISTORY_FLUSH_INTERVAL, DEFAULT_FLUSH_THRESHOLD as HISTORY_FLUSH_THRESHOLD
+from flaskr.passwords import PasswordHasher, DEFAULT_ROUNDS as PASSWORD_ROUNDS, DEFAULT_WORKERS as PASSWORD_WORKERS
+from flaskr.throttle import LoginThrottle, DEFAULT_USER_BURST, DEFAULT_USER_RATE, DEFAULT_ADDRESS_BURST, DEFAULT_ADDRESS_RATE
+from flaskr.blobstore import make_store, seed, GCS
+from flaskr.publish import Publisher
+from flaskr.search import PageSearch, DEFAULT_RESULTS as SEARCH_RESULTS
+from flaskr.suggest import PageSuggest, DEFAULT_RESULTS as SUGGEST_RESULTS, DEFAULT_REFRESH_INTERVAL as SUGGEST_REFRESH_INTERVAL
+from flaskr.links import PageLinks, DEFAULT_RELATED, DEFAULT_REFRESH_INTERVAL as LINKS_REFRESH_INTERVAL
+from flaskr.renderer import MarkdownRenderer, DEFAULT_MAX_SECTIONS as RENDER_MAX_SECTIONS
+from flaskr.storage_policy import StoragePolicy, DeadlinePool, DEFAULT_TIMEOUT as STORAGE_TIMEOUT, DEFAULT_RETRY_INITIAL as STORAGE_RETRY_INITIAL, DEFAULT_RETRY_MAXIMUM as STORAGE_RETRY_MAXIMUM, DEFAULT_RETRY_MULTIPLIER as STORAGE_RETRY_MULTIPLIER, DEFAULT_RETRY_TIMEOUT as STORAGE_RETRY_TIMEOUT, DEFAULT_POOL_SIZE as STORAGE_POOL_SIZE
+from flaskr.uploads import spool, LinkScanner, DEFAULT_MAX_UPLOAD_SIZE, DEFAULT_SPOOL_THRESHOLD
 """
 Explanation
 Args:
 Returns:
 """
 
+# Markdown pages kept out of the pages list and the search results
+HIDDEN_PAGES = ["test_model", "TestMeet", "test_url"]
+
 
 class Backend:
     """
     Explain
 
     Attributes:
+        store: Where the buckets are kept, STORAGE_BACKEND picks GCS,
+               the filesystem or memory (see blobstore)
         bucket_content: 
         bucket_users: 
         bucket_images: 
         pages: Set of all pages on necessary pages on wiki
         sub_pages: Set of all sub-pages to pages.html
         all_pages: All valid pages on the wiki (Union of pages and sub_pages)
+        page_cache: LRU cache of rendered sub pages (RenderedPageCache)
+        analytics: Stored popularity analytics (AnalyticsStore)
+        popularity: Buffered page view counter (PopularityCounter)
+        page_catalog: Index of the markdown blobs (BlobCatalog)
+        renderer: Markdown to HTML with sections cached by hash (MarkdownRenderer)
+        publisher: Rendered HTML artifacts of the pages (Publisher)
+        search_index: Full-text index of the pages (PageSearch)
+        page_suggest: Prefix index of page names and headings (PageSuggest)
+        page_links: Links between pages, both ways (PageLinks)
+        image_catalog: Index of the image blobs (BlobCatalog)
+        thumbnails: Background thumbnail generation (ThumbnailPipeline)
+        upload_pool: Bounded pool uploading the files of a .zip (DeadlinePool)
+        comment_pool: Bounded pool downloading comment bodies (DeadlinePool)
+        comment_log: Hot and compacted comment segments (CommentLog)
+        comment_cache: Newest comments, written through on upload (CommentCache)
+        upload_max_size: Largest file accepted by upload, in bytes (int)
+        upload_spool_threshold: Bytes of an upload kept in memory (int)
+        history: Per-user history segments, written in batches (HistoryLog)
+        passwords: bcrypt hashing on a process pool (PasswordHasher)
+        login_throttle: Token buckets limiting sign in and sign up attempts (LoginThrottle)
     """
 
-    def __init__(self, app, SC=storage.Client()):
+    def __init__(self, app, SC=None):
         """
         Args: 
-            An App from flask (ex. Flask(__name__) )
+            An App from flask (ex. Flask(__name__) ),
+            the storage client used when STORAGE_BACKEND is 'gcs',
+            made on first use if None
         Explain: 
-            Initializes and creates necessary attributes for backend
+            Initializes and creates necessary attributes for backend.
+            Nothing is read from storage and no client is made here,
+            so the app starts without waiting on GCS.
         """
-        test_app = Flask(__name__)
-        self.login_manager = LoginManager()
-        self.login_manager.init_app(test_app)
+        config = getattr(app, 'config', {})
         #Buckets
-        storage_client = SC
-        self.bucket_content = storage_client.bucket('minorbugs_content')
-        self.bucket_users = storage_client.bucket('minorbugs_users')
-        self.bucket_images = storage_client.bucket('minorbugs_images')
-        self.bucket_page_stats = storage_client.bucket('minorbugs_page_analytics')
-        self.bucket_users.bucket_history = storage_client.bucket('user_history')        
-        self.bucket_messages = storage_client.bucket('minorbugs_comments')
+        self.store = make_store(
+            config.get('STORAGE_BACKEND', GCS),
+            client=SC,
+            root=config.get(
+                'STORAGE_ROOT',
+                os.path.join(getattr(app, 'instance_path', '.'), 'blobstore')),
+            latency=config.get('STORAGE_LATENCY', None),
+            base_url=config.get('STORAGE_PUBLIC_URL', None),
+            policy=StoragePolicy(
+                timeout=config.get('STORAGE_TIMEOUT', STORAGE_TIMEOUT),
+                retry_initial=config.get('STORAGE_RETRY_INITIAL',
+                                         STORAGE_RETRY_INITIAL),
+                retry_maximum=config.get('STORAGE_RETRY_MAXIMUM',
+                                         STORAGE_RETRY_MAXIMUM),
+                retry_multiplier=config.get('STORAGE_RETRY_MULTIPLIER',
+                                            STORAGE_RETRY_MULTIPLIER),
+                retry_timeout=config.get('STORAGE_RETRY_TIMEOUT',
+                                         STORAGE_RETRY_TIMEOUT)),
+            pool_size=config.get('STORAGE_POOL_SIZE', STORAGE_POOL_SIZE))
+        self.bucket_content = self.store.bucket('minorbugs_content')
+        self.bucket_users = self.store.bucket('minorbugs_users')
+        self.bucket_images = self.store.bucket('minorbugs_images')
+        self.bucket_page_stats = self.store.bucket('minorbugs_page_analytics')
+        self.bucket_history = self.store.bucket('user_history')
+        self.bucket_messages = self.store.bucket('minorbugs_comments')
+        if config.get('STORAGE_SEED_DIR'):
+            seed(self.bucket_content, config['STORAGE_SEED_DIR'])
         #page urls
         self.pages = {
             '/', 'pages', 'about', 'welcome', 'login', 'logout', 'upload',
@@ -64,72 +126,143 @@ class Backend:
             'form', 'dynamics', 'texture'
         }
         self.all_pages = self.pages | self.sub_pages
-        self.current_username = ""
 
-    def get_history(self):
+        self.page_cache = RenderedPageCache(
+            max_entries=config.get('PAGE_CACHE_MAX_ENTRIES', DEFAULT_MAX_ENTRIES),
+            max_bytes=config.get('PAGE_CACHE_MAX_BYTES', DEFAULT_MAX_BYTES),
+            ttl=config.get('PAGE_CACHE_TTL', None))
+        self.analytics = AnalyticsStore(self.bucket_page_stats)
+        self.popularity = PopularityCounter(
+            self.analytics,
+            flush_interval=config.get('POPULARITY_FLUSH_INTERVAL',
+                                      DEFAULT_FLUSH_INTERVAL),
+            flush_threshold=config.get('POPULARITY_FLUSH_THRESHOLD',
+                                       DEFAULT_FLUSH_THRESHOLD))
+        self.page_catalog = BlobCatalog(
+            self.bucket_content,
+            ttl=config.get('PAGE_CATALOG_TTL', CATALOG_TTL),
+            include=lambda name: name.split('.')[-1] == 'md')
+        self.renderer = MarkdownRenderer(max_sections=config.get(
+            'RENDER_MAX_SECTIONS', RENDER_MAX_SECTIONS))
+        self.publisher = Publisher(self.bucket_content,
+                                   render=self.renderer.render)
+        self.search_index = PageSearch(self.bucket_content,
+                                       self.page_catalog,
+                                       hidden=HIDDEN_PAGES)
+        self.page_suggest = PageSuggest(
+            self.search_index,
+            self.popularity,
+            refresh_interval=config.get('SUGGEST_REFRESH_INTERVAL',
+                                        SUGGEST_REFRESH_INTERVAL))
+        self.page_links = PageLinks(
+            self.search_index,
+            known=self.pages | set(HIDDEN_PAGES),
+            refresh_interval=config.get('LINKS_REFRESH_INTERVAL',
+                                        LINKS_REFRESH_INTERVAL))
+        self.image_catalog = BlobCatalog(
+            self.bucket_images, ttl=config.get('IMAGE_CATALOG_TTL', CATALOG_TTL))
+        self.thumbnails = ThumbnailPipeline(
+            self.bucket_images,
+            self.image_catalog,
+            queue_size=config.get('THUMBNAIL_QUEUE_SIZE', THUMBNAIL_QUEUE_SIZE))
+        zip_workers = config.get('ZIP_UPLOAD_WORKERS', ZIP_WORKERS)
+        self.upload_pool = DeadlinePool(max_workers=zip_workers,
+                                        thread_name_prefix='zip-upload')
+        self.zip_max_in_flight = config.get('ZIP_MAX_IN_FLIGHT',
+                                            zip_workers * 2)
+        self.zip_max_members = config.get('ZIP_MAX_MEMBERS', ZIP_MAX_MEMBERS)
+        self.zip_max_total_size = config.get('ZIP_MAX_TOTAL_SIZE',
+                                             ZIP_MAX_TOTAL_SIZE)
+        self.comment_pool = DeadlinePool(
+            max_workers=config.get('COMMENT_FETCH_WORKERS', 8),
+            thread_name_prefix='comment-fetch')
+        self.comment_log = CommentLog(
+            self.bucket_messages,
+            self.comment_pool,
+            period=config.get('COMMENT_SEGMENT_PERIOD', COMMENT_PERIOD),
+            hot_limit=config.get('COMMENT_HOT_LIMIT', COMMENT_HOT_LIMIT))
+        self.comment_cache = CommentCache(
+            self.comment_log,
+            capacity=config.get('COMMENT_CACHE_SIZE', COMMENT_CACHE_SIZE),
+            refresh_interval=config.get('COMMENT_REFRESH_INTERVAL',
+                                        COMMENT_REFRESH_INTERVAL))
+        self.upload_max_size = config.get('UPLOAD_MAX_SIZE',
+                                          DEFAULT_MAX_UPLOAD_SIZE)
+        self.upload_spool_threshold = config.get('UPLOAD_SPOOL_THRESHOLD',
+                                                 DEFAULT_SPOOL_THRESHOLD)
+        self.history = HistoryLog(
+            self.bucket_history,
+            flush_interval=config.get('HISTORY_FLUSH_INTERVAL',
+                                      HISTORY_FLUSH_INTERVAL),
+            flush_threshold=config.get('HISTORY_FLUSH_THRESHOLD',
+                                       HISTORY_FLUSH_THRESHOLD))
+        self.passwords = PasswordHasher(
+            rounds=config.get('PASSWORD_ROUNDS', PASSWORD_ROUNDS),
+            workers=config.get('PASSWORD_HASH_WORKERS', PASSWORD_WORKERS),
+            max_concurrent=config.get('PASSWORD_MAX_CONCURRENT', None))
+        self.login_throttle = LoginThrottle(
+            store=config.get('LOGIN_THROTTLE_STORE', None),
+            user_burst=config.get('LOGIN_USER_BURST', DEFAULT_USER_BURST),
+            user_rate=config.get('LOGIN_USER_RATE', DEFAULT_USER_RATE),
+            address_burst=config.get('LOGIN_ADDRESS_BURST',
+                                     DEFAULT_ADDRESS_BURST),
+            address_rate=config.get('LOGIN_ADDRESS_RATE',
+                                    DEFAULT_ADDRESS_RATE))
+
+    def get_history(self, username, limit=None, before=None, since=None):
         """
         Args: 
-            Nothing
+            The user's username (str),
+            most events (int or None), only events older than this
+            timestamp (float or None), only events at or after this
+            timestamp (float or None)
         Explain:
-            gets the user's history from bucket_users
+            gets the newest of the user's history from the history log,
+            reading only the segments in the requested range
         Returns:
-            list of the user's pages and times
-        """
-        user_blob = self.bucket_users.blob(f'{self.current_username}')
-        content = user_blob.download_as_string().decode('utf-8').split('\n')[2]
-        content = content.replace('\'', '')
-        content = content.strip('][\'').split(', ')
-        if content[0] == "":
-            return content[1:]
-        return content
+            list of the user's events, newest first (List of HistoryEvent)
+        """
+        return self.history.page(username, limit, before, since)
     
-    def add_to_history(self, page_name):
+    def add_to_history(self, username, page_name):
         """
         Args: 
-            name of a page (str)
+            the user's username (str), name of a page (str)
         Explain:
-            add the page name and time to the user's bucket
+            add the page name and time to the user's history log,
+            written in batches by HistoryLog
         Returns:
             nothing
         """
-        user_blob = self.bucket_users.blob(f'{self.current_username}')
-        content = user_blob.download_as_string().decode('utf-8').split('\n')
-        
-        name = content[0]
-        hash_pass = content[1][2:-1].encode('utf-8')
-
-        raw_log = content[2]
-        raw_log = raw_log.replace('[', '')
-        raw_log = raw_log.replace(']', '')
-        raw_log = raw_log.replace('\'', '')
-        raw_log = raw_log.split(', ')
+        self.history.append(username, page_name)
 
-        history = raw_log
-        
-        now = datetime.now()
-        timestamp = now.strftime("%b-%d-%Y %H:%M:%S")
-        history.append(page_name)
-        history.append(timestamp)
+    def end_session(self, username):
+        """
+        Args: 
+            the user's username (str)
+        Explain:
+            records that the user logged out and writes their
+            pending history
+        Returns:
+            nothing
+        """
+        self.history.append(username, "Logged Out")
+        self.history.flush(username)
 
-        user_blob.upload_from_string(f"{name}\n{hash_pass}\n{history}")
-    
     def get_all_page_names(self):
         """
         Args: 
             Nothing
         Explain:
-            Gets all markdown sub-pages from google cloud buckets
+            Gets all markdown sub-pages from google cloud buckets,
+            through page_catalog so the bucket is only listed once per ttl
         Returns:
             List of sub-page names (List)
         """
-        all_blobs = list(self.bucket_content.list_blobs())
-        #Could add a feature where users upload their own content??
-        
         page_names = []
-        blocklist=["test_model","TestMeet","test_url"]
-        for blob in all_blobs:
-            name = blob.name.split('.')
-            if name[0] not in blocklist and name[-1] == 'md':
+        for blob_name in self.page_catalog.entries():
+            name = blob_name.split('.')
+            if name[0] not in HIDDEN_PAGES:
                 page_names.append(name[0])
                 
         page_names.sort()
@@ -137,196 +270,267 @@ class Backend:
         
     def make_popularity_list(self):
         """
-        Creates matrix of page names and 
-        number times each page was visited.
+        Reads the number of times each page was visited.
         Args:
             - None
         Returns:
-            - Matrix made of str and int 
-        """
-        bucket = self.bucket_page_stats
-        blob = bucket.get_blob("Dictionary by Popularity.csv")
-        downloaded_file = blob.download_as_text(encoding="utf-8")
-        page_data_list = list(downloaded_file)
-        data = []
-        string = ""
-        for index ,character in enumerate(page_data_list):
-            if (character == "," or character == "\r" or character == page_data_list[-1] ) and character != "\n":
-                print(str(page_data_list[-1]))
-                if character == page_data_list[-1]:
-                    string = string + character
-                data.append(string)
-                string = ""
-            elif character != "\n" and character != "\r":
-                string = string+character
-        temp = []
-        true_data = []
-        
-        for index , pairs in enumerate (data):
-            temp.append(pairs)            
-            
-            if index%2 == 1:
-                temp[1] = int(temp[1])
-                
-                true_data.append(temp.copy())
-                temp.clear()
-        
-        return true_data
+            - Views by page name (PageAnalytics)
+        """
+        return self.analytics.read()
         
-    def page_sort_by_popularity(self):
+    def page_sort_by_popularity(self, limit=None):
         """
-        Gets the list of the pages and how often they've been looked at unorganized
-        organizes them by popularity greatest to least \n
+        Ranks pages by how often they've been looked at, greatest to least,
+        breaking ties alphabetically. Pages never viewed count as 0.
+        Only reads the analytics, reconciling them is modify_page_analytics.\n
         Args: 
-            N/A
+            - Number of pages to return, all if None (int)
         Returns:
             list of pages(str) without number ranking (list)
         """
-        self.modify_page_analytics()
-        p_list=self.make_popularity_list()
+        views = dict.fromkeys(self.get_all_page_names(), 0)
+        views.update(self.popularity.counts())
 
+        def rank(page_name):
+            return (-views[page_name], page_name)
+
+        if limit is not None:
+            return heapq.nsmallest(limit, views, key=rank)
+        return sorted(views, key=rank)
 
-        
-        for next_pop in range(0, len(p_list)-1, 1):
-            highest = p_list[next_pop][1]
-            h_index = next_pop
-            for find_highest in range(next_pop, len(p_list), 1):
-                if p_list[find_highest][1] > highest:
-                    highest = p_list[find_highest][1]
-                    h_index = find_highest
-            p_list[next_pop], p_list[h_index] = p_list[h_index], p_list[next_pop]
-        
-        for page in range(len(p_list)):
-            p_list[page] = p_list[page][0]
-        
-        return p_list
-        
     def get_wiki_page(self, page_name):
         """
         Increments popularity value of sub page
-        and converts a markdown file to HTML.\n       
+        and converts a markdown file to HTML.
+        Views are buffered in popularity and written in batches.
+        Rendered HTML is served from page_cache while the
+        markdown blob's generation is unchanged, else from the
+        page's published artifact, rendering only if it is
+        missing or stale.\n
         Args: 
             - Sub page name (Str)
         Returns:
             - HTML content (str)
         """
-        ### Transfered from pages.py ###
-        bucket = self.bucket_page_stats
-        blob = bucket.get_blob("Dictionary by Popularity.csv")        
-        data = self.make_popularity_list()
-        string = ""
+        html_content = self.page_cache.fresh(page_name)
+        if html_content is not None:
+            self.popularity.increment(page_name)
+            return html_content
+
+        # get_blob only fetches metadata, the content is downloaded on a miss
+        md_blob = self.bucket_content.get_blob(f'{page_name}.md')
+        if md_blob is None:
+            raise NotFound(f'{page_name}.md')
+
+        html_content = self.page_cache.get(page_name, md_blob.generation)
+        if html_content is None:
+            html_content = self.publisher.html(page_name, md_blob)
+            self.page_cache.put(page_name, md_blob.generation, html_content)
+
+        self.popularity.increment(page_name)
+        return html_content
+    
+    def search(self, query, limit=SEARCH_RESULTS):
+        """
+        Finds the pages best matching a query, from the in-memory
+        search_index.\n
+        Args:
+            - Words to look for (str), most results (int)
+        Returns:
+            - Best matching pages first, with a highlighted snippet
+              (List of SearchResult)
+        """
+        return self.search_index.search(query, limit)
 
-        for index, pairs in enumerate(data):
-            if pairs[0] == page_name:
-                pairs[1] += 1
+    def suggest(self, prefix, limit=SUGGEST_RESULTS):
+        """
+        Page names and headings with a word starting with what is being
+        typed, from the in-memory page_suggest.\n
+        Args:
+            - What has been typed (str), most suggestions (int)
+        Returns:
+            - Most viewed pages first (List of Suggestion)
+        """
+        return self.page_suggest.suggest(prefix, limit)
 
-        string = ""
-        for index in data:
-            string = string + index[0] + "," + str(index[1]) + "\r\n"
-        
-        blob.upload_from_string(string)
+    def get_page_links(self, page_name, limit=DEFAULT_RELATED):
+        """
+        Links of a sub page from the in-memory page_links, without
+        reading storage. Empty if the link graph fails, so the page is
+        still shown.\n
+        Args:
+            - Sub page name (str), most related pages (int)
+        Returns:
+            - Pages linking to it (List) and pages linked with it,
+              directly or through the same pages, most related first (List)
+        """
+        try:
+            return self.page_links.links(page_name, limit)
+        except Exception:
+            logging.exception('Could not read the links of %s', page_name)
+            return [], []
 
-        md_blob = self.bucket_content.blob(f'{page_name}.md')
-        md_content = md_blob.download_as_string().decode('utf-8')
-        html_content = markdown.markdown(md_content)
+    def broken_links(self):
+        """
+        Finds the links of every page that point at no page, from the
+        link graph, without downloading the pages.\n
+        Returns:
+            - Page name to the missing pages it links to (Dict)
+        """
+        return self.page_links.broken()
 
-        return html_content
-    
     def modify_page_analytics(self):
-        """This check if a subpage analytics doesnt exist inside in the csv 
-        and defult the ammount of times that the page was viewed to 0\n
+        """This check if a subpage analytics doesnt exist inside the analytics 
+        and defult the ammount of times that the page was viewed to 0.
+        Maintenance step, run with `flask reconcile-analytics`.\n
         Args:
             - None
         Returns:
-            - str (Only used in testing)
-        """
-        all_pages = self.get_all_page_names()
-        bucket = self.bucket_page_stats
-        blob = bucket.get_blob("Dictionary by Popularity.csv")
-        csv_list = self.make_popularity_list()
-        names = []
-        string = ""
-        for x in csv_list:
-            string = string+x[0] + "," + str(x[1]) + "\r\n"
-            names.append(x[0])
-
-        for sub_page in all_pages:
-            if sub_page not in names:
-                names.append(sub_page)
-                string = string + sub_page + "," + str(0) + "\r\n"
-            
-        blob.upload_from_string(string)
-            
-        csv_files = list(self.bucket_page_stats.list_blobs())
-        return string
+            - Views by page name (PageAnalytics)
+        """
+        analytics, blob, fmt = self.analytics.load()
+        for sub_page in self.get_all_page_names():
+            analytics.setdefault(sub_page, 0)
+
+        self.analytics.save(analytics, blob, fmt)
+        return analytics
 
     def get_comments(self):
         """
         Args: self
         Explain: Gets all the comments stored in the Google Cloud buckets and returns
-        them as a list of dictionaries containing all the comment info.
+        them as a list of dictionaries containing all the comment info, newest first.
         Returns: List of dictionaries representing the comments.
         """
-        blobs = list(self.bucket_messages.list_blobs())
-        comments_lst = []
-        for blob in blobs:
-            metadata = blob.name.split(":")
-            timestamp = str(datetime.fromtimestamp(float(metadata[0])))[0:-10]
-            user = metadata[1]
-            comments_dict = {
-                "user": user,
-                "time": timestamp,
-                "content": blob.download_as_string().decode('utf-8')
-            }
-            comments_lst.append(comments_dict)
-        return comments_lst
+        return self.get_comment_page()[0]
+
+    def get_comment_page(self, limit=None, before=None):
+        """
+        Args:
+        limit: Most comments to return, every comment if None.
+        before: Timestamp (float or str) of the last comment on the previous page, only older comments are returned.
+        Explain: Reads one page of comments, newest first, from comment_cache, or from comment_log
+        when the page is older than the cached comments. Only the hot comments on that page and the
+        compacted segments that can hold it are downloaded.
+        Returns:
+        List of dictionaries representing the comments and the before value of the next page (None on the last page).
+        """
+        comments, next_before = self.comment_cache.page(limit, before)
+        return [self._comment_dict(comment) for comment in comments], next_before
+
+    def _comment_dict(self, comment):
+        timestamp = str(datetime.fromtimestamp(float(comment.timestamp)))[0:-10]
+        comments_dict = {
+            "user": comment.user,
+            "time": timestamp,
+            "content": comment.content
+        }
+        return comments_dict
 
     def upload_comment(self, username, content):
         """
         Args:
         username: String representation of the logged in username.
         content: String representation of the comment typed out by the user in the comment text input.
-        Explain: Receives a username and the comment content and formats the blob name as timestamp:username and then the contents of that blob
-        is the message. It is then uploaded to the Google Cloud Buckets and then served with all the other comments.
+        Explain: Receives a username and the comment content and writes it to the hot segment of comment_log
+        as a blob named timestamp:username containing the message, only if no such blob exists yet.
+        On success it is added to comment_cache and served with all the other comments.
         Returns: 
         Boolean representing if the upload was successful or not.
         """
         if not content:
             return False
-        timestamp = str(time.time())
-        filename = timestamp + ":" + username
-        message_blob = self.bucket_messages.blob(filename)
-        if message_blob.exists():
+        comment = self.comment_log.append(username, content)
+        if comment is None:
             return False
-        message_blob.upload_from_string(content)
+        self.comment_cache.add(comment)
         return True
 
     def upload(self, content, filename):
         """
         Uploads a .md, .jpg, .jpeg or .png,
-        to a google cloud bucket (Content or Images)\n
+        to a google cloud bucket (Content or Images).
+        The file is read once: it is spooled (to disk past
+        upload_spool_threshold), hashed and link checked on the way in,
+        then uploaded from the spool. A .md must be UTF-8, and is
+        published to HTML and indexed for search right away, which is
+        retried later if it fails.\n
         Args: 
             - Contents of a file (IO), the filename (Str)
         Returns: 
             - (Boolean)
+        Raises:
+            - UploadTooLarge if the file is over upload_max_size
         """
         file_end = filename.split(".")[-1].lower()
 
         if file_end == "md":
-            if not self.url_check(content, filename):
-                return False
-            content.seek(0)
-            blob = self.bucket_content.blob(os.path.basename(filename))
-
+            bucket = self.bucket_content
         elif file_end == "jpeg" or file_end == "jpg" or file_end == "png":
-            blob = self.bucket_images.blob(os.path.basename(filename))
-
+            bucket = self.bucket_images
         else:
             return False
 
-        blob.upload_from_file(content)
+        spooled = spool(content,
+                        max_size=self.upload_max_size,
+                        threshold=self.upload_spool_threshold,
+                        scan_links=file_end == "md")
+        if file_end == "md":
+            if not self._links_valid(spooled.links):
+                return False
+            # Pages are read back as UTF-8, so others are refused unwritten
+            try:
+                md_content = spooled.read().decode('utf-8')
+            except UnicodeDecodeError:
+                return False
+            spooled.seek(0)
+
+        blob = bucket.blob(os.path.basename(filename))
+        blob.metadata = {'sha256': spooled.sha256}
+        blob.upload_from_file(spooled, size=spooled.size)
+        if file_end == "md":
+            # The page is saved: the steps below must not fail the upload
+            page_name = os.path.basename(filename)[:-3]
+            self.page_catalog.record(blob)
+            try:
+                html_content = self.publisher.publish(page_name, md_content,
+                                                      blob)
+                self.page_cache.put(page_name, blob.generation, html_content)
+            except Exception:
+                # Published again the first time the page is viewed
+                logging.exception('Could not publish %s', page_name)
+            try:
+                self.search_index.update(page_name, md_content,
+                                         blob.generation)
+            except Exception:
+                # Indexed again by the next search that syncs
+                logging.exception('Could not index %s', page_name)
+            self.page_links.update(page_name, md_content)
+            self.page_suggest.refresh_in_background()
+        else:
+            self.image_catalog.record(blob)
+            self.thumbnails.submit(blob.name)
         return True
 
+    def upload_zip(self, zip_file):
+        """
+        Uploads the .jpg, .jpeg and .png files inside a .zip archive,
+        in parallel on upload_pool.\n
+        Args: 
+            - Contents of a .zip file (IO)
+        Returns: 
+            - One ZipResult (name, status) per file in the archive (List)
+        Raises:
+            - ZipLimitError if the archive is over the limits,
+              zipfile.BadZipFile if it is not a .zip
+        """
+        return ingest_zip(zip_file,
+                          self.upload,
+                          self.upload_pool,
+                          max_members=self.zip_max_members,
+                          max_total_size=self.zip_max_total_size,
+                          max_in_flight=self.zip_max_in_flight)
+
     def url_check(self, file_content, filename):
         """
         Checks if a .md file has valid links to the site\n
@@ -335,10 +539,13 @@ class Backend:
         Returns: 
             - (Boolean)
         """
-        content = str(file_content.read())
-        check_urls = re.findall(r'\[(.*?)\]\((.*?)\)', content)
+        scanner = LinkScanner()
+        for chunk in iter(lambda: file_content.read(64 * 1024), b''):
+            scanner.feed(chunk)
+        return self._links_valid(scanner.close())
 
-        for url in check_urls:
+    def _links_valid(self, links):
+        for url in links:
             if url[1][1:] in self.all_pages:
                 pass
             elif url[1][2:] in self.all_pages:
@@ -350,53 +557,67 @@ class Backend:
     def get_image(self):
         """
         Args: Nothing
-        Explain: Retrieves image urls from google cloud 
-                 buckets (Content and Images), excluding authors.
-        Returns: List of image urls (List)
-        """
-        #storage_client = storage.Client()
-        #bucket = self.bucket_content
-        blobs = list(self.bucket_content.list_blobs())
-        blobs = list(self.bucket_images.list_blobs())
+        Explain: Retrieves image urls from image_catalog, the cached
+                 index of the images bucket, excluding authors.
+                 Thumbnails are shown when they have been made.
+        Returns: List of (thumbnail url, image url) (List)
+        """
+        entries = self.image_catalog.entries()
         images_lst = []
-
-        for blob in blobs:
-            if blob.name.startswith("[Author]"):
+        for entry in entries.values():
+            if (entry.name.startswith("[Author]") or
+                    entry.name.startswith(DERIVATIVE_PREFIX)):
                 continue
-            blob_img = blob.public_url
-            images_lst.append(blob_img)
+            thumb = entries.get(derivative_name(THUMB, entry.name), entry)
+            images_lst.append((thumb.public_url, entry.public_url))
 
-        images_lst.sort()
+        images_lst.sort(key=lambda image: image[1])
         return images_lst
 
+    def get_image_page(self, page=1, per_page=24):
+        """
+        Args: Page number starting at 1 (int), images per page (int)
+        Explain: One page of get_image, served from image_catalog.
+        Returns: List of (thumbnail url, image url) (List), number of pages (int)
+        """
+        images_lst = self.get_image()
+        page_count = max(1, -(-len(images_lst) // per_page))
+        start = (page - 1) * per_page
+        return images_lst[start:start + per_page], page_count
+
     def get_about(self):
         """
         Args: Nothing
-        Explain: Retrieves image urls from google cloud 
-                 buckets (Images), only authors.
+        Explain: Retrieves image urls from image_catalog, the cached
+                 index of the images bucket, only authors. The medium
+                 size copy is shown when it has been made.
         Returns: List of image urls and author names (List)
         """
-        storage_client = storage.Client()
-        blobs = list(self.bucket_images.list_blobs())
+        entries = self.image_catalog.entries()
         images_lst = []
-        for blob in blobs:
-            if blob.name.startswith("[Author]"):
-                blob_img = blob.public_url
-                name = blob.name.split(",")[1]
-                images_lst.append((blob_img, name))
+        for entry in entries.values():
+            if entry.name.startswith("[Author]"):
+                medium = entries.get(derivative_name(MEDIUM, entry.name), entry)
+                name = entry.name.split(",")[1]
+                images_lst.append((medium.public_url, name))
             else:
                 continue
 
         images_lst.sort()
         return images_lst
 
-    def sign_up(self, user_info):
+    def sign_up(self, user_info, address=None):
         """
-        Args: A users info (Dict(name, username, password))
+        Args: A users info (Dict(name, username, password)),
+              the client's address (str or None)
         Explain: Adds user to GCB (users), if they dont 
                  already exist and allows login.
+                 The password is hashed on the passwords pool.
         Returns: (Boolean), A user's name or empty (str)
+        Raises: Throttled if there were too many attempts,
+                HasherBusy if too many passwords are being hashed
         """
+        self.login_throttle.check(user_info['username'], address)
         user_name = user_info['username'].lower()
         user_blob = self.bucket_users.blob(f'{user_name}')
 
@@ -406,27 +627,26 @@ class Backend:
         user_pass = user_info['password']
         name = user_info['name']
 
-        now = datetime.now()
-        timestamp = now.strftime("%b-%d-%Y %H:%M:%S")
-        history = ["Account Began", timestamp]
-
+        hash_pass = self.passwords.hash(user_pass, user_name)
 
-        mixed = f'{user_pass}hi{user_name}'
-        encoded = base64.b64encode(hashlib.sha256(mixed.encode()).digest())
-        salt = bcrypt.gensalt()
-        hash_pass = bcrypt.hashpw(encoded, salt)
-
-        user_blob.upload_from_string(f"{name}\n{hash_pass}\n{history}")
-        self.current_username = user_name
+        # The only write of the credentials, history goes to the history log
+        user_blob.upload_from_string(f"{name}\n{hash_pass}")
+        self.history.append(user_name, "Account Began")
         return True, name
 
-    def sign_in(self, user_check):
+    def sign_in(self, user_check, address=None):
         """
-        Args: Users sign-in info ( Dict(username, password) )
+        Args: Users sign-in info ( Dict(username, password) ),
+              the client's address (str or None)
         Explain: Checks if an existing user entered the correct 
                  credentials and allows for login.
+                 The password is checked on the passwords pool and the
+                 stored hash is remade if its cost isn't PASSWORD_ROUNDS.
         Returns: (Boolean), A user's name or empty (str)
+        Raises: Throttled if there were too many attempts,
+                HasherBusy if too many passwords are being checked
         """
+        self.login_throttle.check(user_check['username'], address)
         user_name = user_check['username'].lower()
         user_blob = self.bucket_users.blob(f'{user_name}')
 
@@ -436,34 +656,54 @@ class Backend:
         content = user_blob.download_as_string().decode('utf-8').split('\n')
         name = content[0]
         hash_pass = content[1][2:-1].encode('utf-8')
-        
-        if len(content) == 2:
-            content.append("")
-
-        raw_log = content[2]
-        raw_log = raw_log.replace('[', '')
-        raw_log = raw_log.replace(']', '')
-        raw_log = raw_log.replace('\'', '')
-        raw_log = raw_log.split(', ')
-
-        history = raw_log
-        
-        now = datetime.now()
-        timestamp = now.strftime("%b-%d-%Y %H:%M:%S")
-        history.append("Logged In")
-        history.append(timestamp)
 
         user_pass = user_check['password']
-        mixed = f'{user_pass}hi{user_name}'
-        encoded = base64.b64encode(hashlib.sha256(mixed.encode()).digest())
-
-        if not bcrypt.checkpw(encoded, hash_pass):
+        valid, new_hash = self.passwords.verify(user_pass, user_name, hash_pass)
+        if not valid:
             return False, ''
 
-        user_blob.upload_from_string(f"{name}\n{hash_pass}\n{history}")
-        self.current_username = user_name
+        # Lines after the hash still to keep in the blob
+        legacy = content[2:]
+        if legacy:
+            # Retried on the next login, it must never fail this one
+            try:
+                self.migrate_history(user_blob, content)
+                legacy = []
+            except Exception:
+                logging.exception('Could not migrate the history of %s',
+                                  user_name)
+        if new_hash is not None:
+            try:
+                user_blob.upload_from_string(
+                    "\n".join([name, f"{new_hash}"] + legacy),
+                    if_generation_match=user_blob.generation)
+            except PreconditionFailed:
+                pass
+        self.history.append(user_name, "Logged In")
 
         return True, name
 
+    def migrate_history(self, user_blob, content=None):
+        """
+        Args: A user's blob in bucket_users, its lines if already read (List)
+        Explain: Moves history that older accounts keep as a third line of
+                 their user blob into the history log, then rewrites the
+                 blob with only the name and password hash. The rewrite is
+                 skipped if the blob changed since it was read.
+        Returns: Number of events moved (int)
+        """
+        if content is None:
+            content = user_blob.download_as_string().decode('utf-8').split('\n')
+        if len(content) < 3:
+            return 0
+        moved = self.history.migrate(user_blob.name, content[2])
+        try:
+            user_blob.upload_from_string(
+                f"{content[0]}\n{content[1]}",
+                if_generation_match=user_blob.generation)
+        except PreconditionFailed:
+            pass
+        return moved
+
     def get_log(self):
         pass
\ No newline at end of file
@@ -1,6 +1,13 @@
 from flaskr.backend import Backend
 from unittest.mock import MagicMock, patch
+from google.api_core.exceptions import PreconditionFailed, ServiceUnavailable
 import pytest
+import io
+import os
+import threading
+import hashlib
+from flaskr.uploads import UploadTooLarge
+from flaskr.throttle import Throttled
 
 
 class storage_client_mock:
@@ -38,10 +45,28 @@ class bucket_object:
         self.blobz = dict()
 
         for name in data:
-            self.blobz[name] = blob_object(name)
-
-    def list_blobs(self):
-        return list(self.blobz.values())
+            self.blobz[name] = blob_object(name, listed=True)
+
+    def list_blobs(self,
+                   prefix=None,
+                   delimiter=None,
+                   start_offset=None,
+                   end_offset=None,
+                   **options):
+        blobs = []
+        for name in sorted(self.blobz):
+            blob = self.blobz[name]
+            rest = name[len(prefix or ''):]
+            if not blob.exists() or not name.startswith(prefix or ''):
+                continue
+            if start_offset is not None and name < start_offset:
+                continue
+            if end_offset is not None and name >= end_offset:
+                continue
+            if delimiter and delimiter in rest:
+                continue
+            blobs.append(blob)
+        return blobs
 
     def blob(self, blob_name):
         blob_name = blob_name.lower()
@@ -57,51 +82,95 @@ class bucket_object:
         self.blobz[blob_name] = temp_blob
         return temp_blob
 
-    def get_blob(self, blob_name):
-        return self.blob(blob_name)
+    def get_blob(self, blob_name, **options):
+        blob = self.blob(blob_name)
+        if not blob.exists():
+            return None
+        return blob
 
 
 class blob_object:
 
-    def __init__(self, blob_name, test_data=None):
+    def __init__(self, blob_name, test_data=None, listed=False):
         self.test_data = test_data
         self.name = blob_name
         self.public_url = False
         self.uploaded = None
+        self.listed = listed
+        self.generation = 1 if test_data or listed else None
+        self.size = len(test_data) if test_data else 0
+        self.updated = None
+        self.metadata = None
 
-    def exists(self):
-        if not self.public_url:
-            return False
-        else:
-            return True
+    def exists(self, **options):
+        return bool(self.public_url or self.listed or
+                    self.test_data is not None)
+
+    def delete(self, if_generation_match=None, **options):
+        self.public_url = False
+        self.uploaded = None
+        self.listed = False
+        self.test_data = None
+        self.generation = None
 
     def _set_public_url(self, url_name):
         self.public_url = url_name
 
-    def upload_from_string(self, content):
+    def _check_generation(self, if_generation_match):
+        if (if_generation_match is not None and
+                if_generation_match != (self.generation or 0)):
+            raise PreconditionFailed(self.name)
+
+    def upload_from_string(self,
+                           content,
+                           content_type=None,
+                           if_generation_match=None,
+                           **options):
+        self._check_generation(if_generation_match)
         self.uploaded = True
         self.public_url = 'test/test.com'
         self.string_content = content
-
-    def upload_from_file(self, content):
+        self.generation = (self.generation or 0) + 1
+        self.size = len(content)
+
+    def upload_from_file(self,
+                         content,
+                         size=None,
+                         content_type=None,
+                         if_generation_match=None,
+                         **options):
+        self._check_generation(if_generation_match)
         self.uploaded = True
         self.public_url = 'test/test.com'
         self.file_content = content
+        self.generation = (self.generation or 0) + 1
+        self.size = size
 
-    def download_as_text(self, encoding=None):
+    def download_as_text(self, encoding=None, **options):
         if self.uploaded:
             return self.string_content
         if self.test_data:
             return self.test_data
         return 'This is a test string from download_as_string'
 
-    def download_as_string(self):
+    def download_as_string(self, **options):
         if self.uploaded:
             return self.string_content.encode('utf-8')
         if self.test_data:
             return self.test_data.encode('utf-8')
         return 'This is a test string from download_as_string'.encode('utf-8')
 
+    def download_as_bytes(self, **options):
+        if self.uploaded and hasattr(self, 'string_content'):
+            content = self.string_content
+            return content if type(content) == bytes else content.encode('utf-8')
+        if self.uploaded:
+            return self.file_content.read()
+        return self.download_as_string()
+
+    def patch(self, **options):
+        pass
+
     def download_to_filename(self):
         if self.uploaded:
             return self.file_content
@@ -305,6 +374,22 @@ def test_get_all_comments():
     }
     assert test_dict in comments_dict
 
+def test_get_comment_page():
+    be = Backend('app', SC=storage_client_mock())
+    for timestamp, content in [('1680933371.1', 'one'), ('1680933372.2', 'two'),
+                               ('1680933373.3', 'three')]:
+        be.bucket_messages.blob(f'{timestamp}:sandy').upload_from_string(
+            content)
+
+    first, next_before = be.get_comment_page(limit=2)
+    assert [c['content'] for c in first] == ['three', 'two']
+    assert next_before == '1680933372.2'
+
+    second, next_before = be.get_comment_page(limit=2, before=next_before)
+    assert [c['content'] for c in second] == ['one']
+    assert next_before is None
+
+
 def test_get_all_pages_names():
     be = Backend(app)
     test_string = 'chord'
@@ -360,16 +445,23 @@ def test_get_history(valid_user):
     back_end = Backend('app', SC=storage_client_mock())
     back_end.sign_up(valid_user)
     back_end.sign_in(valid_user)
-    history = back_end.get_history()
-    assert len(history) == 4
+    history = back_end.get_history(valid_user['username'])
+    assert [record.event for record in history] == ['Logged In', 'Account Began']
 
 def test_add_to_history(valid_user, page_name):
     back_end = Backend('app', SC=storage_client_mock())
     back_end.sign_up(valid_user)
     back_end.sign_in(valid_user)
-    back_end.add_to_history(page_name)
-    history = back_end.get_history()
-    assert len(history) == 6
+    back_end.add_to_history(valid_user['username'], page_name)
+    history = back_end.get_history(valid_user['username'])
+    assert len(history) == 3
+    assert history[0].event == page_name
+    assert back_end.get_history(valid_user['username'], limit=1) == history[:1]
+    assert back_end.get_history(valid_user['username'],
+                                before=history[0].timestamp) == [
+        record for record in history[1:]
+        if record.timestamp < history[0].timestamp
+    ]
 #test username:test password:test
 
 ### If using blob_test, follow format ###
@@ -382,7 +474,7 @@ def test_make_popularity_list_other():
     back_end = Backend('app', SC=storage_client_mock(blob_data=test_info))
     
     make_actual = back_end.make_popularity_list()
-    expected = [['hello',4], ['there',3], ['world',1]]
+    expected = {'hello': 4, 'there': 3, 'world': 1}
     
     assert expected == make_actual
 
@@ -395,6 +487,27 @@ def test_page_sort_by_pop():
     expected = ['world', 'there', 'hello']
     assert expected == pop_actual
 
+def test_page_sort_by_pop_read_only():
+    test_info = {"Dictionary by Popularity.csv": 'hello,1\r\nthere,3\r\n'}
+    back_end = Backend('app',
+                       SC=storage_client_mock(blobs=['world.md', 'zed.md'],
+                                              blob_data=test_info))
+    back_end.popularity.increment('world')
+    blob = back_end.bucket_page_stats.get_blob('Dictionary by Popularity.csv')
+
+    with patch.object(blob, 'upload_from_string') as upload:
+        pop_actual = back_end.page_sort_by_popularity()
+    upload.assert_not_called()
+    assert ['there', 'hello', 'world', 'zed'] == pop_actual
+
+
+def test_page_sort_by_pop_limit():
+    test_info = {"Dictionary by Popularity.csv": 'b,2\r\na,2\r\nc,5\r\nd,1\r\n'}
+    back_end = Backend('app', SC=storage_client_mock(blob_data=test_info))
+
+    assert ['c', 'a'] == back_end.page_sort_by_popularity(limit=2)
+
+
 def test_sort_alpha():
     test_info = ['world.md', 'there.md', 'hello.md']
     back_end = Backend('app', SC=storage_client_mock(blobs=test_info))
@@ -410,13 +523,27 @@ def test_modify_page_analytics():
     back_end = Backend('app', SC=storage_client_mock(blob_data=test_info))
     
     modify_actual = back_end.modify_page_analytics()
-    assert 'hello,1\r\nthere,3\r\nworld,2\r\n' == modify_actual
+    assert {'hello': 1, 'there': 3, 'world': 2} == modify_actual
+
+
+def test_modify_page_analytics_adds_missing():
+    test_info = {"Dictionary by Popularity.csv": 'hello,1\r\n'}
+    back_end = Backend('app',
+                       SC=storage_client_mock(blobs=['world.md'],
+                                              blob_data=test_info))
+
+    back_end.modify_page_analytics()
+
+    blob = back_end.bucket_page_stats.get_blob('Dictionary by Popularity.csv')
+    assert 'hello,1\r\nworld,0\r\n' == blob.download_as_text()
 
 def test_pop_increment():
     test_info = {"Dictionary by Popularity.csv": 
-                 'hello,1\n\rthere,3\n\rworld,2\n\r'}
+                 'hello,1\n\rthere,3\n\rworld,2\n\r',
+                 "hello.md": '# Hello'}
     back_end = Backend('app', SC=storage_client_mock(blob_data=test_info))
     back_end.get_wiki_page('hello')
+    back_end.popularity.flush()
 
     blob = back_end.bucket_page_stats.get_blob('Dictionary by Popularity.csv')
     incr_actual = blob.download_as_text()
@@ -424,3 +551,346 @@ def test_pop_increment():
     assert 'hello,2\r\nthere,3\r\nworld,2\r\n' == incr_actual
 
 
+def test_pop_increment_buffered():
+    test_info = {"Dictionary by Popularity.csv": 'hello,1\r\n',
+                 "hello.md": '# Hello'}
+    back_end = Backend('app', SC=storage_client_mock(blob_data=test_info))
+    blob = back_end.bucket_page_stats.get_blob('Dictionary by Popularity.csv')
+
+    with patch.object(blob, 'upload_from_string') as upload:
+        back_end.get_wiki_page('hello')
+        back_end.get_wiki_page('hello')
+    upload.assert_not_called()
+    assert back_end.popularity.pending() == {'hello': 2}
+
+
+
+
+def test_get_wiki_page_cached():
+    test_info = {"Dictionary by Popularity.csv": 'hello,1\n\r',
+                 "hello.md": '# Hello'}
+    back_end = Backend('app', SC=storage_client_mock(blob_data=test_info))
+    md_blob = back_end.bucket_content.blob('hello.md')
+
+    with patch.object(md_blob, 'download_as_string',
+                      wraps=md_blob.download_as_string) as download:
+        first = back_end.get_wiki_page('hello')
+        second = back_end.get_wiki_page('hello')
+
+    assert first == second == '<h1 id="hello">Hello</h1>'
+    assert download.call_count == 1
+    assert back_end.page_cache.stats()['hits'] == 1
+
+
+def test_get_wiki_page_rerenders_new_generation():
+    test_info = {"Dictionary by Popularity.csv": 'hello,1\n\r',
+                 "hello.md": '# Hello'}
+    back_end = Backend('app', SC=storage_client_mock(blob_data=test_info))
+    back_end.get_wiki_page('hello')
+
+    back_end.bucket_content.blob('hello.md').upload_from_string('# Changed')
+
+    assert back_end.get_wiki_page('hello') == '<h1 id="changed">Changed</h1>'
+
+
+def test_upload_md_publishes_html():
+    back_end = Backend('app', SC=storage_client_mock())
+    assert back_end.upload(io.BytesIO(b'# New page'), 'new.md')
+
+    artifact = back_end.bucket_content.blob('rendered/new.html')
+    assert artifact.string_content == '<h1 id="new-page">New page</h1>'
+    assert artifact.metadata['source_sha256'] == hashlib.sha256(
+        b'# New page').hexdigest()
+    with patch.object(back_end.publisher, 'html') as html:
+        assert back_end.get_wiki_page('new') == '<h1 id="new-page">New page</h1>'
+    html.assert_not_called()
+
+
+def test_upload_md_indexes_page():
+    back_end = Backend('app', SC=storage_client_mock(blobs=['world.md']))
+    assert back_end.upload(io.BytesIO(b'# Sonata\nA large form'), 'sonata.md')
+    assert [result.page for result in back_end.search('sonatas')] == ['sonata']
+
+
+def test_get_wiki_page_serves_published_html():
+    app = Flask_mock('app')
+    app.config = {'STORAGE_BACKEND': 'memory'}
+    back_end = Backend(app)
+    source = back_end.bucket_content.blob('hello.md')
+    source.upload_from_string('# Hello')
+    back_end.publisher.publish('hello', '# Hello', source)
+
+    # A fresh cache, as in another worker
+    back_end.page_cache.invalidate()
+    with patch.object(back_end.publisher, 'render') as render:
+        assert back_end.get_wiki_page('hello') == '<h1 id="hello">Hello</h1>'
+    render.assert_not_called()
+
+
+def test_get_all_page_names_cached():
+    back_end = Backend('app',
+                       SC=storage_client_mock(blobs=['world.md', 'hello.md']))
+    with patch.object(back_end.bucket_content,
+                      'list_blobs',
+                      wraps=back_end.bucket_content.list_blobs) as list_blobs:
+        back_end.get_all_page_names()
+        back_end.get_all_page_names()
+    assert list_blobs.call_count == 1
+
+
+def test_upload_md_updates_page_names():
+    back_end = Backend('app', SC=storage_client_mock(blobs=['world.md']))
+    back_end.get_all_page_names()
+    content = io.BytesIO(b'# New page')
+
+    with patch.object(back_end.bucket_content, 'list_blobs') as list_blobs:
+        assert back_end.upload(content, 'new.md')
+        assert ['new', 'world'] == back_end.get_all_page_names()
+    list_blobs.assert_not_called()
+
+
+def test_get_image_page():
+    test_info = ['b.png', 'a.png', 'c.jpg', '[Author],Sandy.jpg']
+    back_end = Backend('app', SC=storage_client_mock(blobs=test_info))
+    for blob in back_end.bucket_images.list_blobs():
+        blob._set_public_url(f'url/{blob.name}')
+
+    with patch.object(back_end.bucket_images,
+                      'list_blobs',
+                      wraps=back_end.bucket_images.list_blobs) as list_blobs:
+        first, page_count = back_end.get_image_page(1, 2)
+        second, page_count = back_end.get_image_page(2, 2)
+    assert first == [('url/a.png', 'url/a.png'), ('url/b.png', 'url/b.png')]
+    assert second == [('url/c.jpg', 'url/c.jpg')]
+    assert page_count == 2
+    assert list_blobs.call_count == 1
+
+
+def test_upload_image_updates_manifest():
+    back_end = Backend('app', SC=storage_client_mock())
+    back_end.get_image()
+    content = io.BytesIO(b'image')
+
+    with patch.object(back_end.thumbnails, 'submit') as submit:
+        assert back_end.upload(content, 'new.png')
+    submit.assert_called_once_with('new.png')
+    assert back_end.get_image() == [('test/test.com', 'test/test.com')]
+
+
+def test_get_image_prefers_thumbnails():
+    test_info = ['a.png', 'derivatives/thumb/a.png', 'derivatives/medium/a.png']
+    back_end = Backend('app', SC=storage_client_mock(blobs=test_info))
+    for blob in back_end.bucket_images.list_blobs():
+        blob._set_public_url(f'url/{blob.name}')
+
+    assert back_end.get_image() == [('url/derivatives/thumb/a.png', 'url/a.png')]
+
+
+def test_upload_md_checks_links_once():
+    back_end = Backend('app', SC=storage_client_mock())
+    content = io.BytesIO(b'See [pitch](/pitch)\nand [nowhere](/nowhere)\n')
+
+    assert not back_end.upload(content, 'bad.md')
+    assert not back_end.bucket_content.blob('bad.md').uploaded
+
+
+def test_upload_records_hash_and_size():
+    back_end = Backend('app', SC=storage_client_mock())
+    data = b'# Page\n[pitch](/pitch)\n'
+
+    assert back_end.upload(io.BytesIO(data), 'page.md')
+    blob = back_end.bucket_content.blob('page.md')
+    assert blob.metadata == {'sha256': hashlib.sha256(data).hexdigest()}
+    assert blob.size == len(data)
+
+
+def test_upload_too_large():
+    back_end = Backend('app', SC=storage_client_mock())
+    back_end.upload_max_size = 4
+
+    with pytest.raises(UploadTooLarge):
+        back_end.upload(io.BytesIO(b'too large'), 'big.png')
+    assert not back_end.bucket_images.blob('big.png').uploaded
+
+
+def test_sign_in_does_not_rewrite_credentials(valid_user):
+    back_end = Backend('app', SC=storage_client_mock())
+    back_end.sign_up(valid_user)
+    user_blob = back_end.bucket_users.blob(valid_user['username'].lower())
+
+    with patch.object(user_blob, 'upload_from_string') as upload:
+        back_end.sign_in(valid_user)
+        back_end.add_to_history(valid_user['username'], 'Home')
+    upload.assert_not_called()
+
+
+def test_migrate_history():
+    test_info = {
+        'sandy': "Sandy\nb'hash'\n['Account Began', 'Apr-01-2023 10:00:00', "
+                 "'Home, again', 'Apr-01-2023 10:05:00']"
+    }
+    back_end = Backend('app', SC=storage_client_mock(blob_data=test_info))
+    user_blob = back_end.bucket_users.blob('sandy')
+
+    assert back_end.migrate_history(user_blob) == 2
+    assert user_blob.download_as_text() == "Sandy\nb'hash'"
+    history = back_end.get_history('sandy')
+    assert [record.event for record in history] == ['Home, again', 'Account Began']
+    assert history[0].time == 'Apr-01-2023 10:05:00'
+    assert back_end.migrate_history(user_blob) == 0
+
+
+def test_rehash_keeps_history_that_failed_to_migrate(valid_user):
+    back_end = Backend('app', SC=storage_client_mock())
+    back_end.passwords.rounds = 4
+    back_end.sign_up(valid_user)
+    user_blob = back_end.bucket_users.blob(valid_user['username'])
+    legacy = "['Old page', 'Apr-01-2023 10:00:00']"
+    user_blob.upload_from_string(f"{user_blob.download_as_text()}\n{legacy}")
+
+    back_end.passwords.rounds = 5
+    with patch.object(back_end.history,
+                      'migrate',
+                      side_effect=ServiceUnavailable('down')):
+        assert back_end.sign_in(valid_user) == (True, "Everett-Alan")
+    lines = user_blob.download_as_text().split('\n')
+    assert "$2b$05$" in lines[1]
+    assert lines[2] == legacy
+
+    assert back_end.sign_in(valid_user) == (True, "Everett-Alan")
+    assert len(user_blob.download_as_text().split('\n')) == 2
+    history = back_end.get_history(valid_user['username'])
+    assert 'Old page' in [record.event for record in history]
+
+
+def test_page_links_fall_back_to_empty():
+    back_end = Backend('app', SC=storage_client_mock())
+    with patch.object(back_end.page_links,
+                      'links',
+                      side_effect=ServiceUnavailable('down')):
+        assert back_end.get_page_links('pitch') == ([], [])
+
+
+def test_sign_in_after_failed_history_migration(valid_user):
+    back_end = Backend('app', SC=storage_client_mock())
+    back_end.passwords.rounds = 4
+    back_end.sign_up(valid_user)
+    user_blob = back_end.bucket_users.blob(valid_user['username'])
+    user_blob.upload_from_string(user_blob.download_as_text() +
+                                 "\n['Old page', 'Apr-01-2023 10:00:00']")
+
+    with patch.object(blob_object,
+                      'upload_from_string',
+                      side_effect=ServiceUnavailable('down')):
+        assert back_end.sign_in(valid_user) == (True, "Everett-Alan")
+    assert back_end.sign_in(valid_user) == (True, "Everett-Alan")
+    assert back_end.sign_in(valid_user) == (True, "Everett-Alan")
+    assert len(user_blob.download_as_text().split('\n')) == 2
+    history = back_end.get_history(valid_user['username'])
+    events = [record.event for record in history]
+    assert events.count('Old page') == 1
+
+
+def test_concurrent_users_keep_their_own_history():
+    back_end = Backend('app', SC=storage_client_mock())
+    users = [f'user{number}' for number in range(8)]
+    start = threading.Barrier(len(users))
+
+    def browse(user):
+        start.wait()
+        for number in range(25):
+            back_end.add_to_history(user, f'{user} page {number}')
+
+    threads = [threading.Thread(target=browse, args=(user,)) for user in users]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    for user in users:
+        history = back_end.get_history(user)
+        assert len(history) == 25
+        assert all(record.event.startswith(f'{user} ') for record in history)
+
+
+def test_sign_in_rehashes_on_cost_change(valid_user):
+    back_end = Backend('app', SC=storage_client_mock())
+    back_end.passwords.rounds = 4
+    back_end.sign_up(valid_user)
+    user_blob = back_end.bucket_users.blob(valid_user['username'])
+    assert "$2b$04$" in user_blob.download_as_text()
+
+    back_end.passwords.rounds = 5
+    assert back_end.sign_in(valid_user) == (True, "Everett-Alan")
+    assert "$2b$05$" in user_blob.download_as_text()
+    assert back_end.sign_in(valid_user) == (True, "Everett-Alan")
+
+
+def test_throttled_sign_in_skips_storage_and_bcrypt(valid_user):
+    back_end = Backend('app', SC=storage_client_mock())
+    back_end.login_throttle.user_burst = 1
+    back_end.sign_in(valid_user, '10.0.0.1')
+
+    with patch.object(back_end.bucket_users, 'blob') as blob, \
+            patch.object(back_end.passwords, 'verify') as verify:
+        with pytest.raises(Throttled):
+            back_end.sign_in(valid_user, '10.0.0.1')
+    blob.assert_not_called()
+    verify.assert_not_called()
+
+
+def test_backend_on_memory_store(valid_user):
+    directory = os.path.join(os.path.dirname(__file__), 'temp_markdown')
+    app = Flask_mock('app')
+    app.config = {'STORAGE_BACKEND': 'memory', 'STORAGE_SEED_DIR': directory}
+    back_end = Backend(app)
+
+    assert 'pitch' in back_end.get_all_page_names()
+    assert '<h2 id="pitch">Pitch</h2>' in back_end.get_wiki_page('pitch')
+    assert back_end.upload(io.BytesIO(b'# New\n[pitch](/pitch)\n'), 'new.md')
+    assert 'new' in back_end.get_all_page_names()
+    assert back_end.search('new')[0].page == 'new'
+    assert back_end.search('pitch')[0].page == 'pitch'
+    back_end.page_suggest.refresh()
+    assert back_end.suggest('pit')[0].url == '/pages/pitch'
+    backlinks, related = back_end.get_page_links('pitch')
+    assert backlinks == ['new']
+    assert 'new' in related
+    assert back_end.broken_links() == {}
+
+    assert back_end.sign_up(valid_user) == (True, 'Everett-Alan')
+    assert back_end.sign_in(valid_user) == (True, 'Everett-Alan')
+    assert back_end.upload_comment('tim3line', 'Hello')
+    assert back_end.get_comments()[0]['content'] == 'Hello'
+
+
+@pytest.fixture
+def memory_backend():
+    app = Flask_mock('app')
+    app.config = {'STORAGE_BACKEND': 'memory'}
+    return Backend(app)
+
+
+def test_upload_refuses_markdown_that_is_not_utf8(memory_backend):
+    assert not memory_backend.upload(io.BytesIO(b'# T\xe9st\n'), 'latin.md')
+    assert memory_backend.bucket_content.get_blob('latin.md') is None
+
+
+def test_upload_saved_page_survives_publish_and_index_errors(memory_backend):
+    with patch.object(memory_backend.publisher,
+                      'publish',
+                      side_effect=ServiceUnavailable('down')), \
+            patch.object(memory_backend.search_index,
+                         'update',
+                         side_effect=ServiceUnavailable('down')):
+        assert memory_backend.upload(io.BytesIO(b'# Tempo\n'), 'tempo.md')
+
+    assert 'tempo' in memory_backend.get_all_page_names()
+    assert '<h1 id="tempo">Tempo</h1>' in memory_backend.get_wiki_page('tempo')
+    assert memory_backend.search('tempo')[0].page == 'tempo'
+
+
+def test_backend_does_not_touch_storage_on_init():
+    with patch('google.cloud.storage.Client') as client_class:
+        Backend('app')
+    client_class.assert_not_called()
@@ -0,0 +1,552 @@
+"""
+Blob stores the Backend keeps its buckets in.
+
+A store hands out buckets with store.bucket(name). Buckets and blobs have
+the subset of the google-cloud-storage API the wiki uses:
+
+    bucket.blob(name), bucket.get_blob(name),
+    bucket.list_blobs(prefix, delimiter, start_offset, end_offset)
+    blob.name, .generation, .size, .updated, .metadata, .content_type,
+    .public_url, blob.exists(), .reload(), .download_as_bytes(),
+    .download_as_string(), .download_as_text(), .upload_from_string(),
+    .upload_from_file(), .patch(), .delete()
+
+Writes and deletes take if_generation_match, 0 meaning the blob must not
+exist yet, and raise google.api_core's PreconditionFailed when it doesn't
+hold. Reads of missing blobs raise NotFound, as with GCS.
+
+GCSStore passes through to google.cloud.storage, creating the client and
+buckets on first use so startup doesn't wait for credential discovery,
+and gives every call the timeout and retries of its StoragePolicy.
+FileSystemStore keeps each bucket in a directory, with generations and metadata in a
+sidecar directory, for running without GCS. MemoryStore keeps everything
+in process memory and can add latency to every call, for tests and
+benchmarks.
+"""
+import json
+import mimetypes
+import os
+import random
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+from flaskr.storage_policy import DEFAULT_POOL_SIZE, PolicyBucket, shared_client
+
+GCS = 'gcs'
+FILESYSTEM = 'filesystem'
+MEMORY = 'memory'
+COPY_CHUNK_SIZE = 1024 * 1024
+
+
+class GCSStore:
+    """
+    Buckets of Google Cloud Storage.
+
+    google.cloud.storage is imported and the client made on the first
+    call that needs them, not when the store or its buckets are made.
+    Without a client given, the process-wide shared_client() is used.
+
+    Attributes:
+        policy: Timeout and retries of every call (StoragePolicy or None)
+        pool_size: Connections kept open by the shared client (int)
+    """
+
+    def __init__(self, client=None, policy=None, pool_size=DEFAULT_POOL_SIZE):
+        self.policy = policy
+        self.pool_size = pool_size
+        self._client = client
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        """
+        Returns:
+            - The google.cloud.storage.Client used, made if needed
+        """
+        with self._lock:
+            if self._client is None:
+                self._client = shared_client(self.pool_size)
+            return self._client
+
+    def bucket(self, name):
+        if self._client is not None:
+            bucket = self._client.bucket(name)
+        else:
+            bucket = LazyBucket(self, name)
+        if self.policy is None:
+            return bucket
+        return PolicyBucket(bucket, self.policy)
+
+
+class LazyBucket:
+    """
+    Stands in for a GCS bucket until it is first used.
+    """
+
+    def __init__(self, store, name):
+        self.name = name
+        self._store = store
+        self._bucket = None
+
+    def __getattr__(self, attr):
+        # Only reached for attributes of the real bucket
+        if self._bucket is None:
+            self._bucket = self._store.client.bucket(self.name)
+        return getattr(self._bucket, attr)
+
+
+class StoredBlob:
+    """
+    A blob of a FileSystemStore or MemoryStore bucket. Like a GCS blob
+    made with bucket.blob(name), its properties are only known once it
+    has been read, written or reloaded.
+    """
+
+    def __init__(self, bucket, name, record=None):
+        self.bucket = bucket
+        self.name = name
+        self.metadata = None
+        self._apply(record)
+
+    @property
+    def public_url(self):
+        return self.bucket.public_url(self.name)
+
+    def exists(self):
+        return self.bucket._stat(self.name) is not None
+
+    def reload(self):
+        record = self.bucket._stat(self.name)
+        if record is None:
+            raise NotFound(self.name)
+        self._apply(record)
+
+    def download_as_bytes(self):
+        data, record = self.bucket._read(self.name)
+        self._apply(record)
+        return data
+
+    def download_as_string(self):
+        return self.download_as_bytes()
+
+    def download_as_text(self, encoding='utf-8'):
+        return self.download_as_bytes().decode(encoding)
+
+    def upload_from_string(self,
+                           data,
+                           content_type='text/plain',
+                           if_generation_match=None):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self._apply(
+            self.bucket._write(self.name, data, content_type, self.metadata,
+                               if_generation_match))
+
+    def upload_from_file(self,
+                         file_obj,
+                         size=None,
+                         content_type=None,
+                         if_generation_match=None):
+        self._apply(
+            self.bucket._write(self.name, (file_obj, size), content_type,
+                               self.metadata, if_generation_match))
+
+    def patch(self):
+        self._apply(self.bucket._patch(self.name, self.metadata))
+
+    def delete(self, if_generation_match=None):
+        self.bucket._delete(self.name, if_generation_match)
+
+    def _apply(self, record):
+        record = record or {}
+        self.generation = record.get('generation')
+        self.size = record.get('size')
+        self.content_type = record.get('content_type')
+        updated = record.get('updated')
+        self.updated = (datetime.fromtimestamp(updated, timezone.utc)
+                        if updated is not None else None)
+        if 'metadata' in record:
+            self.metadata = dict(record['metadata'] or {}) or None
+
+
+class _Bucket:
+    """
+    Listing and blob handles shared by FileSystemStore and MemoryStore
+    buckets, which store (data, record) pairs. A record holds generation,
+    size, content_type, updated (epoch seconds) and metadata.
+    """
+
+    def __init__(self, name, base_url):
+        self.name = name
+        self._base_url = base_url
+        self._lock = threading.RLock()
+        self._last_generation = 0
+
+    def public_url(self, name):
+        return f'{self._base_url}/{self.name}/{quote(name)}'
+
+    def blob(self, name):
+        return StoredBlob(self, name)
+
+    def get_blob(self, name):
+        record = self._stat(name)
+        if record is None:
+            return None
+        return StoredBlob(self, name, record)
+
+    def list_blobs(self,
+                   prefix=None,
+                   delimiter=None,
+                   start_offset=None,
+                   end_offset=None):
+        """
+        Returns:
+            - Blobs in name order, without those under a delimiter after
+              the prefix, like the items of a GCS listing (list)
+        """
+        blobs = []
+        for name, record in self._records():
+            if prefix and not name.startswith(prefix):
+                continue
+            if delimiter and delimiter in name[len(prefix or ''):]:
+                continue
+            if start_offset is not None and name < start_offset:
+                continue
+            if end_offset is not None and name >= end_offset:
+                continue
+            blobs.append(StoredBlob(self, name, record))
+        return blobs
+
+    def _next_generation(self):
+        # Microseconds like GCS, always growing within the bucket
+        self._last_generation = max(self._last_generation + 1,
+                                    time.time_ns() // 1000)
+        return self._last_generation
+
+    def _check(self, name, record, if_generation_match):
+        if if_generation_match is None:
+            return
+        generation = record['generation'] if record else 0
+        if generation != if_generation_match:
+            raise PreconditionFailed(f'{self.name}/{name}')
+
+    def _new_record(self, old, size, content_type, metadata):
+        return {
+            'generation':
+                self._next_generation(),
+            'size':
+                size,
+            'content_type':
+                content_type or
+                (old or {}).get('content_type') or 'application/octet-stream',
+            'updated':
+                time.time(),
+            'metadata':
+                dict(metadata) if metadata else None
+        }
+
+
+class MemoryBucket(_Bucket):
+
+    def __init__(self, name, base_url, delay):
+        super().__init__(name, base_url)
+        self._delay = delay
+        # name -> (data, record)
+        self._blobs = {}
+
+    def _records(self):
+        self._delay()
+        with self._lock:
+            return [(name, dict(self._blobs[name][1]))
+                    for name in sorted(self._blobs)]
+
+    def _stat(self, name):
+        self._delay()
+        with self._lock:
+            if name not in self._blobs:
+                return None
+            return dict(self._blobs[name][1])
+
+    def _read(self, name):
+        self._delay()
+        with self._lock:
+            if name not in self._blobs:
+                raise NotFound(f'{self.name}/{name}')
+            data, record = self._blobs[name]
+            return data, dict(record)
+
+    def _write(self, name, source, content_type, metadata, if_generation_match):
+        self._delay()
+        if not isinstance(source, bytes):
+            file_obj, size = source
+            source = file_obj.read() if size is None else file_obj.read(size)
+        with self._lock:
+            old = self._blobs.get(name, (None, None))[1]
+            self._check(name, old, if_generation_match)
+            record = self._new_record(old, len(source), content_type, metadata)
+            self._blobs[name] = (source, record)
+            return dict(record)
+
+    def _patch(self, name, metadata):
+        self._delay()
+        with self._lock:
+            if name not in self._blobs:
+                raise NotFound(f'{self.name}/{name}')
+            data, record = self._blobs[name]
+            record = dict(record,
+                          metadata=dict(metadata) if metadata else None,
+                          updated=time.time())
+            self._blobs[name] = (data, record)
+            return dict(record)
+
+    def _delete(self, name, if_generation_match):
+        self._delay()
+        with self._lock:
+            if name not in self._blobs:
+                raise NotFound(f'{self.name}/{name}')
+            self._check(name, self._blobs[name][1], if_generation_match)
+            del self._blobs[name]
+
+
+class MemoryStore:
+    """
+    Buckets in process memory.
+
+    Attributes:
+        latency: Seconds added to every call, a (low, high) range to pick
+                 from at random, or None (float or tuple)
+    """
+
+    def __init__(self, latency=None, base_url='memory:/'):
+        self.latency = latency
+        self._base_url = base_url
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def bucket(self, name):
+        with self._lock:
+            if name not in self._buckets:
+                self._buckets[name] = MemoryBucket(name, self._base_url,
+                                                   self._delay)
+            return self._buckets[name]
+
+    def _delay(self):
+        if not self.latency:
+            return
+        if isinstance(self.latency, (tuple, list)):
+            time.sleep(random.uniform(*self.latency))
+        else:
+            time.sleep(self.latency)
+
+
+class FileBucket(_Bucket):
+    """
+    Blob data is kept in <root>/<bucket>/<name> and its record in
+    <root>/<bucket>.meta/<name>.json. Blobs written by hand, without a
+    record, are given one when first seen.
+    """
+
+    def __init__(self, name, root, base_url):
+        super().__init__(name, base_url)
+        self._data_dir = os.path.join(root, name)
+        self._meta_dir = os.path.join(root, f'{name}.meta')
+        os.makedirs(self._data_dir, exist_ok=True)
+        os.makedirs(self._meta_dir, exist_ok=True)
+
+    def _paths(self, name):
+        parts = name.split('/')
+        if any(part in ('', '.', '..') for part in parts):
+            raise ValueError(f'Invalid blob name {name!r}')
+        return (os.path.join(self._data_dir, *parts),
+                os.path.join(self._meta_dir, *parts) + '.json')
+
+    def _records(self):
+        names = []
+        for directory, _, files in os.walk(self._data_dir):
+            relative = os.path.relpath(directory, self._data_dir)
+            for file_name in files:
+                if file_name.startswith('.tmp-'):
+                    continue
+                if relative == '.':
+                    names.append(file_name)
+                else:
+                    names.append('/'.join(relative.split(os.sep) + [file_name]))
+        records = []
+        for name in sorted(names):
+            record = self._stat(name)
+            if record is not None:
+                records.append((name, record))
+        return records
+
+    def _stat(self, name):
+        data_path, meta_path = self._paths(name)
+        with self._lock:
+            try:
+                size = os.path.getsize(data_path)
+            except OSError:
+                return None
+            try:
+                with open(meta_path) as meta_file:
+                    return json.load(meta_file)
+            except (OSError, ValueError):
+                record = self._new_record(None, size, None, None)
+                record['updated'] = os.path.getmtime(data_path)
+                self._save_record(meta_path, record)
+                return record
+
+    def _read(self, name):
+        data_path, _ = self._paths(name)
+        with self._lock:
+            record = self._stat(name)
+            if record is None:
+                raise NotFound(f'{self.name}/{name}')
+            with open(data_path, 'rb') as data_file:
+                return data_file.read(), record
+
+    def _write(self, name, source, content_type, metadata, if_generation_match):
+        data_path, meta_path = self._paths(name)
+        os.makedirs(os.path.dirname(data_path), exist_ok=True)
+        # Data is copied outside the lock and swapped in under it
+        handle, temp_path = tempfile.mkstemp(prefix='.tmp-',
+                                             dir=os.path.dirname(data_path))
+        try:
+            with os.fdopen(handle, 'wb') as temp_file:
+                if isinstance(source, bytes):
+                    temp_file.write(source)
+                else:
+                    file_obj, size = source
+                    _copy(file_obj, temp_file, size)
+                size = temp_file.tell()
+            with self._lock:
+                old = self._stat(name)
+                self._check(name, old, if_generation_match)
+                record = self._new_record(old, size, content_type, metadata)
+                os.replace(temp_path, data_path)
+                self._save_record(meta_path, record)
+                return record
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def _patch(self, name, metadata):
+        _, meta_path = self._paths(name)
+        with self._lock:
+            record = self._stat(name)
+            if record is None:
+                raise NotFound(f'{self.name}/{name}')
+            record = dict(record,
+                          metadata=dict(metadata) if metadata else None,
+                          updated=time.time())
+            self._save_record(meta_path, record)
+            return record
+
+    def _delete(self, name, if_generation_match):
+        data_path, meta_path = self._paths(name)
+        with self._lock:
+            record = self._stat(name)
+            if record is None:
+                raise NotFound(f'{self.name}/{name}')
+            self._check(name, record, if_generation_match)
+            os.remove(data_path)
+            if os.path.exists(meta_path):
+                os.remove(meta_path)
+
+    def _save_record(self, meta_path, record):
+        os.makedirs(os.path.dirname(meta_path), exist_ok=True)
+        handle, temp_path = tempfile.mkstemp(prefix='.tmp-',
+                                             dir=os.path.dirname(meta_path))
+        with os.fdopen(handle, 'w') as meta_file:
+            json.dump(record, meta_file)
+        os.replace(temp_path, meta_path)
+
+
+class FileSystemStore:
+    """
+    Buckets kept as directories under root.
+
+    Preconditions hold between the threads of one process; processes
+    sharing a root may race.
+
+    Attributes:
+        root: Directory holding one directory per bucket (str)
+    """
+
+    def __init__(self, root, base_url=None):
+        self.root = os.path.abspath(root)
+        self._base_url = base_url or f'file://{quote(self.root)}'
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def bucket(self, name):
+        with self._lock:
+            if name not in self._buckets:
+                self._buckets[name] = FileBucket(name, self.root,
+                                                 self._base_url)
+            return self._buckets[name]
+
+
+def make_store(kind=GCS,
+               client=None,
+               root=None,
+               latency=None,
+               base_url=None,
+               policy=None,
+               pool_size=DEFAULT_POOL_SIZE):
+    """
+    Args:
+        - 'gcs', 'filesystem' or 'memory' (str), storage client for
+          'gcs', directory for 'filesystem' (str), latency for 'memory'
+          (float or tuple), base of public urls (str), StoragePolicy and
+          connection pool size for 'gcs'
+    Returns:
+        - The store
+    """
+    if kind == GCS:
+        return GCSStore(client, policy=policy, pool_size=pool_size)
+    if kind == FILESYSTEM:
+        return FileSystemStore(root, base_url=base_url)
+    if kind == MEMORY:
+        return MemoryStore(latency=latency, base_url=base_url or 'memory:/')
+    raise ValueError(f'Unknown storage backend {kind!r}')
+
+
+def seed(bucket, directory, extensions=('.md',)):
+    """
+    Copies files of a directory into a bucket, skipping those already
+    there.\n
+    Args:
+        - Bucket to fill, directory to read (str), file endings (tuple)
+    Returns:
+        - Number of blobs written (int)
+    """
+    written = 0
+    for file_name in sorted(os.listdir(directory)):
+        if not file_name.endswith(extensions):
+            continue
+        content_type = mimetypes.guess_type(file_name)[0]
+        with open(os.path.join(directory, file_name), 'rb') as source:
+            try:
+                bucket.blob(file_name).upload_from_file(
+                    source, content_type=content_type, if_generation_match=0)
+                written += 1
+            except PreconditionFailed:
+                continue
+    return written
+
+
+def _copy(source, target, size):
+    remaining = size
+    while remaining is None or remaining > 0:
+        chunk_size = COPY_CHUNK_SIZE if remaining is None else min(
+            COPY_CHUNK_SIZE, remaining)
+        chunk = source.read(chunk_size)
+        if not chunk:
+            break
+        target.write(chunk)
+        if remaining is not None:
+            remaining -= len(chunk)
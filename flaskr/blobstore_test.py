@@ -0,0 +1,155 @@
+from flaskr.blobstore import MemoryStore, FileSystemStore, GCSStore, make_store, seed
+from flaskr.backend_test import storage_client_mock
+from google.api_core.exceptions import NotFound, PreconditionFailed
+from unittest.mock import patch
+import io
+import os
+import time
+import pytest
+
+
+@pytest.fixture(params=['memory', 'filesystem'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryStore()
+    return FileSystemStore(str(tmp_path))
+
+
+def test_write_and_read(store):
+    bucket = store.bucket('content')
+    blob = bucket.blob('pitch.md')
+    assert not blob.exists()
+    assert bucket.get_blob('pitch.md') is None
+
+    blob.upload_from_string('# Pitch', content_type='text/markdown')
+    assert blob.generation is not None
+    assert blob.size == 7
+
+    stored = bucket.get_blob('pitch.md')
+    assert stored.generation == blob.generation
+    assert stored.content_type == 'text/markdown'
+    assert stored.updated is not None
+    assert stored.download_as_text() == '# Pitch'
+    assert stored.download_as_string() == b'# Pitch'
+
+
+def test_upload_from_file_and_metadata(store):
+    bucket = store.bucket('images')
+    blob = bucket.blob('a.png')
+    blob.metadata = {'sha256': 'abc'}
+    blob.upload_from_file(io.BytesIO(b'0123456789'), size=4)
+    assert bucket.get_blob('a.png').download_as_bytes() == b'0123'
+    assert bucket.get_blob('a.png').metadata == {'sha256': 'abc'}
+
+    blob.metadata = {'sha256': 'abc', 'thumb': 'derivatives/thumb/a.png'}
+    blob.patch()
+    assert bucket.get_blob(
+        'a.png').metadata['thumb'] == 'derivatives/thumb/a.png'
+
+
+def test_preconditions(store):
+    bucket = store.bucket('analytics')
+    blob = bucket.blob('counts.json')
+    blob.upload_from_string('{}', if_generation_match=0)
+    with pytest.raises(PreconditionFailed):
+        bucket.blob('counts.json').upload_from_string('{}',
+                                                      if_generation_match=0)
+
+    first = blob.generation
+    blob.upload_from_string('{"a": 1}', if_generation_match=first)
+    assert blob.generation > first
+    with pytest.raises(PreconditionFailed):
+        blob.upload_from_string('{"a": 2}', if_generation_match=first)
+    with pytest.raises(PreconditionFailed):
+        blob.delete(if_generation_match=first)
+    blob.delete(if_generation_match=blob.generation)
+    assert not blob.exists()
+
+
+def test_missing_blobs(store):
+    bucket = store.bucket('users')
+    with pytest.raises(NotFound):
+        bucket.blob('nobody').download_as_bytes()
+    with pytest.raises(NotFound):
+        bucket.blob('nobody').delete()
+    with pytest.raises(NotFound):
+        bucket.blob('nobody').patch()
+
+
+def test_list_blobs(store):
+    bucket = store.bucket('comments')
+    for name in ['2:b', '1:a', 'segments/index.json', 'segments/x.jsonl']:
+        bucket.blob(name).upload_from_string(name)
+
+    assert [blob.name for blob in bucket.list_blobs()
+           ] == ['1:a', '2:b', 'segments/index.json', 'segments/x.jsonl']
+    assert [blob.name for blob in bucket.list_blobs(delimiter='/')
+           ] == ['1:a', '2:b']
+    assert [blob.name for blob in bucket.list_blobs(prefix='segments/')
+           ] == ['segments/index.json', 'segments/x.jsonl']
+    assert [blob.name for blob in bucket.list_blobs(end_offset='2')] == ['1:a']
+    assert [
+        blob.name for blob in bucket.list_blobs(delimiter='/', start_offset='2')
+    ] == ['2:b']
+    assert bucket.list_blobs()[0].generation is not None
+
+
+def test_buckets_are_apart(store):
+    store.bucket('a').blob('x').upload_from_string('a')
+    assert store.bucket('b').get_blob('x') is None
+    assert store.bucket('a').get_blob('x').public_url.endswith('/a/x')
+
+
+def test_filesystem_store_keeps_blobs(tmp_path):
+    FileSystemStore(str(tmp_path)).bucket('content').blob(
+        'derivatives/thumb/a.png').upload_from_string('png')
+    with open(tmp_path / 'content' / 'hand.md', 'w') as hand_written:
+        hand_written.write('# By hand')
+
+    bucket = FileSystemStore(str(tmp_path)).bucket('content')
+    assert bucket.get_blob(
+        'derivatives/thumb/a.png').download_as_text() == 'png'
+    assert bucket.get_blob('hand.md').download_as_text() == '# By hand'
+    with pytest.raises(ValueError):
+        bucket.blob('../escape').upload_from_string('x')
+
+
+def test_memory_store_latency():
+    store = MemoryStore(latency=0.01)
+    started = time.perf_counter()
+    store.bucket('a').get_blob('x')
+    assert time.perf_counter() - started >= 0.01
+
+
+def test_seed_from_temp_markdown():
+    bucket = MemoryStore().bucket('content')
+    directory = os.path.join(os.path.dirname(__file__), 'temp_markdown')
+    count = seed(bucket, directory)
+
+    assert count == len(
+        [name for name in os.listdir(directory) if name.endswith('.md')])
+    assert bucket.get_blob('pitch.md').content_type == 'text/markdown'
+    assert seed(bucket, directory) == 0
+
+
+def test_make_store():
+    client = storage_client_mock()
+    assert make_store('gcs', client=client).bucket('a') is client.bucket('a')
+    assert isinstance(make_store('memory'), MemoryStore)
+    with pytest.raises(ValueError):
+        make_store('ftp')
+
+
+def test_gcs_store_makes_client_on_first_use():
+    with patch('flaskr.blobstore.shared_client') as shared_client:
+        store = GCSStore(pool_size=8)
+        bucket = store.bucket('minorbugs_content')
+        assert bucket.name == 'minorbugs_content'
+        shared_client.assert_not_called()
+
+        bucket.get_blob('pitch.md')
+        store.bucket('minorbugs_users').list_blobs()
+    shared_client.assert_called_once_with(8)
+    shared_client.return_value.bucket.assert_any_call('minorbugs_content')
+    shared_client.return_value.bucket.return_value.get_blob.assert_called_once_with(
+        'pitch.md')
@@ -0,0 +1,102 @@
+"""
+In-memory index of the blobs in a bucket, refreshed on a ttl so
+listing pages doesn't list the bucket on every request.
+"""
+import threading
+import time
+from collections import namedtuple
+
+DEFAULT_TTL = 300
+
+CatalogEntry = namedtuple(
+    'CatalogEntry', ['name', 'size', 'generation', 'updated', 'public_url'])
+
+
+class BlobCatalog:
+    """
+    Index of blob names with their size, generation, updated time
+    and public url.
+
+    The bucket is listed at most once per ttl. Writes made through this
+    process are recorded right away, so they show up without a relist.
+
+    Attributes:
+        bucket: Bucket being indexed
+        ttl: Seconds a listing is trusted (float)
+        include: Which blob names are indexed (callable, name -> Boolean)
+        refreshes: Number of times the bucket was listed (int)
+    """
+
+    def __init__(self,
+                 bucket,
+                 ttl=DEFAULT_TTL,
+                 include=None,
+                 clock=time.monotonic):
+        self.bucket = bucket
+        self.ttl = ttl
+        self.include = include or (lambda name: True)
+        self.refreshes = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._entries = None
+        self._listed_at = None
+
+    def entries(self):
+        """
+        Returns:
+            - Blob name to CatalogEntry, refreshed if stale (dict)
+        """
+        with self._lock:
+            if (self._entries is None or
+                    self._clock() - self._listed_at >= self.ttl):
+                self._refresh()
+            return dict(self._entries)
+
+    def names(self):
+        """
+        Returns:
+            - Sorted blob names (list)
+        """
+        return sorted(self.entries())
+
+    def record(self, blob):
+        """
+        Adds or updates a blob that was just written.\n
+        Args:
+            - The written blob
+        """
+        if not self.include(blob.name):
+            return
+        with self._lock:
+            if self._entries is not None:
+                self._entries[blob.name] = _entry(blob)
+
+    def discard(self, name):
+        """
+        Args:
+            - Name of a deleted blob (str)
+        """
+        with self._lock:
+            if self._entries is not None:
+                self._entries.pop(name, None)
+
+    def invalidate(self):
+        """
+        Forces the next lookup to list the bucket.
+        """
+        with self._lock:
+            self._entries = None
+
+    def _refresh(self):
+        self._entries = {
+            blob.name: _entry(blob)
+            for blob in self.bucket.list_blobs()
+            if self.include(blob.name)
+        }
+        self._listed_at = self._clock()
+        self.refreshes += 1
+
+
+def _entry(blob):
+    return CatalogEntry(blob.name, blob.size, blob.generation, blob.updated,
+                        blob.public_url)
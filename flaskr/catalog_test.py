@@ -0,0 +1,54 @@
+from flaskr.backend_test import storage_client_mock
+from flaskr.catalog import BlobCatalog
+import pytest
+
+
+@pytest.fixture
+def bucket():
+    return storage_client_mock(
+        blobs=['chord.md', 'pitch.md', 'notes.txt']).bucket('content')
+
+
+def test_names_filtered(bucket):
+    catalog = BlobCatalog(bucket, include=lambda name: name.endswith('.md'))
+    assert catalog.names() == ['chord.md', 'pitch.md']
+
+
+def test_entries_metadata(bucket):
+    catalog = BlobCatalog(bucket)
+    entry = catalog.entries()['chord.md']
+    assert entry.name == 'chord.md'
+    assert entry.generation == 1
+
+
+def test_lists_once_per_ttl(bucket):
+    now = [0]
+    catalog = BlobCatalog(bucket, ttl=60, clock=lambda: now[0])
+    catalog.names()
+    now[0] = 59
+    catalog.names()
+    assert catalog.refreshes == 1
+    now[0] = 60
+    catalog.names()
+    assert catalog.refreshes == 2
+
+
+def test_record_and_discard(bucket):
+    catalog = BlobCatalog(bucket, include=lambda name: name.endswith('.md'))
+    catalog.names()
+    blob = bucket.blob('scales.md')
+    blob.upload_from_string('# Scales')
+    catalog.record(blob)
+    catalog.record(bucket.blob('ignored.txt'))
+    catalog.discard('pitch.md')
+
+    assert catalog.names() == ['chord.md', 'scales.md']
+    assert catalog.refreshes == 1
+
+
+def test_invalidate(bucket):
+    catalog = BlobCatalog(bucket)
+    catalog.names()
+    catalog.invalidate()
+    catalog.names()
+    assert catalog.refreshes == 2
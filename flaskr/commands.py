@@ -0,0 +1,86 @@
+"""
+Maintenance commands, run with `flask <command>` (FLASK_APP=flaskr).
+"""
+import click
+
+
+def make_commands(app, Back_end):
+    """Registers the maintenance commands on the app's cli.
+
+    Attributes:
+        app: Flask instance.
+        Back_end: Backend instance shared with the endpoints.
+    """
+
+    @app.cli.command('reconcile-analytics')
+    def reconcile_analytics():
+        """Adds every page missing from the popularity analytics with 0 views."""
+        Back_end.popularity.flush()
+        Back_end.modify_page_analytics()
+        click.echo('Popularity analytics reconciled')
+
+    @app.cli.command('migrate-analytics')
+    def migrate_analytics():
+        """Converts the popularity csv to the versioned JSON-lines format."""
+        Back_end.popularity.flush()
+        if Back_end.analytics.migrate():
+            click.echo('Popularity analytics migrated to JSON-lines')
+        else:
+            click.echo('Nothing to migrate')
+
+    @app.cli.command('compact-comments')
+    def compact_comments():
+        """Moves comments of past periods from the hot segment into segments."""
+        moved = Back_end.comment_log.compact()
+        click.echo(f'Compacted {moved} comments')
+
+    @app.cli.command('migrate-comments')
+    def migrate_comments():
+        """Converts every per-comment blob, including recent ones, into segments."""
+        moved = Back_end.comment_log.compact(older_than=float('inf'))
+        click.echo(f'Migrated {moved} comments')
+
+    @app.cli.command('migrate-history')
+    def migrate_history():
+        """Moves the history kept in every user blob into the history log."""
+        moved = 0
+        for user_blob in Back_end.bucket_users.list_blobs():
+            moved += Back_end.migrate_history(user_blob)
+        Back_end.history.flush()
+        click.echo(f'Migrated {moved} history events')
+
+    @app.cli.command('publish-pages')
+    @click.option('--force', is_flag=True, help='Republish current pages too.')
+    def publish_pages(force):
+        """Renders every page whose HTML artifact is missing or stale."""
+        sources = [
+            blob for blob in Back_end.bucket_content.list_blobs()
+            if blob.name.endswith('.md')
+        ]
+        count = Back_end.publisher.publish_all(sources, force=force)
+        click.echo(f'Published {count} pages')
+
+    @app.cli.command('index-pages')
+    def index_pages():
+        """Builds the search index of every page again and saves it."""
+        count = Back_end.search_index.rebuild()
+        click.echo(f'Indexed {count} pages')
+
+    @app.cli.command('broken-links')
+    def broken_links():
+        """Lists the links of every page that point at no page."""
+        report = Back_end.broken_links()
+        for page_name, targets in report.items():
+            click.echo(f'{page_name}: {", ".join(targets)}')
+        click.echo(f'{sum(map(len, report.values()))} broken links')
+
+    @app.cli.command('backfill-thumbnails')
+    def backfill_thumbnails():
+        """Makes thumbnails for every image that doesn't have them yet."""
+        if not Back_end.thumbnails.enabled:
+            click.echo('Pillow is not installed, no thumbnails made')
+            return
+        Back_end.image_catalog.invalidate()
+        names = Back_end.image_catalog.entries()
+        count = Back_end.thumbnails.backfill(names)
+        click.echo(f'Made thumbnails for {count} images')
@@ -0,0 +1,92 @@
+from flaskr import create_app
+from unittest.mock import MagicMock
+import pytest
+
+
+@pytest.fixture
+def mock_backend():
+    mock_backend = MagicMock()
+    mock_backend.return_value = mock_backend
+    return mock_backend
+
+
+@pytest.fixture
+def runner(mock_backend):
+    app = create_app({'TESTING': True}, mock_backend)
+    return app.test_cli_runner()
+
+
+def test_reconcile_analytics(runner, mock_backend):
+    result = runner.invoke(args=['reconcile-analytics'])
+
+    assert result.exit_code == 0
+    mock_backend.popularity.flush.assert_called_once()
+    mock_backend.modify_page_analytics.assert_called_once()
+
+
+def test_migrate_analytics(runner, mock_backend):
+    mock_backend.analytics.migrate.return_value = True
+    result = runner.invoke(args=['migrate-analytics'])
+
+    assert result.exit_code == 0
+    assert 'migrated' in result.output
+
+
+def test_migrate_comments(runner, mock_backend):
+    mock_backend.comment_log.compact.return_value = 3
+    result = runner.invoke(args=['migrate-comments'])
+
+    assert result.exit_code == 0
+    mock_backend.comment_log.compact.assert_called_once_with(
+        older_than=float('inf'))
+    assert 'Migrated 3 comments' in result.output
+
+
+def test_backfill_thumbnails(runner, mock_backend):
+    mock_backend.thumbnails.backfill.return_value = 2
+    result = runner.invoke(args=['backfill-thumbnails'])
+
+    assert result.exit_code == 0
+    mock_backend.image_catalog.invalidate.assert_called_once()
+    assert 'Made thumbnails for 2 images' in result.output
+
+
+def test_migrate_history(runner, mock_backend):
+    mock_backend.bucket_users.list_blobs.return_value = ['sandy', 'bob']
+    mock_backend.migrate_history.return_value = 2
+    result = runner.invoke(args=['migrate-history'])
+
+    assert result.exit_code == 0
+    assert mock_backend.migrate_history.call_count == 2
+    mock_backend.history.flush.assert_called_once()
+    assert 'Migrated 4 history events' in result.output
+
+
+def test_publish_pages(runner, mock_backend):
+    md_blob, html_blob = MagicMock(), MagicMock()
+    md_blob.name, html_blob.name = 'pitch.md', 'rendered/pitch.html'
+    mock_backend.bucket_content.list_blobs.return_value = [md_blob, html_blob]
+    mock_backend.publisher.publish_all.return_value = 1
+    result = runner.invoke(args=['publish-pages', '--force'])
+
+    assert result.exit_code == 0
+    mock_backend.publisher.publish_all.assert_called_once_with([md_blob],
+                                                               force=True)
+    assert 'Published 1 pages' in result.output
+
+
+def test_index_pages(runner, mock_backend):
+    mock_backend.search_index.rebuild.return_value = 10
+    result = runner.invoke(args=['index-pages'])
+
+    assert result.exit_code == 0
+    assert 'Indexed 10 pages' in result.output
+
+
+def test_broken_links(runner, mock_backend):
+    mock_backend.broken_links.return_value = {'chord': ['gone', 'lost']}
+    result = runner.invoke(args=['broken-links'])
+
+    assert result.exit_code == 0
+    assert 'chord: gone, lost' in result.output
+    assert '2 broken links' in result.output
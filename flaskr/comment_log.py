@@ -0,0 +1,416 @@
+"""
+Comment storage for the comments bucket.
+
+New comments are written as small blobs named timestamp:username, the
+hot segment. Compaction moves hot comments of past periods (an hour by
+default) into immutable JSON-lines segment blobs under segments/, and a
+small index blob maps each segment to the time range it covers. Reading
+a page of comments lists the hot segment and downloads only the few
+segments that can hold comments for that page.
+"""
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+SEGMENT_PREFIX = 'segments/'
+INDEX_BLOB = 'segments/index.json'
+INDEX_VERSION = 1
+DEFAULT_PERIOD = 3600
+DEFAULT_HOT_LIMIT = 200
+DEFAULT_SEGMENT_CACHE = 32
+DEFAULT_CACHE_SIZE = 100
+DEFAULT_REFRESH_INTERVAL = 60
+MAX_RETRIES = 5
+
+Comment = namedtuple('Comment', ['timestamp', 'user', 'content'])
+
+
+def comment_name(timestamp, user):
+    """
+    Args:
+        - Timestamp (str), username (str)
+    Returns:
+        - Name of the hot blob holding the comment (str)
+    """
+    return f'{timestamp}:{user}'
+
+
+class CommentLog:
+    """
+    Hot segment plus compacted segments of the comments bucket.
+
+    Attributes:
+        bucket: The comments bucket
+        pool: Bounded pool used to download hot comments (Executor)
+        period: Seconds of comments held by one segment (int)
+        hot_limit: Hot comments that trigger a background compaction (int)
+    """
+
+    def __init__(self,
+                 bucket,
+                 pool,
+                 period=DEFAULT_PERIOD,
+                 hot_limit=DEFAULT_HOT_LIMIT,
+                 segment_cache=DEFAULT_SEGMENT_CACHE,
+                 clock=time.time):
+        self.bucket = bucket
+        self.pool = pool
+        self.period = period
+        self.hot_limit = hot_limit
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._compacting = False
+        self._index = (None, [])
+        # Segments never change once written, so parsed ones are kept
+        self._segments = OrderedDict()
+        self._segment_cache = segment_cache
+
+    def append(self, user, content):
+        """
+        Writes a new comment to the hot segment.\n
+        Args:
+            - Username (str), comment content (str)
+        Returns:
+            - The stored Comment or None if it could not be written
+        """
+        timestamp = str(self._clock())
+        message_blob = self.bucket.blob(comment_name(timestamp, user))
+        try:
+            # Only written if no comment has this name yet
+            message_blob.upload_from_string(content, if_generation_match=0)
+        except PreconditionFailed:
+            return None
+        return Comment(timestamp, user, content)
+
+    def page(self, limit=None, before=None):
+        """
+        Args:
+            - Most comments to return, all if None (int), timestamp that
+              returned comments must be older than (float, str or None)
+        Returns:
+            - Comments newest first (list of Comment) and the before value
+              of the next page, None on the last page (str)
+        """
+        before_ts = float(before) if before is not None else None
+        hot = self._hot_blobs(
+            end_offset=str(before) if before is not None else None)
+        if before is None and len(hot) > self.hot_limit:
+            self._compact_in_background()
+
+        # name -> (timestamp, Comment or hot blob still to download)
+        items = {}
+        for blob in hot:
+            timestamp = float(blob.name.split(':')[0])
+            if before_ts is None or timestamp < before_ts:
+                items[blob.name] = (timestamp, blob)
+
+        segments = sorted(self.segments(),
+                          key=lambda segment: segment['end'],
+                          reverse=True)
+        for segment in segments:
+            if before_ts is not None and segment['start'] >= before_ts:
+                continue
+            if limit is not None and len(items) > limit:
+                newest = sorted((item[0] for item in items.values()),
+                                reverse=True)
+                if segment['end'] < newest[limit]:
+                    break
+            for comment in self._read_segment(segment['name']):
+                timestamp = float(comment.timestamp)
+                if before_ts is None or timestamp < before_ts:
+                    name = comment_name(comment.timestamp, comment.user)
+                    items.setdefault(name, (timestamp, comment))
+
+        ordered = sorted(items.values(), key=lambda item: item[0], reverse=True)
+        next_before = None
+        if limit is not None and len(ordered) > limit:
+            ordered = ordered[:limit]
+            last = ordered[-1][1]
+            if isinstance(last, Comment):
+                next_before = last.timestamp
+            else:
+                next_before = last.name.split(':')[0]
+
+        comments = list(self.pool.map(self._load, ordered))
+        if None in comments:
+            # Compacted since they were listed: read them from their
+            # segment, or leave them out if it isn't indexed yet
+            missing = [
+                item[1].name
+                for item, comment in zip(ordered, comments)
+                if comment is None
+            ]
+            compacted = self._find_compacted(missing)
+            comments = [
+                comment or compacted.get(item[1].name)
+                for item, comment in zip(ordered, comments)
+            ]
+            comments = [comment for comment in comments if comment is not None]
+        return comments, next_before
+
+    def segments(self):
+        """
+        Returns:
+            - Index entries with name, start, end and count (list of dict)
+        """
+        blob = self.bucket.get_blob(INDEX_BLOB)
+        if blob is None:
+            return []
+        with self._lock:
+            generation, segments = self._index
+            if generation == blob.generation:
+                return segments
+        segments = json.loads(blob.download_as_text())['segments']
+        with self._lock:
+            self._index = (blob.generation, segments)
+        return segments
+
+    def compact(self, older_than=None):
+        """
+        Moves hot comments into segments, one segment per period.\n
+        Args:
+            - Only comments older than this timestamp are moved, by default
+              those of periods that have ended (float or None)
+        Returns:
+            - Number of comments moved (int)
+        """
+        if older_than is None:
+            older_than = self._clock() // self.period * self.period
+
+        groups = {}
+        for blob in self._hot_blobs():
+            timestamp = float(blob.name.split(':')[0])
+            if timestamp < older_than:
+                start = int(timestamp // self.period * self.period)
+                groups.setdefault(start, []).append(blob)
+
+        moved = 0
+        for start, blobs in sorted(groups.items()):
+            comments = sorted(self.pool.map(self._load_hot, blobs),
+                              key=lambda comment: float(comment.timestamp))
+            if self._write_segment(start, comments) is None:
+                continue
+            for blob in blobs:
+                try:
+                    blob.delete()
+                except NotFound:
+                    pass
+            moved += len(comments)
+        return moved
+
+    def _hot_blobs(self, end_offset=None):
+        return [
+            blob for blob in self.bucket.list_blobs(delimiter='/',
+                                                    end_offset=end_offset)
+            if not blob.name.startswith(SEGMENT_PREFIX)
+        ]
+
+    def _write_segment(self, start, comments):
+        stamp = time.strftime('%Y%m%d%H%M', time.gmtime(start))
+        body = ''.join(
+            json.dumps({
+                'ts': comment.timestamp,
+                'user': comment.user,
+                'content': comment.content
+            }) + '\n' for comment in comments)
+
+        existing = {segment['name'] for segment in self.segments()}
+        for number in range(len(existing) + MAX_RETRIES):
+            name = f'{SEGMENT_PREFIX}{stamp}-{number}.jsonl'
+            if name in existing:
+                continue
+            try:
+                self.bucket.blob(name).upload_from_string(
+                    body,
+                    content_type='application/jsonl',
+                    if_generation_match=0)
+                break
+            except PreconditionFailed:
+                continue
+        else:
+            logging.warning('Could not name a comment segment for %s', stamp)
+            return None
+
+        self._add_to_index({
+            'name': name,
+            'start': float(comments[0].timestamp),
+            'end': float(comments[-1].timestamp),
+            'count': len(comments)
+        })
+        return name
+
+    def _add_to_index(self, entry):
+        for _ in range(MAX_RETRIES):
+            blob = self.bucket.get_blob(INDEX_BLOB)
+            if blob is None:
+                blob = self.bucket.blob(INDEX_BLOB)
+                segments = []
+            else:
+                segments = json.loads(blob.download_as_text())['segments']
+            segments.append(entry)
+            index = json.dumps({'version': INDEX_VERSION, 'segments': segments})
+            try:
+                blob.upload_from_string(index,
+                                        content_type='application/json',
+                                        if_generation_match=blob.generation or
+                                        0)
+                return
+            except PreconditionFailed:
+                continue
+        raise PreconditionFailed(INDEX_BLOB)
+
+    def _read_segment(self, name):
+        with self._lock:
+            if name in self._segments:
+                self._segments.move_to_end(name)
+                return self._segments[name]
+        comments = []
+        for line in self.bucket.blob(name).download_as_text().splitlines():
+            if line.strip():
+                row = json.loads(line)
+                comments.append(Comment(row['ts'], row['user'], row['content']))
+        with self._lock:
+            self._segments[name] = comments
+            while len(self._segments) > self._segment_cache:
+                self._segments.popitem(last=False)
+        return comments
+
+    def _compact_in_background(self):
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+
+        def run():
+            try:
+                self.compact()
+            except Exception:
+                logging.exception('Comment compaction failed')
+            finally:
+                with self._lock:
+                    self._compacting = False
+
+        threading.Thread(target=run, name='comment-compaction',
+                         daemon=True).start()
+
+    def _find_compacted(self, names):
+        timestamps = [float(name.split(':')[0]) for name in names]
+        wanted = set(names)
+        found = {}
+        for segment in self.segments():
+            if (segment['end'] < min(timestamps) or
+                    segment['start'] > max(timestamps)):
+                continue
+            for comment in self._read_segment(segment['name']):
+                name = comment_name(comment.timestamp, comment.user)
+                if name in wanted:
+                    found[name] = comment
+        return found
+
+    def _load(self, item):
+        value = item[1]
+        if isinstance(value, Comment):
+            return value
+        try:
+            return self._load_hot(value)
+        except NotFound:
+            return None
+
+    def _load_hot(self, blob):
+        timestamp, user = blob.name.split(':', 1)
+        content = blob.download_as_string().decode('utf-8')
+        return Comment(timestamp, user, content)
+
+
+class CommentCache:
+    """
+    Process-local copy of the newest comments, written through on upload.
+
+    The newest capacity comments are loaded once and reloaded every
+    refresh_interval seconds to pick up comments posted by other
+    processes. Comments posted through this process are added right away,
+    so the page shown after a post is served from memory. Pages reaching
+    past the cached comments are read from the log.
+
+    Attributes:
+        log: Where comments are stored (CommentLog)
+        capacity: Newest comments kept in memory (int)
+        refresh_interval: Seconds between reloads (float)
+        hits: Pages served from memory (int)
+        misses: Pages read from the log (int)
+    """
+
+    def __init__(self,
+                 log,
+                 capacity=DEFAULT_CACHE_SIZE,
+                 refresh_interval=DEFAULT_REFRESH_INTERVAL,
+                 clock=time.monotonic):
+        self.log = log
+        self.capacity = capacity
+        self.refresh_interval = refresh_interval
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._comments = None
+        self._complete = False
+        self._loaded_at = None
+
+    def page(self, limit=None, before=None):
+        """
+        Same as CommentLog.page, from memory when the cached comments
+        cover the requested page.
+        """
+        with self._lock:
+            stale = (self._comments is None or
+                     self._clock() - self._loaded_at >= self.refresh_interval)
+        if stale:
+            self.refresh()
+
+        with self._lock:
+            comments = self._comments
+            complete = self._complete
+        if before is not None:
+            before_ts = float(before)
+            comments = [
+                comment for comment in comments
+                if float(comment.timestamp) < before_ts
+            ]
+
+        if limit is not None and len(comments) > limit:
+            self.hits += 1
+            return comments[:limit], comments[limit - 1].timestamp
+        if complete:
+            self.hits += 1
+            return comments, None
+        self.misses += 1
+        return self.log.page(limit, before)
+
+    def add(self, comment):
+        """
+        Args:
+            - A comment that was just written (Comment)
+        """
+        with self._lock:
+            if self._comments is None:
+                return
+            comments = self._comments + [comment]
+            comments.sort(key=lambda comment: float(comment.timestamp),
+                          reverse=True)
+            if len(comments) > self.capacity:
+                comments = comments[:self.capacity]
+                self._complete = False
+            self._comments = comments
+
+    def refresh(self):
+        """
+        Reloads the newest comments from the log.
+        """
+        comments, next_before = self.log.page(self.capacity)
+        with self._lock:
+            self._comments = comments
+            self._complete = next_before is None
+            self._loaded_at = self._clock()
@@ -0,0 +1,186 @@
+from flaskr.backend_test import storage_client_mock
+from flaskr.blobstore import MemoryStore
+from flaskr.comment_log import CommentLog, CommentCache
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+import pytest
+
+HOUR = 3600
+
+
+@pytest.fixture
+def bucket():
+    return storage_client_mock().bucket('comments')
+
+
+@pytest.fixture
+def pool():
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        yield pool
+
+
+def post(bucket, timestamp, user, content):
+    bucket.blob(f'{timestamp}:{user}').upload_from_string(content)
+
+
+def contents(comments):
+    return [comment.content for comment in comments]
+
+
+def test_append_writes_hot_blob(bucket, pool):
+    log = CommentLog(bucket, pool, clock=lambda: 1680933371.5)
+    comment = log.append('sandy', 'Hola Mundo')
+
+    assert comment.timestamp == '1680933371.5'
+    blob = bucket.get_blob('1680933371.5:sandy')
+    assert blob.download_as_string() == b'Hola Mundo'
+
+
+def test_compact_moves_past_periods(bucket, pool):
+    post(bucket, '3600.5', 'sandy', 'first')
+    post(bucket, '3700.5', 'tim', 'second')
+    post(bucket, '7300.5', 'sandy', 'third')
+    post(bucket, '10900.5', 'sandy', 'current')
+    log = CommentLog(bucket, pool, period=HOUR, clock=lambda: 11000)
+
+    assert log.compact() == 3
+
+    hot = [blob.name for blob in bucket.list_blobs(delimiter='/')]
+    assert hot == ['10900.5:sandy']
+    segments = log.segments()
+    assert [segment['count'] for segment in segments] == [2, 1]
+    assert segments[0]['start'] == 3600.5
+    assert segments[0]['end'] == 3700.5
+
+
+def test_page_reads_hot_and_segments(bucket, pool):
+    for number in range(5):
+        post(bucket, f'{3600 + number}.5', 'sandy', f'old {number}')
+    post(bucket, '10900.5', 'sandy', 'new')
+    log = CommentLog(bucket, pool, period=HOUR, clock=lambda: 11000)
+    log.compact()
+
+    first, next_before = log.page(limit=3)
+    assert contents(first) == ['new', 'old 4', 'old 3']
+    assert next_before == '3603.5'
+
+    second, next_before = log.page(limit=3, before=next_before)
+    assert contents(second) == ['old 2', 'old 1', 'old 0']
+    assert next_before is None
+    # As parsed from the query string by the view
+    second, _ = log.page(limit=3, before=3603.5)
+    assert contents(second) == ['old 2', 'old 1', 'old 0']
+
+
+def test_page_reads_comments_compacted_after_listing(pool):
+    bucket = MemoryStore().bucket('comments')
+    post(bucket, '3600.5', 'sandy', 'first')
+    post(bucket, '3700.5', 'tim', 'second')
+    log = CommentLog(bucket, pool, period=HOUR, clock=lambda: 11000)
+    listed = log._hot_blobs()
+    log.compact()
+
+    with patch.object(log, '_hot_blobs', return_value=listed):
+        comments, next_before = log.page()
+    assert contents(comments) == ['second', 'first']
+    assert next_before is None
+
+
+def test_page_skips_comments_deleted_after_listing(pool):
+    bucket = MemoryStore().bucket('comments')
+    post(bucket, '3600.5', 'sandy', 'first')
+    post(bucket, '3700.5', 'tim', 'second')
+    log = CommentLog(bucket, pool, period=HOUR, clock=lambda: 11000)
+    listed = log._hot_blobs()
+    bucket.blob('3700.5:tim').delete()
+
+    with patch.object(log, '_hot_blobs', return_value=listed):
+        comments, _ = log.page()
+    assert contents(comments) == ['first']
+
+
+def test_page_skips_old_segments(bucket, pool):
+    post(bucket, '3600.5', 'sandy', 'oldest')
+    post(bucket, '7200.5', 'sandy', 'older')
+    post(bucket, '10800.5', 'sandy', 'newest')
+    log = CommentLog(bucket, pool, period=HOUR, clock=lambda: 20000)
+    log.compact()
+
+    with patch.object(log, '_read_segment',
+                      wraps=log._read_segment) as read_segment:
+        comments, next_before = log.page(limit=1)
+    assert contents(comments) == ['newest']
+    assert read_segment.call_count == 2
+
+
+def test_migrate_everything(bucket, pool):
+    post(bucket, '3600.5', 'sandy', 'old')
+    post(bucket, '10900.5', 'sandy', 'current')
+    log = CommentLog(bucket, pool, period=HOUR, clock=lambda: 11000)
+
+    assert log.compact(older_than=float('inf')) == 2
+    assert bucket.list_blobs(delimiter='/') == []
+    assert contents(log.page()[0]) == ['current', 'old']
+
+
+def test_compaction_is_repeatable(bucket, pool):
+    post(bucket, '3600.5', 'sandy', 'old')
+    log = CommentLog(bucket, pool, period=HOUR, clock=lambda: 11000)
+    log.compact()
+    post(bucket, '3601.5', 'tim', 'late')
+    log.compact()
+
+    names = [segment['name'] for segment in log.segments()]
+    assert names == [
+        'segments/197001010100-0.jsonl', 'segments/197001010100-1.jsonl'
+    ]
+    assert contents(log.page()[0]) == ['late', 'old']
+
+
+def test_append_refuses_existing_name(bucket, pool):
+    log = CommentLog(bucket, pool, clock=lambda: 1680933371.5)
+    log.append('sandy', 'first')
+    assert log.append('sandy', 'second') is None
+    assert bucket.get_blob(
+        '1680933371.5:sandy').download_as_string() == b'first'
+
+
+def test_cache_serves_new_comment_from_memory(bucket, pool):
+    post(bucket, '3600.5', 'sandy', 'old')
+    now = [4000]
+    log = CommentLog(bucket, pool, clock=lambda: now[0])
+    cache = CommentCache(log, refresh_interval=60, clock=lambda: 0)
+    cache.page(20)
+    now[0] = 4001
+
+    cache.add(log.append('tim', 'new'))
+    with patch.object(bucket, 'list_blobs') as list_blobs:
+        comments, next_before = cache.page(20)
+    list_blobs.assert_not_called()
+    assert contents(comments) == ['new', 'old']
+    assert next_before is None
+
+
+def test_cache_refreshes_on_interval(bucket, pool):
+    now = [0]
+    log = CommentLog(bucket, pool)
+    cache = CommentCache(log, refresh_interval=60, clock=lambda: now[0])
+    cache.page(20)
+    post(bucket, '3600.5', 'sandy', 'from another process')
+
+    assert cache.page(20)[0] == []
+    now[0] = 60
+    assert contents(cache.page(20)[0]) == ['from another process']
+
+
+def test_cache_falls_back_past_capacity(bucket, pool):
+    for number in range(4):
+        post(bucket, f'{3600 + number}.5', 'sandy', f'comment {number}')
+    log = CommentLog(bucket, pool)
+    cache = CommentCache(log, capacity=2)
+
+    first, next_before = cache.page(1)
+    assert contents(first) == ['comment 3']
+    second, next_before = cache.page(2, before=next_before)
+    assert contents(second) == ['comment 2', 'comment 1']
+    assert cache.misses == 1
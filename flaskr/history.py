@@ -0,0 +1,311 @@
+"""
+Append-only log of what each user did, kept apart from their credentials.
+
+Events are buffered per user and written as a new JSON-lines segment blob
+named <username>/<first timestamp>-<last timestamp>.jsonl, so an event
+never rewrites what was written before it and a page of history only
+downloads the segments whose time range it overlaps. When a user has more
+than max_segments segments they are merged into one.
+
+History kept in the user blob by older accounts, a repr'd Python list of
+alternating page names and times, is moved into the log with migrate().
+"""
+import ast
+import atexit
+import json
+import logging
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+DEFAULT_FLUSH_INTERVAL = 30
+DEFAULT_FLUSH_THRESHOLD = 20
+DEFAULT_MAX_SEGMENTS = 32
+TIME_FORMAT = "%b-%d-%Y %H:%M:%S"
+
+
+class HistoryEvent(namedtuple('HistoryEvent', ['timestamp', 'event'])):
+    """
+    One thing a user did: when (seconds since the epoch) and what,
+    e.g. the name of a page they visited.
+    """
+    __slots__ = ()
+
+    @property
+    def time(self):
+        """
+        Returns:
+            - Local time of the event, e.g. Apr-01-2023 10:00:00 (str)
+        """
+        return datetime.fromtimestamp(self.timestamp).strftime(TIME_FORMAT)
+
+
+def segment_name(user, start, end):
+    """
+    Args:
+        - Username (str), timestamps of the first and last event (float)
+    Returns:
+        - Name of the segment blob, sorting in time order (str)
+    """
+    return f'{user}/{start:017.6f}-{end:017.6f}.jsonl'
+
+
+def segment_range(name):
+    """
+    Args:
+        - Name of a segment blob (str)
+    Returns:
+        - Timestamps of its first and last event (tuple of float)
+    """
+    start, end = name.rsplit('/', 1)[1][:-len('.jsonl')].split('-')
+    return float(start), float(end)
+
+
+def parse_legacy(text):
+    """
+    Reads history in the format older accounts kept in their user blob.\n
+    Args:
+        - repr of a list alternating page names and times (str)
+    Returns:
+        - Events, oldest first (list of HistoryEvent)
+    """
+    try:
+        entries = ast.literal_eval(text)
+    except (ValueError, SyntaxError):
+        # Quotes were stripped by older versions, so the list may not parse
+        entries = text.replace('\'', '').strip('][').split(', ')
+    entries = [str(entry) for entry in entries if entry != ""]
+
+    events = []
+    for event, when in zip(entries[0::2], entries[1::2]):
+        try:
+            timestamp = time.mktime(time.strptime(when, TIME_FORMAT))
+        except ValueError:
+            logging.warning('Skipping history entry %r at %r', event, when)
+            continue
+        events.append(HistoryEvent(timestamp, event))
+    return sorted(events)
+
+
+class HistoryLog:
+    """
+    Per-user history segments in the history bucket.
+
+    A user's events are written on the event that reaches flush_threshold
+    pending events or comes flush_interval seconds after their oldest
+    pending one, when their session ends and when the process exits.
+    Reads include events still pending.
+
+    Attributes:
+        bucket: The history bucket
+        flush_interval: Most seconds an event waits to be written (float)
+        flush_threshold: Most events held per user (int)
+        max_segments: Segments a user may have before they are merged (int)
+    """
+
+    def __init__(self,
+                 bucket,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 flush_threshold=DEFAULT_FLUSH_THRESHOLD,
+                 max_segments=DEFAULT_MAX_SEGMENTS,
+                 clock=time.time):
+        self.bucket = bucket
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.max_segments = max_segments
+        self._clock = clock
+        self._lock = threading.Lock()
+        # username -> [HistoryEvent] not yet written
+        self._pending = {}
+        atexit.register(self.flush)
+
+    def append(self, user, event):
+        """
+        Records an event, writing the user's pending events if due.\n
+        Args:
+            - Username (str), what happened, e.g. a page name (str)
+        Returns:
+            - The recorded HistoryEvent
+        """
+        entry = HistoryEvent(self._clock(), event)
+        with self._lock:
+            events = self._pending.setdefault(user, [])
+            events.append(entry)
+            due = (len(events) >= self.flush_threshold or
+                   entry.timestamp - events[0].timestamp >= self.flush_interval)
+        if due:
+            self.flush(user)
+        return entry
+
+    def events(self, user):
+        """
+        Args:
+            - Username (str)
+        Returns:
+            - Every event of the user, oldest first (list of HistoryEvent)
+        """
+        return self.page(user)[::-1]
+
+    def page(self, user, limit=None, before=None, since=None):
+        """
+        Reads the newest events of a user in a time range, downloading
+        only the segments that can hold them.\n
+        Args:
+            - Username (str), most events to return, all if None (int),
+              only events older than this timestamp (float or None),
+              only events at or after this timestamp (float or None)
+        Returns:
+            - Events, newest first (list of HistoryEvent)
+        """
+
+        def in_range(timestamp):
+            return ((before is None or timestamp < before) and
+                    (since is None or timestamp >= since))
+
+        with self._lock:
+            events = {
+                entry for entry in self._pending.get(user, [])
+                if in_range(entry.timestamp)
+            }
+
+        segments = []
+        for blob in self._segments(user):
+            start, end = segment_range(blob.name)
+            if ((before is None or start < before) and
+                (since is None or end >= since)):
+                segments.append((end, blob))
+        segments.sort(key=lambda segment: segment[0], reverse=True)
+
+        for end, blob in segments:
+            if limit is not None and len(events) >= limit:
+                newest = sorted(events, reverse=True)
+                if end < newest[limit - 1].timestamp:
+                    break
+            events.update(entry for entry in _parse(blob.download_as_text())
+                          if in_range(entry.timestamp))
+
+        events = sorted(events, reverse=True)
+        return events if limit is None else events[:limit]
+
+    def migrate(self, user, legacy):
+        """
+        Writes history read from a user blob as one segment. The segment
+        is named after its events, so finding it already there means an
+        earlier migration wrote it.\n
+        Args:
+            - Username (str), the history (str, see parse_legacy)
+        Returns:
+            - Number of events moved (int)
+        """
+        events = parse_legacy(legacy)
+        if events:
+            try:
+                self._write(user, events)
+            except PreconditionFailed:
+                pass
+        return len(events)
+
+    def pending(self, user):
+        """
+        Returns:
+            - Events of the user not yet written (list of HistoryEvent)
+        """
+        with self._lock:
+            return list(self._pending.get(user, []))
+
+    def flush(self, user=None):
+        """
+        Writes pending events as new segments. Events that could not be
+        written are kept for the next flush.\n
+        Args:
+            - Only this user's events, everyone's if None (str)
+        Returns:
+            - (Boolean) True if nothing is left pending
+        """
+        with self._lock:
+            users = [user] if user is not None else list(self._pending)
+            batches = {
+                name: self._pending.pop(name)
+                for name in users
+                if self._pending.get(name)
+            }
+
+        done = True
+        for name, events in batches.items():
+            try:
+                self._write(name, events)
+            except Exception:
+                logging.exception('Could not write the history of %s', name)
+                done = False
+                with self._lock:
+                    self._pending.setdefault(name, [])[:0] = events
+        return done
+
+    def compact(self, user):
+        """
+        Merges a user's segments into one.\n
+        Args:
+            - Username (str)
+        Returns:
+            - Number of segments merged away (int)
+        """
+        segments = self._segments(user)
+        if len(segments) < 2:
+            return 0
+        events = set()
+        for blob in segments:
+            events.update(_parse(blob.download_as_text()))
+
+        events = sorted(events)
+        generations = {blob.name: blob.generation for blob in segments}
+        name = segment_name(user, events[0].timestamp, events[-1].timestamp)
+        # Sources are deleted only after the merged segment is written;
+        # events found in both are dropped when read.
+        try:
+            merged = self._write(user,
+                                 events,
+                                 compact=False,
+                                 if_generation_match=generations.get(name, 0))
+        except PreconditionFailed:
+            return 0
+        for blob in segments:
+            if blob.name == merged:
+                continue
+            try:
+                blob.delete()
+            except NotFound:
+                pass
+        return len(segments) - 1
+
+    def _segments(self, user):
+        return sorted(self.bucket.list_blobs(prefix=f'{user}/'),
+                      key=lambda blob: blob.name)
+
+    def _write(self, user, events, compact=True, if_generation_match=0):
+        name = segment_name(user, events[0].timestamp, events[-1].timestamp)
+        self.bucket.blob(name).upload_from_string(
+            _dump(events),
+            content_type='application/jsonl',
+            if_generation_match=if_generation_match)
+        if compact and len(self._segments(user)) > self.max_segments:
+            self.compact(user)
+        return name
+
+
+def _dump(events):
+    return ''.join(
+        json.dumps({
+            'ts': entry.timestamp,
+            'event': entry.event
+        }) + '\n' for entry in events)
+
+
+def _parse(text):
+    events = []
+    for line in text.splitlines():
+        if line.strip():
+            row = json.loads(line)
+            events.append(HistoryEvent(row['ts'], row['event']))
+    return events
@@ -0,0 +1,129 @@
+from flaskr.backend_test import storage_client_mock
+from flaskr.history import HistoryLog, HistoryEvent, segment_name, parse_legacy
+from google.api_core.exceptions import PreconditionFailed
+from unittest.mock import patch
+import pytest
+
+
+class Clock:
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def bucket():
+    return storage_client_mock().bucket('user_history')
+
+
+def segments(bucket, user):
+    return [blob.name for blob in bucket.list_blobs(prefix=f'{user}/')]
+
+
+def test_events_are_batched(bucket):
+    clock = Clock()
+    log = HistoryLog(bucket, flush_threshold=3, clock=clock)
+    log.append('sandy', 'Home')
+    clock.now += 1
+    log.append('sandy', 'About')
+    assert segments(bucket, 'sandy') == []
+
+    clock.now += 1
+    log.append('sandy', 'Images')
+    assert segments(bucket, 'sandy') == [segment_name('sandy', 1000.0, 1002.0)]
+    assert log.pending('sandy') == []
+    assert [entry.event for entry in log.events('sandy')
+           ] == ['Home', 'About', 'Images']
+
+
+def test_flush_on_interval(bucket):
+    clock = Clock()
+    log = HistoryLog(bucket, flush_interval=30, clock=clock)
+    log.append('sandy', 'Home')
+    clock.now += 30
+    log.append('sandy', 'About')
+
+    assert len(segments(bucket, 'sandy')) == 1
+
+
+def test_events_include_pending_and_other_users_are_apart(bucket):
+    clock = Clock()
+    log = HistoryLog(bucket, clock=clock)
+    log.append('sandy', 'Home')
+    log.flush('sandy')
+    clock.now += 1
+    log.append('sandy', 'About')
+    log.append('bob', 'Pages')
+
+    assert [entry.event for entry in log.events('sandy')] == ['Home', 'About']
+    assert log.events('bob') == [HistoryEvent(1001.0, 'Pages')]
+    assert segments(bucket, 'bob') == []
+
+
+def test_failed_flush_keeps_events(bucket):
+    log = HistoryLog(bucket, clock=Clock())
+    log.append('sandy', 'Home')
+
+    with patch.object(bucket, 'blob', side_effect=PreconditionFailed('taken')):
+        assert not log.flush()
+    assert log.pending('sandy') == [HistoryEvent(1000.0, 'Home')]
+    assert log.flush()
+    assert log.pending('sandy') == []
+
+
+def test_segments_are_merged(bucket):
+    clock = Clock()
+    log = HistoryLog(bucket, flush_threshold=1, max_segments=2, clock=clock)
+    for page in ['Home', 'About', 'Images']:
+        log.append('sandy', page)
+        clock.now += 1
+
+    assert segments(bucket, 'sandy') == [segment_name('sandy', 1000.0, 1002.0)]
+    assert [entry.event for entry in log.events('sandy')
+           ] == ['Home', 'About', 'Images']
+
+
+def test_page_reads_only_needed_segments(bucket):
+    clock = Clock()
+    log = HistoryLog(bucket, flush_threshold=2, clock=clock)
+    for page in ['Home', 'About', 'Images', 'Pages', 'Upload']:
+        log.append('sandy', page)
+        clock.now += 10
+    oldest = bucket.blob(segment_name('sandy', 1000.0, 1010.0))
+
+    with patch.object(oldest, 'download_as_text') as download:
+        newest = log.page('sandy', limit=3)
+    download.assert_not_called()
+    assert [entry.event for entry in newest] == ['Upload', 'Pages', 'Images']
+
+    older = log.page('sandy', limit=3, before=newest[-1].timestamp)
+    assert [entry.event for entry in older] == ['About', 'Home']
+    since = log.page('sandy', since=1030.0)
+    assert [entry.event for entry in since] == ['Upload', 'Pages']
+
+
+def test_parse_legacy():
+    legacy = ("['Account Began', 'Apr-01-2023 10:00:00', 'Logged In', "
+              "'Apr-01-2023 10:01:00', 'Home, again', 'Apr-01-2023 10:02:00']")
+    events = parse_legacy(legacy)
+
+    assert [entry.event for entry in events
+           ] == ['Account Began', 'Logged In', 'Home, again']
+    assert events[2].time == 'Apr-01-2023 10:02:00'
+    # Written by versions that stripped the quotes
+    stripped = "[, Account Began, Apr-01-2023 10:00:00, Home, bad time]"
+    assert [entry.event for entry in parse_legacy(stripped)
+           ] == ['Account Began']
+
+
+def test_migrate_again_after_segment_was_written(bucket):
+    log = HistoryLog(bucket, clock=Clock())
+    legacy = "['Account Began', 'Apr-01-2023 10:00:00']"
+
+    assert log.migrate('sandy', legacy) == 1
+    assert log.migrate('sandy', legacy) == 1
+    assert len(segments(bucket, 'sandy')) == 1
+    assert [entry.event for entry in log.events('sandy')] == ['Account Began']
@@ -0,0 +1,264 @@
+"""
+Graph of the links between wiki pages.
+
+The pages each page links to are found when the page is indexed for
+search and kept in the saved search index, so the graph is made from
+memory. It answers which pages link to a page, which pages are related to
+it, and which links point at no page, without downloading any page.
+
+Views answer from the graph in memory and never wait on storage. An
+upload changes the links of its page only, and pages written by other
+processes are picked up by a refresh in the background at most once per
+refresh_interval, which again only changes the pages whose links differ.
+"""
+import heapq
+import logging
+import threading
+import time
+from collections import Counter
+
+from flaskr.uploads import LINK_PATTERN
+
+DEFAULT_RELATED = 5
+DEFAULT_REFRESH_INTERVAL = 60
+PAGES_PREFIX = 'pages/'
+
+
+def link_target(url):
+    """
+    Args:
+        - Url of a markdown link (str)
+    Returns:
+        - Page name it points at, e.g. 'pitch' for '/pitch' or
+          '/pages/pitch#range', None for other sites (str)
+    """
+    if '://' in url or url.startswith(('mailto:', '#')):
+        return None
+    path = url.split('#')[0].split('?')[0].lstrip('./')
+    if path.startswith(PAGES_PREFIX):
+        path = path[len(PAGES_PREFIX):]
+    return path or None
+
+
+def link_targets(md_content):
+    """
+    Args:
+        - Markdown of a page (str)
+    Returns:
+        - Pages it links to, sorted (list of str)
+    """
+    targets = {link_target(url) for _, url in LINK_PATTERN.findall(md_content)}
+    targets.discard(None)
+    return sorted(targets)
+
+
+class LinkGraph:
+    """
+    Links between pages, both ways.
+
+    Attributes:
+        outgoing: Page name to the pages it links to (dict of sets)
+        incoming: Page name to the pages linking to it (dict of sets)
+    """
+
+    def __init__(self, outgoing):
+        """
+        Args:
+            - Page name to the pages it links to (dict)
+        """
+        self.outgoing = {}
+        self.incoming = {}
+        for page, targets in outgoing.items():
+            self.set_links(page, targets)
+
+    def set_links(self, page_name, targets):
+        """
+        Adds a page or changes the pages it links to.\n
+        Args:
+            - Page name (str), the pages it links to (iterable)
+        """
+        targets = set(targets)
+        old = self.outgoing.get(page_name, set())
+        for target in old - targets:
+            linking = self.incoming[target]
+            linking.discard(page_name)
+            if not linking:
+                del self.incoming[target]
+        for target in targets - old:
+            self.incoming.setdefault(target, set()).add(page_name)
+        self.outgoing[page_name] = targets
+
+    def remove(self, page_name):
+        """
+        Drops a page and its links, links to it stay.\n
+        Args:
+            - Page name (str)
+        """
+        if page_name in self.outgoing:
+            self.set_links(page_name, ())
+            del self.outgoing[page_name]
+
+    def backlinks(self, page_name):
+        """
+        Returns:
+            - Pages linking to the page, sorted (list)
+        """
+        return sorted(self.incoming.get(page_name, set()) - {page_name})
+
+    def related(self, page_name, limit=DEFAULT_RELATED):
+        """
+        Pages linked with the page, directly or through the same pages.
+        A direct link counts two, each page both link to or are linked
+        from counts one.\n
+        Args:
+            - Page name (str), most pages (int)
+        Returns:
+            - Most related first (list)
+        """
+        scores = Counter()
+        for neighbor in self._neighbors(page_name):
+            scores[neighbor] += 2
+            for shared in self._neighbors(neighbor):
+                scores[shared] += 1
+        scores.pop(page_name, None)
+        existing = [page for page in scores if page in self.outgoing]
+        return heapq.nsmallest(limit,
+                               existing,
+                               key=lambda page: (-scores[page], page))
+
+    def broken(self, known=()):
+        """
+        Args:
+            - Names that exist without being pages, e.g. routes (iterable)
+        Returns:
+            - Page name to the targets of its links that don't exist,
+              only for pages with some (dict of sorted lists)
+        """
+        existing = set(self.outgoing) | set(known)
+        report = {}
+        for page, targets in sorted(self.outgoing.items()):
+            missing = sorted(targets - existing)
+            if missing:
+                report[page] = missing
+        return report
+
+    def _neighbors(self, page_name):
+        return (self.outgoing.get(page_name, set()) |
+                self.incoming.get(page_name, set()))
+
+
+class PageLinks:
+    """
+    The link graph of the pages in a search index.
+
+    Attributes:
+        search: The indexed pages and their links (PageSearch)
+        known: Names links may point at that aren't pages (set)
+        refresh_interval: Seconds between refreshes from the search
+                          index (float)
+    """
+
+    def __init__(self,
+                 search,
+                 known=(),
+                 refresh_interval=DEFAULT_REFRESH_INTERVAL,
+                 clock=time.monotonic):
+        self.search = search
+        self.known = set(known)
+        self.refresh_interval = refresh_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._graph = LinkGraph({})
+        self._version = None
+        self._refreshed_at = None
+        self._refreshing = False
+        # Page name -> number of the update that last changed it
+        self._updates = 0
+        self._updated = {}
+
+    def links(self, page_name, limit=DEFAULT_RELATED):
+        """
+        Links of a page from the graph in memory, refreshed in the
+        background when due.\n
+        Args:
+            - Page name (str), most related pages (int)
+        Returns:
+            - Pages linking to it and related pages, see LinkGraph
+              (tuple of lists)
+        """
+        self._refresh_in_background()
+        with self._lock:
+            return (self._graph.backlinks(page_name),
+                    self._graph.related(page_name, limit))
+
+    def update(self, page_name, md_content):
+        """
+        Changes the links of a page that was just written.\n
+        Args:
+            - Page name (str), its markdown (str)
+        """
+        if page_name in self.search.hidden:
+            return
+        targets = link_targets(md_content)
+        with self._lock:
+            self._graph.set_links(page_name, targets)
+            self._updates += 1
+            self._updated[page_name] = self._updates
+
+    def refresh(self):
+        """
+        Brings the graph up to date with the search index, changing only
+        the pages whose links differ.
+        """
+        with self._lock:
+            started = self._updates
+        version, pages = self.search.snapshot()
+        with self._lock:
+            self._refreshed_at = self._clock()
+            if version == self._version:
+                return
+            # Updated while the snapshot was read, so newer than it
+            newer = {
+                page_name for page_name, number in self._updated.items()
+                if number > started
+            }
+            for page_name in set(self._graph.outgoing) - set(pages) - newer:
+                self._graph.remove(page_name)
+            for page_name, page in pages.items():
+                if page_name in newer:
+                    continue
+                if self._graph.outgoing.get(page_name) != set(page.links):
+                    self._graph.set_links(page_name, page.links)
+            self._version = version
+
+    def broken(self):
+        """
+        Returns:
+            - Broken links of every page, after a refresh, see
+              LinkGraph.broken (dict)
+        """
+        self.refresh()
+        with self._lock:
+            return self._graph.broken(self.known)
+
+    def _refresh_in_background(self):
+        with self._lock:
+            if self._refreshing or (
+                    self._refreshed_at is not None and
+                    self._clock() - self._refreshed_at < self.refresh_interval):
+                return
+            self._refreshing = True
+
+        def run():
+            try:
+                self.refresh()
+            except Exception:
+                logging.exception('Link graph refresh failed')
+                with self._lock:
+                    self._refreshed_at = self._clock()
+            finally:
+                with self._lock:
+                    self._refreshing = False
+
+        threading.Thread(target=run, name='link-graph-refresh',
+                         daemon=True).start()
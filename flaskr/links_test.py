@@ -0,0 +1,132 @@
+from flaskr.links import LinkGraph, PageLinks, link_target, link_targets
+from flaskr.search import PageSearch
+from flaskr.blobstore import MemoryStore
+from flaskr.catalog import BlobCatalog
+from unittest.mock import patch
+import pytest
+import threading
+
+
+class Clock:
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+PAGES = {
+    'scales': '# Scales\nBuilt on [pitch](/pitch), used in [melody](/melody)',
+    'melody': '# Melody\nNotes of a [scale](/pages/scales#major)',
+    'chord': '# Chord\n[Pitches](/pitch) at once, see [harmony](/harmony)',
+    'pitch': '# Pitch\nHow high a note is, [source](https://example.com)',
+}
+
+
+def test_link_target():
+    assert link_target('/pitch') == 'pitch'
+    assert link_target('//pitch') == 'pitch'
+    assert link_target('/pages/pitch#range') == 'pitch'
+    assert link_target('./pitch?x=1') == 'pitch'
+    assert link_target('https://example.com/pitch') is None
+    assert link_target('#top') is None
+    assert link_targets(PAGES['chord']) == ['harmony', 'pitch']
+
+
+def test_backlinks_and_broken():
+    graph = LinkGraph({name: link_targets(md) for name, md in PAGES.items()})
+    assert graph.backlinks('pitch') == ['chord', 'scales']
+    assert graph.backlinks('chord') == []
+    assert graph.broken() == {'chord': ['harmony']}
+    assert graph.broken(known={'harmony'}) == {}
+
+
+def test_related():
+    graph = LinkGraph({name: link_targets(md) for name, md in PAGES.items()})
+    # Linked both ways with scales, through pitch with chord
+    assert graph.related('melody') == ['scales', 'pitch']
+    assert graph.related('chord') == ['pitch', 'scales']
+    assert graph.related('chord', limit=1) == ['pitch']
+    assert graph.related('nothing') == []
+
+
+@pytest.fixture
+def search():
+    bucket = MemoryStore().bucket('content')
+    for name, content in PAGES.items():
+        bucket.blob(f'{name}.md').upload_from_string(content)
+    catalog = BlobCatalog(bucket, include=lambda name: name.endswith('.md'))
+    return PageSearch(bucket, catalog)
+
+
+def test_graph_changes_one_page():
+    graph = LinkGraph({name: link_targets(md) for name, md in PAGES.items()})
+    graph.set_links('chord', ['scales'])
+    assert graph.backlinks('pitch') == ['scales']
+    assert graph.backlinks('scales') == ['chord', 'melody']
+    assert 'harmony' not in graph.incoming
+
+    graph.remove('melody')
+    assert graph.backlinks('scales') == ['chord']
+    assert graph.backlinks('melody') == ['scales']
+    assert 'melody' not in graph.outgoing
+
+
+def test_page_links_follow_uploads(search):
+    links = PageLinks(search, known={'about'})
+    links.refresh()
+    assert links.links('melody') == (['scales'], ['scales', 'pitch'])
+
+    md_content = '# Harmony\n[chords](/chord), [about](/about)'
+    harmony = search.bucket.blob('harmony.md')
+    harmony.upload_from_string(md_content)
+    search.catalog.record(harmony)
+    search.update('harmony', md_content, harmony.generation)
+    with patch.object(search, 'snapshot') as snapshot:
+        links.update('harmony', md_content)
+        assert links.links('chord')[0] == ['harmony']
+    snapshot.assert_not_called()
+    assert links.broken() == {}
+
+
+def test_links_answer_from_memory(search):
+    clock = Clock()
+    links = PageLinks(search, refresh_interval=60, clock=clock)
+    links.refresh()
+    with patch.object(search, 'snapshot') as snapshot:
+        assert links.links('pitch')[0] == ['chord', 'scales']
+        clock.now += 30
+        links.links('pitch')
+    snapshot.assert_not_called()
+
+    with patch.object(links, 'refresh') as refresh:
+        clock.now += 30
+        links.links('pitch')
+        for thread in threading.enumerate():
+            if thread.name == 'link-graph-refresh':
+                thread.join()
+    refresh.assert_called_once_with()
+
+
+def test_refresh_keeps_pages_updated_meanwhile(search):
+    links = PageLinks(search)
+    links.refresh()
+    version, pages = search.snapshot()
+
+    def read_then_upload():
+        # The upload lands after the snapshot was read
+        links.update('pitch', '# Pitch\n[chord](/chord)')
+        return version + 1, pages
+
+    with patch.object(search, 'snapshot', side_effect=read_then_upload):
+        links.refresh()
+    assert links.links('chord')[0] == ['pitch']
+
+
+def test_broken_report_reads_no_pages(search):
+    links = PageLinks(search)
+    links.broken()
+    with patch.object(search.bucket, 'blob') as blob:
+        assert links.broken() == {'chord': ['harmony']}
+    blob.assert_not_called()
@@ -0,0 +1,143 @@
+"""
+In-process cache of rendered wiki pages, keyed by page name and
+the generation of the markdown blob the HTML was rendered from.
+"""
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_MAX_ENTRIES = 128
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+
+
+class RenderedPageCache:
+    """
+    LRU cache of rendered HTML for sub pages.
+
+    An entry is only served while the generation it was rendered from
+    matches the blob's current generation. With a ttl set, an entry is
+    trusted for ttl seconds after it was last verified and the metadata
+    check is skipped entirely.
+
+    Attributes:
+        max_entries: Most pages held at once (int)
+        max_bytes: Most bytes of HTML held at once (int)
+        ttl: Seconds an entry is trusted without a check (float or None)
+        hits: Lookups served from the cache (int)
+        misses: Lookups that had to render (int)
+        evictions: Entries dropped to respect the limits (int)
+    """
+
+    def __init__(self,
+                 max_entries=DEFAULT_MAX_ENTRIES,
+                 max_bytes=DEFAULT_MAX_BYTES,
+                 ttl=None,
+                 clock=time.monotonic):
+        """
+        Args:
+            - Entry limit (int), byte limit (int), ttl in seconds
+              (float or None), clock returning seconds (callable)
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._clock = clock
+        self._lock = threading.Lock()
+        # page_name -> [generation, html, size, verified_at]
+        self._entries = OrderedDict()
+        self._bytes = 0
+
+    def fresh(self, page_name):
+        """
+        Returns cached HTML without a generation check, only in ttl mode
+        and only while the entry was verified less than ttl seconds ago.\n
+        Args:
+            - Sub page name (str)
+        Returns:
+            - HTML content (str) or None
+        """
+        if self.ttl is None:
+            return None
+        with self._lock:
+            entry = self._entries.get(page_name)
+            if entry is None or self._clock() - entry[3] >= self.ttl:
+                return None
+            self._entries.move_to_end(page_name)
+            self.hits += 1
+            return entry[1]
+
+    def get(self, page_name, generation):
+        """
+        Returns cached HTML if it was rendered from this generation.\n
+        Args:
+            - Sub page name (str), blob generation (int)
+        Returns:
+            - HTML content (str) or None
+        """
+        with self._lock:
+            entry = self._entries.get(page_name)
+            if entry is None or entry[0] != generation:
+                self.misses += 1
+                return None
+            entry[3] = self._clock()
+            self._entries.move_to_end(page_name)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, page_name, generation, html):
+        """
+        Stores rendered HTML, evicting least recently used pages
+        until both limits hold. Pages larger than max_bytes are not kept.\n
+        Args:
+            - Sub page name (str), blob generation (int), HTML content (str)
+        """
+        size = len(html.encode('utf-8'))
+        with self._lock:
+            self._discard(page_name)
+            if size > self.max_bytes:
+                return
+            self._entries[page_name] = [generation, html, size, self._clock()]
+            self._bytes += size
+            while (len(self._entries) > self.max_entries or
+                   self._bytes > self.max_bytes):
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+
+    def invalidate(self, page_name=None):
+        """
+        Drops one page, or every page when no name is given.\n
+        Args:
+            - Sub page name (str or None)
+        """
+        with self._lock:
+            if page_name is None:
+                self._entries.clear()
+                self._bytes = 0
+            else:
+                self._discard(page_name)
+
+    def stats(self):
+        """
+        Returns:
+            - Counters and current usage of the cache (dict)
+        """
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_entries': self.max_entries,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+            }
+
+    def _discard(self, page_name):
+        entry = self._entries.pop(page_name, None)
+        if entry is not None:
+            self._bytes -= entry[2]
@@ -0,0 +1,78 @@
+from flaskr.page_cache import RenderedPageCache
+
+
+class clock_mock:
+
+    def __init__(self):
+        self.now = 0
+
+    def __call__(self):
+        return self.now
+
+
+def test_get_same_generation():
+    cache = RenderedPageCache()
+    cache.put('chord', 1, '<p>chord</p>')
+    assert cache.get('chord', 1) == '<p>chord</p>'
+    assert cache.hits == 1
+    assert cache.misses == 0
+
+
+def test_get_new_generation_misses():
+    cache = RenderedPageCache()
+    cache.put('chord', 1, '<p>chord</p>')
+    assert cache.get('chord', 2) is None
+    assert cache.misses == 1
+
+
+def test_evicts_least_recently_used():
+    cache = RenderedPageCache(max_entries=2)
+    cache.put('chord', 1, 'a')
+    cache.put('pitch', 1, 'b')
+    cache.get('chord', 1)
+    cache.put('scales', 1, 'c')
+
+    assert cache.get('pitch', 1) is None
+    assert cache.get('chord', 1) == 'a'
+    assert cache.evictions == 1
+
+
+def test_byte_limit():
+    cache = RenderedPageCache(max_bytes=10)
+    cache.put('chord', 1, '12345')
+    cache.put('pitch', 1, '123456')
+    cache.put('scales', 1, 'x' * 11)
+
+    assert cache.stats()['entries'] == 1
+    assert cache.stats()['bytes'] == 6
+    assert cache.get('scales', 1) is None
+
+
+def test_fresh_only_in_ttl_mode():
+    cache = RenderedPageCache()
+    cache.put('chord', 1, 'a')
+    assert cache.fresh('chord') is None
+
+
+def test_fresh_expires_after_ttl():
+    clock = clock_mock()
+    cache = RenderedPageCache(ttl=30, clock=clock)
+    cache.put('chord', 1, 'a')
+
+    clock.now = 29
+    assert cache.fresh('chord') == 'a'
+    clock.now = 30
+    assert cache.fresh('chord') is None
+    # A successful generation check trusts the entry for another ttl
+    assert cache.get('chord', 1) == 'a'
+    assert cache.fresh('chord') == 'a'
+
+
+def test_invalidate():
+    cache = RenderedPageCache()
+    cache.put('chord', 1, 'a')
+    cache.put('pitch', 1, 'b')
+    cache.invalidate('chord')
+    assert cache.get('chord', 1) is None
+    cache.invalidate()
+    assert cache.stats()['entries'] == 0
@@ -1,12 +1,15 @@
 
-from flask import Flask, render_template, request, flash, redirect, url_for
-from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required
-from google.cloud import storage
+from flask import Flask, render_template, request, flash, redirect, url_for, session, jsonify
+from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
 import os
-import uuid
 import zipfile
-from flaskext.markdown import Markdown
 import csv
+from flaskr.commands import make_commands
+from flaskr.zip_ingest import ZipLimitError
+from flaskr.passwords import HasherBusy
+from flaskr.throttle import Throttled
+from flaskr.storage_policy import start_deadline, clear_deadline, DEFAULT_REQUEST_DEADLINE
+from google.api_core.exceptions import GatewayTimeout, RetryError
 
 def make_endpoints(app, Backend):
     """Connects the frontend with the established routes and the backend.
@@ -14,39 +17,48 @@ def make_endpoints(app, Backend):
     Attributes:
         app: Flask instance.
         login_manager: LoginManager object that takes care of the user's login.
-        Markdown: Converts the contents of Markdown files to readable text.
     """
 
     login_manager = LoginManager()
     login_manager.init_app(app)
     login_manager.session_protection = 'strong'
-    Markdown(app)
     Back_end = Backend(app)
+    make_commands(app, Back_end)
 
+    @app.before_request
+    def start_storage_deadline():
+        """Bounds the time a request spends in storage, over all its calls."""
+        start_deadline(
+            app.config.get('STORAGE_REQUEST_DEADLINE', DEFAULT_REQUEST_DEADLINE))
 
+    @app.teardown_request
+    def clear_storage_deadline(error=None):
+        clear_deadline()
 
     class User(UserMixin):
         """User Class that is used by the Login Manager and browser.
 
-        It is stored in user's browser and is used to authorize the user when using the wiki.
+        Its id, the username, is stored in the user's session and identifies them on every request,
+        so concurrent requests of different users never share state on the Backend.
 
         Attributes:
+            id: The user's username
             name: String representation of User's name
-            id: UUID identifier for the user
             
         """
 
-        def __init__(self, name):
-            """Initializes the User object with the name passed as parameter and assigns it an UUID.
+        def __init__(self, username, name=None):
+            """Initializes the User object with the username and name passed as parameters.
 
             Args:
-                name: String representation of the user's name
+                username: The user's username
+                name: String representation of the user's name, the username if missing
             """
-            self.name = f'{name}'
-            self.id = f'{uuid.uuid4()}'
+            self.id = f'{username}'
+            self.name = f'{name or username}'
 
         def get_id(self):
-            return self.name
+            return self.id
 
         def is_authenticated(self):
             return True
@@ -58,16 +70,35 @@ def make_endpoints(app, Backend):
             return False
 
     @login_manager.user_loader
-    def load_user(name):
+    def load_user(username):
         """
-        Creates and returns a User object with name passed as parameter.
+        Creates and returns the User of the current session.
 
         Args:
-            name: String representation of user's name.
+            username: The user's username, stored in the session by login_user.
         """
-        user = User(name)
+        user = User(username, session.get('name'))
         return user
 
+    def log_in(username, name):
+        """Logs in the user for this and the following requests of their session.
+
+        Args:
+            username: The user's username.
+            name: String representation of user's name.
+        """
+        session['name'] = name
+        login_user(User(username.lower(), name))
+
+    def visit(page_name):
+        """Adds a page to the history of the user making the request, if they are logged in.
+
+        Args:
+            page_name: Name of the visited page.
+        """
+        if current_user.is_authenticated:
+            Back_end.add_to_history(current_user.get_id(), page_name)
+
     @app.route('/')
     # @app.route('/main')
     def home():
@@ -75,8 +106,7 @@ def make_endpoints(app, Backend):
 
         GET: Home page
         """
-        if Back_end.current_username != "":
-            Back_end.add_to_history("Home")
+        visit("Home")
         return render_template("main.html")
 
     @app.route('/pages', methods=['GET','POST'])
@@ -93,7 +123,8 @@ def make_endpoints(app, Backend):
 
         if request.args.get("sort_by")=="Popularity":
             sort="Popularity"
-            page_names=Back_end.page_sort_by_popularity()
+            limit = request.args.get("limit", type=int)
+            page_names=Back_end.page_sort_by_popularity(limit)
             #get list of page names by Popularity
         # default list is equal to Alphabetically
         return render_template('pages.html', sort=sort, page_names=page_names)
@@ -104,14 +135,42 @@ def make_endpoints(app, Backend):
         """Returns the parametrized sub_page page. It uses the sub_page passed as part of the route to 
         check the Backend for the corresponding wiki page and sends the user to that user-selected markdown file that is now displayed as HTML.
 
-        GET: Gets the corresponding MD file from the Backend, sends the user to a new page that displays the MD as HTML.
+        GET: Gets the corresponding MD file from the Backend, sends the user to a new page that displays the MD as HTML,
+        with the pages linking to it and related pages from the Backend's link graph.
         """
-        if Back_end.current_username != "":
-            sub_page_cap=sub_page.capitalize()
-            Back_end.add_to_history(sub_page_cap)
+        visit(sub_page.capitalize())
             
         html_content = Back_end.get_wiki_page(sub_page)    
-        return render_template(f'sub_pages.html', content=html_content)
+        backlinks, related = Back_end.get_page_links(sub_page)
+        return render_template(f'sub_pages.html', content=html_content,
+                               backlinks=backlinks, related=related)
+
+    @app.route('/suggest')
+    def suggest():
+        """Returns, as JSON, the page names and headings with a word starting with ?prefix=,
+        most viewed pages first. Answered from memory for every keystroke of the search box.
+
+        GET: List of {"text", "page", "url"} objects, empty without a prefix.
+        """
+        prefix = request.args.get("prefix", "")
+        limit = app.config.get('SUGGEST_RESULTS', 8)
+        return jsonify([{
+            "text": suggestion.text,
+            "page": suggestion.page,
+            "url": suggestion.url
+        } for suggestion in Back_end.suggest(prefix, limit)])
+
+    @app.route('/search')
+    def search():
+        """Returns the pages matching the words of ?q=, best first, with highlighted snippets.
+        Answered from the Backend's in-memory search index.
+
+        GET: Search page with the results, the search form alone without a query.
+        """
+        query = request.args.get("q", "").strip()
+        limit = app.config.get('SEARCH_RESULTS', 20)
+        results = Back_end.search(query, limit) if query else []
+        return render_template('search.html', query=query, results=results)
 
     #@app.route('/pages', methods=['GET'])
     #def dropdown():
@@ -124,8 +183,7 @@ def make_endpoints(app, Backend):
 
         GET: Calls Backend to get all Authors information and pictures, then sends the user to the about page that shows all the author's corresponding info.
         """
-        if Back_end.current_username != "":
-            Back_end.add_to_history("About")
+        visit("About")
         authors = Back_end.get_about()
         return render_template('about.html', authors=authors)
 
@@ -161,14 +219,20 @@ def make_endpoints(app, Backend):
         }
 
         # be = backend.Backend(app)
-        valid, data = Back_end.sign_in(user_check)
+        try:
+            valid, data = Back_end.sign_in(user_check, request.remote_addr)
+        except Throttled as error:
+            return render_template('login.html', error=error.description), 429, {
+                'Retry-After': str(int(error.retry_after) + 1)
+            }
+        except HasherBusy as error:
+            return render_template('login.html', error=str(error)), 503
 
         if not valid:
             return render_template('login.html',
                                    error='Incorrect Username and/or Password')
 
-        user = load_user(data)
-        login_user(user)
+        log_in(user_check['username'], data)
         return redirect(url_for('welcome'))
 
     @app.route('/logout')
@@ -178,9 +242,10 @@ def make_endpoints(app, Backend):
 
         GET: Log out and redirects user to initial page
         """
-        if Back_end.current_username != "":
-            Back_end.add_to_history("Logged Out")
+        if current_user.is_authenticated:
+            Back_end.end_session(current_user.get_id())
         logout_user()
+        session.pop('name', None)
         return redirect('/')
 
     @app.route('/upload', methods=['GET', 'POST'])
@@ -191,11 +256,11 @@ def make_endpoints(app, Backend):
 
         GET: Upload Page
         POST: Takes the file passed as an input in the form and sents it to the Backend, redirects the user to the Home page.
+        For a .zip it shows what happened to each file in the archive instead.
         """
 
         #TODO A user can overwrite a pre-existing file, some check should to be created when uploading
-        if Back_end.current_username != "":
-            Back_end.add_to_history("Upload")
+        visit("Upload")
         if request.method == 'POST':
             uploaded_file = request.files['upload']
             filename = os.path.basename(uploaded_file.filename)
@@ -208,16 +273,12 @@ def make_endpoints(app, Backend):
                 return redirect(url_for("home"))
             #case where the file is a zip
             elif filename.endswith('.zip'):
-                with zipfile.ZipFile(uploaded_file, 'r') as z:
-                    for zipped_image in z.namelist():
-                        zip_end = zipped_image.split(".")[-1].lower()
-                        #upload the files that are images only
-                        if zipped_image.endswith(
-                                '.jpg') or zipped_image.endswith(
-                                    '.jpeg') or zipped_image.endswith('.png'):
-                            Back_end.upload(z.open(zipped_image), zipped_image)
-                            print("FILENAME\nrfeionffoij", zipped_image)
-                return redirect(url_for("home"))
+                #upload the files that are images only, in parallel
+                try:
+                    results = Back_end.upload_zip(uploaded_file)
+                except (ZipLimitError, zipfile.BadZipFile) as error:
+                    return render_template('upload.html', error=str(error))
+                return render_template('upload.html', results=results)
             else:
                 return render_template('upload.html',
                                        error='Incorrect File Type')
@@ -230,25 +291,29 @@ def make_endpoints(app, Backend):
         When a POST request is received it takes the information passed in the
         form and creates a blob containing it that is uploaded to the Google Cloud Storage comments bucket. 
 
-        GET: Comments page with input form for users to upload their own content.
+        GET: Comments page with input form for users to upload their own content, newest first and
+        paginated with ?before=<timestamp of the last comment shown>.
         POST: Takes the message passed as an input in the form and sents it to the Backend, refreshes the page to display newly created comments.
         """
-        Back_end.add_to_history("Comments")
-        comment_list = Back_end.get_comments()
+        visit("Comments")
+        per_page = app.config.get('COMMENTS_PER_PAGE', 20)
+        # A before that isn't a number is ignored, as on /history
+        before = request.args.get("before", type=float)
+        error = None
         if request.method == 'POST':
             message = request.form.get("comment")
-            author = request.form.get("hidden")
+            author = current_user.name if current_user.is_authenticated else request.form.get("hidden")
             if not message:
-                return render_template('comments.html',
-                                       comment_list=comment_list , error='Comment content is empty. Invalid Comment. Please fill out the form.')
-            if len(message) > 500:
-                return render_template('comments.html',
-                                       comment_list=comment_list , error='Comment is too long, limit your message to 500 characters.')
-            uploaded = Back_end.upload_comment(author, message)
-            if uploaded:
+                error = 'Comment content is empty. Invalid Comment. Please fill out the form.'
+            elif len(message) > 500:
+                error = 'Comment is too long, limit your message to 500 characters.'
+            elif Back_end.upload_comment(author, message):
                 print("File was uploaded Succesfully")
-            comment_list = Back_end.get_comments()
-        return render_template('comments.html', comment_list=comment_list)
+            # The new comment is on the first page
+            before = None
+        # Served from the Backend's comment cache, which the upload wrote through
+        comment_list, next_before = Back_end.get_comment_page(per_page, before)
+        return render_template('comments.html', comment_list=comment_list, next_before=next_before, error=error)
 
     @app.route('/signup', methods=['GET'])
     def get_signup():
@@ -259,7 +324,7 @@ def make_endpoints(app, Backend):
         return render_template('signup.html')
 
     @app.route('/auth_signup', methods=['POST'])
-    def sign_up(load_user=load_user):
+    def sign_up():
         """When response is POST it takes the name, username, password information in the form and passes it on to the Backend to confirm if valid.
         If valid, it logins the user and redirects it to the Welcome page, else: it returns an error and the same page.
 
@@ -271,13 +336,19 @@ def make_endpoints(app, Backend):
             'password': request.form.get('Password')
         }
 
-        valid, data = Back_end.sign_up(new_user)
+        try:
+            valid, data = Back_end.sign_up(new_user, request.remote_addr)
+        except Throttled as error:
+            return render_template('signup.html', error=error.description), 429, {
+                'Retry-After': str(int(error.retry_after) + 1)
+            }
+        except HasherBusy as error:
+            return render_template('signup.html', error=str(error)), 503
 
         if not valid:
             return render_template('signup.html', error='User already exists')
 
-        user = load_user(data)
-        login_user(user)
+        log_in(new_user['username'], data)
         return redirect(url_for('welcome'))
 
     @app.route('/images', methods=['GET', 'POST'])
@@ -285,12 +356,14 @@ def make_endpoints(app, Backend):
         """It uses the Backend to look for all images in the GCS image bucket and returns a list of links to each one.
         It sends the user to the Images page and passes the image list as a parameter.
 
-        GET: Calls Backend and fetch images, sends user to the Images page where are images are displayed.
+        GET: Calls Backend and fetch one page of images (?page=&per_page=), sends user to the Images page where are images are displayed.
         """
-        if Back_end.current_username != "":
-            Back_end.add_to_history("Images")
-        image_lst = Back_end.get_image()
-        return render_template('images.html', image_lst=image_lst)
+        visit("Images")
+        page = max(1, request.args.get("page", 1, type=int))
+        per_page = request.args.get("per_page", 24, type=int)
+        per_page = min(max(1, per_page), 100)
+        image_lst, page_count = Back_end.get_image_page(page, per_page)
+        return render_template('images.html', image_lst=image_lst, page=page, per_page=per_page, page_count=page_count)
 
     @app.errorhandler(405)
     def invalid_method(error):
@@ -302,6 +375,27 @@ def make_endpoints(app, Backend):
         flash('Incorrect method used, try again')
         return redirect(url_for('home')), 405
 
+    @app.errorhandler(413)
+    def too_large(error):
+        """Error handler for an upload over UPLOAD_MAX_SIZE or a request over MAX_CONTENT_LENGTH,
+        raised while the file is still being received.
+
+        Args:
+            error: The RequestEntityTooLarge raised.
+        """
+        return render_template('upload.html', error='File is too large'), 413
+
+    @app.errorhandler(GatewayTimeout)
+    @app.errorhandler(RetryError)
+    def storage_too_slow(error):
+        """Error handler for a request whose storage calls ran past STORAGE_REQUEST_DEADLINE,
+        timed out or ran out of retries, or that GCS timed out.
+
+        Args:
+            error: The GatewayTimeout (DeadlineExceeded is one) or RetryError raised.
+        """
+        return 'Storage took too long, try again', 504
+
     @app.route('/log')
     def log():
         return render_template('log.html')
@@ -319,12 +413,19 @@ def make_endpoints(app, Backend):
     """
 
     @app.route('/history', methods=['GET', 'POST'])
+    @login_required
     def history():
         '''This takes the user's history and sendss it to the frontend page history.html to display the user's history.
         Personal preference, but the code below isn't necessary since the user doesn't need to know they're viewing their history.'''
-        # if Back_end.current_username is not "":
-        #     Back_end.add_to_history("History")
-        history_summary = Back_end.get_history()
-        history_summary.reverse()
-        user_name = Back_end.current_username        
-        return render_template('history.html', history_summary = history_summary, user_name = user_name)
\ No newline at end of file
+        # visit("History")
+        # Newest events first, paginated with ?before=<timestamp of the last event shown>
+        per_page = app.config.get('HISTORY_PER_PAGE', 50)
+        before = request.args.get("before", type=float)
+        history_summary = Back_end.get_history(current_user.get_id(), per_page + 1, before)
+        next_before = None
+        if len(history_summary) > per_page:
+            history_summary = history_summary[:per_page]
+            next_before = history_summary[-1].timestamp
+        user_name = current_user.name
+        return render_template('history.html', history_summary = history_summary, user_name = user_name,
+                               next_before = next_before)
\ No newline at end of file
@@ -3,8 +3,19 @@ from flaskr.pages import make_endpoints
 from unittest.mock import MagicMock, Mock, patch, ANY
 from flaskr import create_app
 from werkzeug.datastructures import FileStorage
+from flaskr.zip_ingest import ZipResult
+from flaskr.uploads import SpooledUpload
+from flaskr.history import HistoryEvent
+from flaskr.passwords import HasherBusy
+from flaskr.throttle import Throttled
+from flaskr.search import SearchResult
+from flaskr.suggest import Suggestion
+from markupsafe import Markup
+from google.api_core.exceptions import GatewayTimeout, RetryError
+from flaskr.backend import Backend
+from flaskr.backend_test import storage_client_mock
 import pytest
-import flask, os
+import flask, os, io, hashlib, threading
 
 
 @pytest.fixture
@@ -64,11 +75,15 @@ def test_pages(client, mock_backend):
 @patch("flaskr.pages.render_template")
 def test_pages_next(mock_render, client, mock_backend):
     mock_backend.get_wiki_page.return_value = "Test Content"
+    mock_backend.get_page_links.return_value = (["pitch"], ["chord"])
     mock_render.return_value = "Test Content"
 
     resp = client.get("/pages/sub_pages")
 
-    mock_render.assert_called_once_with("sub_pages.html", content="Test Content")
+    mock_render.assert_called_once_with("sub_pages.html",
+                                        content="Test Content",
+                                        backlinks=["pitch"],
+                                        related=["chord"])
     print(resp.data)
     assert resp.status_code == 200
     assert b"Test Content" == resp.data
@@ -96,14 +111,43 @@ def test_get_login(client):
     assert b"<h1>Login</h1>" in resp.data
 
 def test_comments_upload(client,mock_backend):
+    mock_backend.get_comment_page.return_value = ([], None)
     resp = client.post("/comments", data = {"comment": "helloworld", "hidden":"sandy"})
     mock_backend.upload_comment.assert_called_once()
+    mock_backend.get_comment_page.assert_called_once_with(20, None)
+
+def test_comments_upload_empty(client, mock_backend):
+    mock_backend.get_comment_page.return_value = ([], None)
+    resp = client.post("/comments", data={"comment": "", "hidden": "sandy"})
+    mock_backend.upload_comment.assert_not_called()
+    assert b"Comment content is empty" in resp.data
 
 def test_comments_view(client,mock_backend):
+    mock_backend.get_comment_page.return_value = ([], None)
     resp = client.get("/comments")
     assert resp.status_code ==200
     assert b"Post your comment here!" in resp.data
 
+def test_comments_older_page(client, mock_backend):
+    mock_backend.get_comment_page.return_value = ([{
+        "user": "sandy",
+        "time": "2023-04-08 05:56",
+        "content": "Hola Mundo"
+    }], "1680933371.7")
+    resp = client.get("/comments", query_string={"before": "1680933999.1"})
+
+    assert resp.status_code == 200
+    mock_backend.get_comment_page.assert_called_once_with(20, 1680933999.1)
+    assert b"Hola Mundo" in resp.data
+    assert b"/comments?before=1680933371.7" in resp.data
+
+def test_comments_invalid_before_shows_first_page(client, mock_backend):
+    mock_backend.get_comment_page.return_value = ([], None)
+    resp = client.get("/comments", query_string={"before": "abc"})
+
+    assert resp.status_code == 200
+    mock_backend.get_comment_page.assert_called_once_with(20, None)
+
 
 @patch("uuid.uuid4")
 def test_auth_login_success(mock_uuid, client, mock_backend):
@@ -119,6 +163,32 @@ def test_auth_login_success(mock_uuid, client, mock_backend):
     assert b"Welcome Test Name" in resp.data
 
 
+def test_auth_login_throttles_client_behind_proxy(client, mock_backend):
+    mock_backend.sign_in.return_value = (False, "Test Name")
+    client.post("/auth_login",
+                data={
+                    "Username": "U",
+                    "Password": "P"
+                },
+                headers={"X-Forwarded-For": "203.0.113.7"})
+    mock_backend.sign_in.assert_called_once_with(ANY, "203.0.113.7")
+
+
+def test_untrusted_forwarded_for_is_ignored(mock_backend):
+    app = create_app({
+        'TESTING': True,
+        'PROXY_FIX_X_FOR': 0,
+    }, mock_backend)
+    mock_backend.sign_in.return_value = (False, "Test Name")
+    app.test_client().post("/auth_login",
+                           data={
+                               "Username": "U",
+                               "Password": "P"
+                           },
+                           headers={"X-Forwarded-For": "203.0.113.7"})
+    mock_backend.sign_in.assert_called_once_with(ANY, "127.0.0.1")
+
+
 def test_auth_login_fail(client, mock_backend):
     mock_backend.sign_in.return_value = (False, "Test Name")
     resp = client.post("/auth_login", data={"Username": "U", "Password": "P"})
@@ -126,6 +196,21 @@ def test_auth_login_fail(client, mock_backend):
     assert b"Incorrect Username and/or Password" in resp.data
 
 
+def test_auth_login_busy(client, mock_backend):
+    mock_backend.sign_in.side_effect = HasherBusy('Too many logins at once, try again')
+    resp = client.post("/auth_login", data={"Username": "U", "Password": "P"})
+    assert resp.status_code == 503
+    assert b"Too many logins at once" in resp.data
+
+
+def test_auth_login_throttled(client, mock_backend):
+    mock_backend.sign_in.side_effect = Throttled(9.5)
+    resp = client.post("/auth_login", data={"Username": "U", "Password": "P"})
+    assert resp.status_code == 429
+    assert resp.headers['Retry-After'] == '10'
+    assert b"Too many attempts" in resp.data
+
+
 def test_logout(client, mock_backend):
     resp = client.get("/logout", follow_redirects=True)
     assert resp.status_code == 200
@@ -148,6 +233,65 @@ def test_upload_success(client, mock_backend):
     assert b"Music Theory Wiki" in resp.data
 
 
+def test_upload_is_spooled(client, mock_backend):
+    data = b'# Page\n[pitch](/pitch)\n'
+    file_ = FileStorage(io.BytesIO(data), filename="page.md")
+    client.post("/upload", data={"upload": file_})
+
+    uploaded = mock_backend.upload.call_args[0][0]
+    assert isinstance(uploaded.stream, SpooledUpload)
+    assert uploaded.stream.sha256 == hashlib.sha256(data).hexdigest()
+    assert uploaded.stream.links == [('pitch', '/pitch')]
+
+
+def test_upload_too_large(mock_backend):
+    app = create_app({
+        'TESTING': True,
+        'LOGIN_DISABLED': True,
+        'UPLOAD_MAX_SIZE': 4
+    }, mock_backend)
+    file_ = FileStorage(io.BytesIO(b'0123456789'), filename="big.png")
+    resp = app.test_client().post("/upload", data={"upload": file_})
+
+    assert resp.status_code == 413
+    assert b"File is too large" in resp.data
+    mock_backend.upload.assert_not_called()
+
+
+def test_history_is_paginated(login_app, login_client, mock_backend):
+    client = login_client
+    login_app.config['HISTORY_PER_PAGE'] = 2
+    mock_backend.sign_in.return_value = (True, "Sandy")
+    client.post("/auth_login", data={"Username": "Sandy", "Password": "P"})
+    mock_backend.get_history.return_value = [
+        HistoryEvent(1680000300.0, 'Home'),
+        HistoryEvent(1680000200.0, 'About'),
+        HistoryEvent(1680000100.0, 'Scales')
+    ]
+    resp = client.get("/history?before=1680000400")
+
+    assert resp.status_code == 200
+    mock_backend.get_history.assert_called_once_with('sandy', 3, 1680000400.0)
+    assert b"History of Sandy" in resp.data
+    assert b"Home" in resp.data
+    assert b"Scales" not in resp.data
+    assert b"/history?before=1680000200.0" in resp.data
+
+
+def test_upload_zip(client, mock_backend):
+    mock_backend.upload_zip.return_value = [
+        ZipResult("a.png", "uploaded"),
+        ZipResult("notes.txt", "skipped")
+    ]
+    file_ = FileStorage(filename="images.zip", content_type="application/zip")
+    resp = client.post("/upload", data={"upload": file_})
+
+    assert resp.status_code == 200
+    mock_backend.upload_zip.assert_called_once()
+    assert b"a.png: uploaded" in resp.data
+    assert b"notes.txt: skipped" in resp.data
+
+
 def test_upload_fail(client):
     file_ = FileStorage(filename="test_dir/test_file.bad")
     resp = client.post("/upload", data={"upload": file_}, follow_redirects=True)
@@ -209,15 +353,27 @@ def test_signup_fail(client, mock_backend):
 
 
 def test_get_allimages(client, mock_backend):
-    mock_backend.get_image.return_value = ["pic0", "pic1"]
+    mock_backend.get_image_page.return_value = ([("pic0", "full0"),
+                                                 ("pic1", "full1")], 1)
     resp = client.get("/images")
     assert resp.status_code == 200
     assert b"src=\"pic0\" alt=\"pic0\"" in resp.data
     assert b"src=\"pic1\" alt=\"pic1\"" in resp.data
+    assert b"<a href=\"full0\">" in resp.data
+    assert b"Next" not in resp.data
+
+
+def test_get_images_paginated(client, mock_backend):
+    mock_backend.get_image_page.return_value = ([("pic2", "full2")], 3)
+    resp = client.get("/images", query_string={"page": 2, "per_page": 1})
+    assert resp.status_code == 200
+    mock_backend.get_image_page.assert_called_once_with(2, 1)
+    assert b"/images?page=1&per_page=1" in resp.data
+    assert b"/images?page=3&per_page=1" in resp.data
 
 
 def test_invalid_method(client, mock_backend):
-    mock_backend.get_image = lambda: abort(405)
+    mock_backend.get_image_page = lambda page, per_page: abort(405)
     resp = client.get("/images", follow_redirects=True)
     assert resp.status_code == 405
     assert b"<a href=\"/\">/</a>" in resp.data
@@ -242,3 +398,121 @@ def test_page_sort_pop(client, mock_backend):
     print(str_data)
     idx_3, idx_2, idx_1 = str_data.find('3_test'), str_data.find('2_test'), str_data.find('1_test')
     assert -1 < idx_3 < idx_2 < idx_1
+
+
+def test_page_sort_pop_limit(client, mock_backend):
+    mock_backend.page_sort_by_popularity.return_value = ['3_test']
+    resp = client.get('/pages',
+                      query_string={
+                          'sort_by': 'Popularity',
+                          'limit': '1'
+                      })
+
+    assert resp.status_code == 200
+    mock_backend.page_sort_by_popularity.assert_called_once_with(1)
+
+
+def test_concurrent_sessions_do_not_share_users():
+    app = create_app({'TESTING': True},
+                     lambda app: Backend(app, SC=storage_client_mock()))
+    clients = {}
+    for name in ['Sandy', 'Bob', 'Ana']:
+        clients[name] = app.test_client()
+        clients[name].post("/auth_signup",
+                           data={
+                               "Name": name,
+                               "Username": name,
+                               "Password": "secret"
+                           })
+    start = threading.Barrier(len(clients))
+    errors = []
+
+    def browse(name, client):
+        start.wait()
+        for _ in range(10):
+            resp = client.get("/welcome")
+            if f"Welcome {name}".encode() not in resp.data:
+                errors.append(name)
+            client.get("/about")
+
+    threads = [
+        threading.Thread(target=browse, args=item) for item in clients.items()
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    for name, client in clients.items():
+        resp = client.get("/history")
+        assert f"History of {name}".encode() in resp.data
+        assert resp.data.count(b"About") >= 10
+
+
+def test_storage_deadline_returns_504():
+    app = create_app({
+        'TESTING': True,
+        'STORAGE_REQUEST_DEADLINE': 1e-9
+    }, lambda app: Backend(app, SC=storage_client_mock()))
+    resp = app.test_client().get("/images")
+    assert resp.status_code == 504
+
+
+@pytest.mark.parametrize("error", [
+    RetryError('Deadline of 20s exceeded', None),
+    GatewayTimeout('Upstream timed out'),
+])
+def test_storage_timeouts_return_504(client, mock_backend, error):
+    mock_backend.get_comment_page.side_effect = error
+    resp = client.get("/comments")
+    assert resp.status_code == 504
+    assert b"Storage took too long" in resp.data
+    assert b"Storage took too long" in resp.data
+
+
+def test_search(client, mock_backend):
+    mock_backend.search.return_value = [
+        SearchResult('scales', 2.5, Markup('Major <mark>scales</mark>'))
+    ]
+    resp = client.get("/search", query_string={"q": "scales"})
+
+    assert resp.status_code == 200
+    mock_backend.search.assert_called_once_with("scales", 20)
+    assert b'<a href="/pages/scales">scales</a>' in resp.data
+    assert b"Major <mark>scales</mark>" in resp.data
+
+
+def test_search_without_query(client, mock_backend):
+    resp = client.get("/search")
+
+    assert resp.status_code == 200
+    mock_backend.search.assert_not_called()
+
+
+def test_suggest(client, mock_backend):
+    mock_backend.suggest.return_value = [
+        Suggestion('Major scale', 'scales', '/pages/scales#major-scale', 1)
+    ]
+    resp = client.get("/suggest", query_string={"prefix": "maj"})
+
+    assert resp.status_code == 200
+    mock_backend.suggest.assert_called_once_with("maj", 8)
+    assert resp.get_json() == [{
+        "text": "Major scale",
+        "page": "scales",
+        "url": "/pages/scales#major-scale"
+    }]
+
+
+def test_pages_next_shows_links(client, mock_backend):
+    mock_backend.get_wiki_page.return_value = "<h1>Scales</h1>"
+    mock_backend.get_page_links.return_value = (["melody"],
+                                                ["chord", "harmony"])
+
+    resp = client.get("/pages/scales")
+
+    assert resp.status_code == 200
+    assert b"Pages linking here" in resp.data
+    assert b'<a href="/pages/melody">melody</a>' in resp.data
+    assert b'<a href="/pages/harmony">harmony</a>' in resp.data
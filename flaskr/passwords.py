@@ -0,0 +1,217 @@
+"""
+Password hashing and checking off the request threads.
+
+bcrypt runs in a small process pool so a burst of logins can use at most
+workers cores, and at most max_concurrent hashes wait for the pool at
+once. The workers are started by a fork server, not forked from the
+app, so they don't inherit its threads, locks and storage clients. A
+pool left broken by a worker that died is replaced. Hashes made with a
+cost other than the configured one are remade on the next successful
+login.
+"""
+import base64
+import hashlib
+import logging
+import multiprocessing
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+DEFAULT_ROUNDS = 12
+DEFAULT_WORKERS = 2
+DEFAULT_QUEUE_TIMEOUT = 10
+LATENCY_SAMPLES = 1024
+
+
+class HasherBusy(RuntimeError):
+    """
+    Too many passwords are being hashed or checked already.
+    """
+
+
+def prehash(password, username):
+    """
+    Args:
+        - Password (str), username (str)
+    Returns:
+        - What bcrypt is given, sha256 of the salted password in base64, so
+          long passwords aren't cut at bcrypt's 72 bytes (bytes)
+    """
+    mixed = f'{password}hi{username}'
+    return base64.b64encode(hashlib.sha256(mixed.encode()).digest())
+
+
+def hash_rounds(hashed):
+    """
+    Args:
+        - A bcrypt hash, e.g. b'$2b$12$...' (bytes)
+    Returns:
+        - Its cost (int)
+    """
+    return int(hashed.split(b'$')[2])
+
+
+def pool_context():
+    """
+    Returns:
+        - How pool workers are started: forkserver where there is one,
+          spawn otherwise (multiprocessing context)
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+# Run in the workers: module level and given only bytes and ints, so
+# nothing of the app is sent to them
+def _hash(encoded, rounds):
+    return bcrypt.hashpw(encoded, bcrypt.gensalt(rounds))
+
+
+def _check(encoded, hashed):
+    return bcrypt.checkpw(encoded, hashed)
+
+
+class PasswordHasher:
+    """
+    Hashes and checks passwords on a process pool.
+
+    Attributes:
+        rounds: bcrypt cost of new hashes (int)
+        workers: Processes hashing, 0 to hash on the calling thread (int)
+        max_concurrent: Most hashes running or waiting for the pool (int)
+        queue_timeout: Seconds a request waits for a slot (float)
+    """
+
+    def __init__(self,
+                 rounds=DEFAULT_ROUNDS,
+                 workers=DEFAULT_WORKERS,
+                 max_concurrent=None,
+                 queue_timeout=DEFAULT_QUEUE_TIMEOUT,
+                 clock=time.perf_counter):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_concurrent = max_concurrent or max(workers, 1) * 4
+        self.queue_timeout = queue_timeout
+        self._clock = clock
+        self._slots = threading.BoundedSemaphore(self.max_concurrent)
+        self._lock = threading.Lock()
+        self._pool = None
+        self._latencies = {
+            'hash': deque(maxlen=LATENCY_SAMPLES),
+            'verify': deque(maxlen=LATENCY_SAMPLES)
+        }
+        self._counts = {
+            'hash': 0,
+            'verify': 0,
+            'rehash': 0,
+            'busy': 0,
+            'restarts': 0
+        }
+
+    def hash(self, password, username):
+        """
+        Args:
+            - Password (str), username (str)
+        Returns:
+            - bcrypt hash with the configured cost (bytes)
+        Raises:
+            - HasherBusy
+        """
+        return self._run('hash', _hash, prehash(password, username),
+                         self.rounds)
+
+    def verify(self, password, username, hashed):
+        """
+        Checks a password and, if it matches a hash of another cost,
+        makes a hash with the configured cost.\n
+        Args:
+            - Password (str), username (str), the stored hash (bytes)
+        Returns:
+            - (Boolean) whether it matches, the new hash to store or None
+        Raises:
+            - HasherBusy
+        """
+        encoded = prehash(password, username)
+        if not self._run('verify', _check, encoded, hashed):
+            return False, None
+        if hash_rounds(hashed) == self.rounds:
+            return True, None
+        with self._lock:
+            self._counts['rehash'] += 1
+        return True, self._run('hash', _hash, encoded, self.rounds)
+
+    def stats(self):
+        """
+        Returns:
+            - Counts and latency in ms (count, mean, p50, p95, max) of
+              recent hashes and checks (dict)
+        """
+        with self._lock:
+            stats = dict(self._counts)
+            stats['rounds'] = self.rounds
+            for name, samples in self._latencies.items():
+                ordered = sorted(samples)
+                if not ordered:
+                    stats[f'{name}_ms'] = None
+                    continue
+                stats[f'{name}_ms'] = {
+                    'count': len(ordered),
+                    'mean': sum(ordered) / len(ordered) * 1000,
+                    'p50': ordered[len(ordered) // 2] * 1000,
+                    'p95': ordered[int(len(ordered) * 0.95)] * 1000,
+                    'max': ordered[-1] * 1000
+                }
+            return stats
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown()
+
+    def _run(self, name, func, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            with self._lock:
+                self._counts['busy'] += 1
+            raise HasherBusy('Too many logins at once, try again')
+        try:
+            started = self._clock()
+            if self.workers:
+                result = self._submit(func, *args)
+            else:
+                result = func(*args)
+            elapsed = self._clock() - started
+        finally:
+            self._slots.release()
+        with self._lock:
+            self._counts[name] += 1
+            self._latencies[name].append(elapsed)
+        return result
+
+    def _submit(self, func, *args):
+        # A worker that died (OOM kill, crash) breaks the whole pool:
+        # start another and try once more
+        for _ in range(2):
+            pool = self._get_pool()
+            try:
+                return pool.submit(func, *args).result()
+            except BrokenProcessPool:
+                logging.warning('Password pool broke, starting a new one')
+                with self._lock:
+                    if self._pool is pool:
+                        self._pool = None
+                        self._counts['restarts'] += 1
+                pool.shutdown(wait=False)
+        raise HasherBusy('Too many logins at once, try again')
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ProcessPoolExecutor(max_workers=self.workers,
+                                                 mp_context=pool_context())
+            return self._pool
@@ -0,0 +1,87 @@
+from flaskr.passwords import PasswordHasher, HasherBusy, hash_rounds
+from unittest.mock import patch
+import threading
+import pytest
+
+
+def test_hash_and_verify_on_process_pool():
+    hasher = PasswordHasher(rounds=4, workers=1)
+    try:
+        hashed = hasher.hash('secret', 'sandy')
+        assert hash_rounds(hashed) == 4
+        assert hasher.verify('secret', 'sandy', hashed) == (True, None)
+        assert hasher.verify('wrong', 'sandy', hashed) == (False, None)
+        assert hasher.verify('secret', 'bob', hashed) == (False, None)
+    finally:
+        hasher.shutdown()
+
+
+def test_pool_workers_are_not_forked():
+    hasher = PasswordHasher(rounds=4, workers=1)
+    try:
+        hasher.hash('secret', 'sandy')
+        assert hasher._pool._mp_context.get_start_method() != 'fork'
+    finally:
+        hasher.shutdown()
+
+
+def test_pool_replaced_after_worker_dies():
+    hasher = PasswordHasher(rounds=4, workers=1)
+    try:
+        hashed = hasher.hash('secret', 'sandy')
+        for process in list(hasher._pool._processes.values()):
+            process.kill()
+            process.join()
+
+        assert hasher.verify('secret', 'sandy', hashed) == (True, None)
+        assert hasher.stats()['restarts'] == 1
+    finally:
+        hasher.shutdown()
+
+
+def test_verify_rehashes_other_costs():
+    old = PasswordHasher(rounds=4, workers=0).hash('secret', 'sandy')
+    hasher = PasswordHasher(rounds=5, workers=0)
+
+    valid, new_hash = hasher.verify('secret', 'sandy', old)
+    assert valid
+    assert hash_rounds(new_hash) == 5
+    assert hasher.verify('secret', 'sandy', new_hash) == (True, None)
+    assert hasher.stats()['rehash'] == 1
+
+
+def test_busy_when_all_slots_are_taken():
+    hasher = PasswordHasher(rounds=4,
+                            workers=0,
+                            max_concurrent=1,
+                            queue_timeout=0.01)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_hash(encoded, rounds):
+        started.set()
+        release.wait()
+        return b'$2b$04$hash'
+
+    with patch('flaskr.passwords._hash', slow_hash):
+        thread = threading.Thread(target=hasher.hash, args=('a', 'sandy'))
+        thread.start()
+        started.wait()
+        with pytest.raises(HasherBusy):
+            hasher.hash('b', 'bob')
+        release.set()
+        thread.join()
+    assert hasher.stats()['busy'] == 1
+
+
+def test_stats():
+    hasher = PasswordHasher(rounds=4, workers=0)
+    assert hasher.stats()['hash_ms'] is None
+    hashed = hasher.hash('secret', 'sandy')
+    hasher.verify('secret', 'sandy', hashed)
+
+    stats = hasher.stats()
+    assert stats['hash'] == 1
+    assert stats['verify'] == 1
+    assert stats['verify_ms']['count'] == 1
+    assert stats['hash_ms']['max'] >= stats['hash_ms']['p50'] > 0
@@ -0,0 +1,130 @@
+"""
+Buffered page view counter for the popularity analytics file.
+"""
+import atexit
+import logging
+import threading
+import time
+from google.api_core.exceptions import PreconditionFailed
+
+DEFAULT_FLUSH_INTERVAL = 30
+DEFAULT_FLUSH_THRESHOLD = 50
+DEFAULT_MAX_RETRIES = 5
+
+
+class PopularityCounter:
+    """
+    Collects page views in memory and merges them into the
+    stored analytics in one write per flush.
+
+    A flush happens on the view that reaches flush_threshold pending
+    views or that comes flush_interval seconds after the last flush.
+    Writes are conditional on the generation that was read, so two
+    processes flushing at once retry instead of losing increments.
+
+    Attributes:
+        store: Where the analytics are kept (AnalyticsStore)
+        flush_interval: Most seconds between flushes (float)
+        flush_threshold: Most views held before a flush (int)
+        max_retries: Attempts made when another writer wins (int)
+    """
+
+    def __init__(self,
+                 store,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 flush_threshold=DEFAULT_FLUSH_THRESHOLD,
+                 max_retries=DEFAULT_MAX_RETRIES,
+                 clock=time.monotonic):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.flush_threshold = flush_threshold
+        self.max_retries = max_retries
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._pending_total = 0
+        self._last_flush = clock()
+        atexit.register(self.flush)
+
+    def increment(self, page_name, views=1):
+        """
+        Records views of a page, flushing if one is due.\n
+        Args:
+            - Sub page name (str), number of views (int)
+        """
+        with self._lock:
+            self._pending[page_name] = self._pending.get(page_name, 0) + views
+            self._pending_total += views
+            due = (self._pending_total >= self.flush_threshold or
+                   self._clock() - self._last_flush >= self.flush_interval)
+        if due:
+            self.flush(wait=False)
+
+    def counts(self):
+        """
+        Reads the stored views and adds the pending ones, without writing.\n
+        Returns:
+            - Views by page name (PageAnalytics)
+        """
+        counts = self.store.read()
+        counts.merge(self.pending())
+        return counts
+
+    def pending(self):
+        """
+        Returns:
+            - Views not yet written, by page name (dict)
+        """
+        with self._lock:
+            return dict(self._pending)
+
+    def flush(self, wait=True):
+        """
+        Merges the pending views into the stored analytics.
+        Views that could not be written, because of races or storage
+        errors, are kept for the next flush. Never raises.\n
+        Args:
+            - Whether to wait for a flush already running (Boolean)
+        Returns:
+            - (Boolean) True if nothing is left pending
+        """
+        if not self._flush_lock.acquire(blocking=wait):
+            return False
+        try:
+            with self._lock:
+                batch = self._pending
+                self._pending = {}
+                self._pending_total = 0
+                self._last_flush = self._clock()
+            if not batch:
+                return True
+
+            for _ in range(self.max_retries):
+                try:
+                    self._merge(batch)
+                    return True
+                except PreconditionFailed:
+                    continue
+                except Exception:
+                    # Called from increment, a page view must not fail
+                    # because storage did
+                    logging.exception("Popularity flush failed, keeping views")
+                    break
+            else:
+                logging.warning("Popularity flush lost %d races, keeping views",
+                                self.max_retries)
+
+            with self._lock:
+                for page_name, views in batch.items():
+                    self._pending[page_name] = (
+                        self._pending.get(page_name, 0) + views)
+                    self._pending_total += views
+            return False
+        finally:
+            self._flush_lock.release()
+
+    def _merge(self, batch):
+        counts, blob, fmt = self.store.load()
+        counts.merge(batch)
+        self.store.save(counts, blob, fmt)
@@ -0,0 +1,99 @@
+from flaskr.backend_test import storage_client_mock
+from flaskr.analytics import AnalyticsStore
+from flaskr.popularity import PopularityCounter
+from google.api_core.exceptions import PreconditionFailed, ServiceUnavailable
+from unittest.mock import patch
+import pytest
+
+
+@pytest.fixture
+def bucket():
+    test_info = {"Dictionary by Popularity.csv": 'chord,3\r\npitch,1\r\n'}
+    return storage_client_mock(blob_data=test_info).bucket('analytics')
+
+
+def stored_counts(bucket):
+    return AnalyticsStore(bucket).read()
+
+
+def test_flush_merges_in_one_write(bucket):
+    counter = PopularityCounter(AnalyticsStore(bucket), flush_threshold=100)
+    counter.increment('chord')
+    counter.increment('chord')
+    counter.increment('scales')
+
+    blob = bucket.get_blob("Dictionary by Popularity.csv")
+    with patch.object(blob, 'upload_from_string',
+                      wraps=blob.upload_from_string) as upload:
+        assert counter.flush()
+    assert upload.call_count == 1
+    assert stored_counts(bucket) == {'chord': 5, 'pitch': 1, 'scales': 1}
+    assert counter.pending() == {}
+
+
+def test_flush_on_threshold(bucket):
+    counter = PopularityCounter(AnalyticsStore(bucket), flush_threshold=2)
+    counter.increment('pitch')
+    assert stored_counts(bucket)['pitch'] == 1
+    counter.increment('pitch')
+    assert stored_counts(bucket)['pitch'] == 3
+
+
+def test_flush_on_interval(bucket):
+    now = [0]
+    counter = PopularityCounter(AnalyticsStore(bucket),
+                                flush_interval=10,
+                                flush_threshold=100,
+                                clock=lambda: now[0])
+    counter.increment('pitch')
+    assert counter.pending() == {'pitch': 1}
+    now[0] = 10
+    counter.increment('pitch')
+    assert counter.pending() == {}
+    assert stored_counts(bucket)['pitch'] == 3
+
+
+def test_flush_retries_concurrent_writer(bucket):
+    counter = PopularityCounter(AnalyticsStore(bucket), flush_threshold=100)
+    counter.increment('chord')
+    blob = bucket.get_blob("Dictionary by Popularity.csv")
+    real_upload = blob.upload_from_string
+    raced = []
+
+    def racing_upload(content, **kwargs):
+        if not raced:
+            # Another process writes between our read and our write
+            raced.append(True)
+            real_upload('chord,10\r\n')
+        return real_upload(content, **kwargs)
+
+    with patch.object(blob, 'upload_from_string', side_effect=racing_upload):
+        assert counter.flush()
+    assert stored_counts(bucket) == {'chord': 11}
+
+
+def test_flush_keeps_views_after_retries(bucket):
+    counter = PopularityCounter(AnalyticsStore(bucket),
+                                flush_threshold=100,
+                                max_retries=2)
+    counter.increment('chord')
+    blob = bucket.get_blob("Dictionary by Popularity.csv")
+
+    with patch.object(blob,
+                      'upload_from_string',
+                      side_effect=PreconditionFailed('raced')):
+        assert not counter.flush()
+    assert counter.pending() == {'chord': 1}
+
+
+def test_storage_error_keeps_views_and_views_still_count(bucket):
+    store = AnalyticsStore(bucket)
+    counter = PopularityCounter(store, flush_threshold=2)
+    counter.increment('chord')
+
+    with patch.object(store, 'load', side_effect=ServiceUnavailable('down')):
+        counter.increment('pitch')
+        assert not counter.flush()
+    assert counter.pending() == {'chord': 1, 'pitch': 1}
+    assert counter.flush()
+    assert stored_counts(bucket) == {'chord': 4, 'pitch': 2}
@@ -0,0 +1,152 @@
+"""
+HTML artifacts of the wiki pages, rendered when a page is published.
+
+The HTML of <page>.md is stored next to it in the content bucket as
+rendered/<page>.html. The artifact's metadata records the generation and
+sha256 of the markdown it was rendered from and the RENDER_VERSION of the
+renderer, and a page is served from its artifact only while they still
+match. Pages are published on upload, by `flask publish-pages`, and again
+whenever a view finds the artifact missing or stale.
+"""
+from google.api_core.exceptions import NotFound, PreconditionFailed
+import markdown
+
+from flaskr.renderer import EXTENSIONS
+
+RENDERED_PREFIX = 'rendered/'
+# Bumped whenever render() changes its output, to republish every page
+RENDER_VERSION = '2'
+
+
+def artifact_name(page_name):
+    """
+    Args:
+        - Sub page name (str)
+    Returns:
+        - Name of its HTML artifact blob (str)
+    """
+    return f'{RENDERED_PREFIX}{page_name}.html'
+
+
+def render(md_content):
+    """
+    Args:
+        - Markdown of a page (str)
+    Returns:
+        - HTML content (str)
+    """
+    return markdown.markdown(md_content, extensions=list(EXTENSIONS))
+
+
+def is_current(artifact, source):
+    """
+    Args:
+        - HTML artifact blob, markdown blob
+    Returns:
+        - Whether the artifact was rendered from the markdown's content by
+          the current renderer (Boolean)
+    """
+    metadata = artifact.metadata or {}
+    if metadata.get('render_version') != RENDER_VERSION:
+        return False
+    if metadata.get('source_generation') == str(source.generation):
+        return True
+    sha256 = (source.metadata or {}).get('sha256')
+    return sha256 is not None and metadata.get('source_sha256') == sha256
+
+
+class Publisher:
+    """
+    Renders pages to HTML artifacts and serves them.
+
+    Attributes:
+        bucket: The content bucket, holding pages and their artifacts
+        render: Markdown to HTML, e.g. MarkdownRenderer.render (callable)
+        published: Artifacts written (int)
+        served: Views answered from an artifact (int)
+    """
+
+    def __init__(self, bucket, render=render):
+        self.bucket = bucket
+        self.render = render
+        self.published = 0
+        self.served = 0
+
+    def publish(self, page_name, md_content, source, if_generation_match=None):
+        """
+        Renders a page and stores its artifact.\n
+        Args:
+            - Sub page name (str), its markdown (str), the markdown blob it
+              was read from, generation the artifact must have
+              (int or None)
+        Returns:
+            - HTML content (str)
+        Raises:
+            - PreconditionFailed if the artifact changed meanwhile
+        """
+        html_content = self.render(md_content)
+        artifact = self.bucket.blob(artifact_name(page_name))
+        artifact.metadata = {
+            'render_version': RENDER_VERSION,
+            'source_generation': str(source.generation),
+            'source_sha256': (source.metadata or {}).get('sha256', '')
+        }
+        artifact.upload_from_string(html_content,
+                                    content_type='text/html',
+                                    if_generation_match=if_generation_match)
+        self.published += 1
+        return html_content
+
+    def html(self, page_name, source):
+        """
+        HTML of a page, from its artifact when current. Otherwise the page
+        is rendered and its artifact rewritten, unless another writer got
+        there first.\n
+        Args:
+            - Sub page name (str), its markdown blob
+        Returns:
+            - HTML content (str)
+        """
+        artifact = self.bucket.get_blob(artifact_name(page_name))
+        if artifact is not None and is_current(artifact, source):
+            try:
+                html_content = artifact.download_as_bytes().decode('utf-8')
+                self.served += 1
+                return html_content
+            except NotFound:
+                artifact = None
+
+        md_content = source.download_as_string().decode('utf-8')
+        try:
+            return self.publish(
+                page_name,
+                md_content,
+                source,
+                if_generation_match=artifact.generation if artifact else 0)
+        except PreconditionFailed:
+            return self.render(md_content)
+
+    def publish_all(self, sources, force=False):
+        """
+        Publishes every page whose artifact is missing or stale.\n
+        Args:
+            - Markdown blobs (iterable), republish current pages too
+              (Boolean)
+        Returns:
+            - Number of pages published (int)
+        """
+        artifacts = {
+            blob.name: blob
+            for blob in self.bucket.list_blobs(prefix=RENDERED_PREFIX)
+        }
+        count = 0
+        for source in sources:
+            page_name = source.name[:-len('.md')]
+            artifact = artifacts.get(artifact_name(page_name))
+            if not force and artifact is not None and is_current(
+                    artifact, source):
+                continue
+            md_content = source.download_as_string().decode('utf-8')
+            self.publish(page_name, md_content, source)
+            count += 1
+        return count
@@ -0,0 +1,77 @@
+from flaskr.publish import Publisher, artifact_name, is_current, RENDER_VERSION
+from flaskr.blobstore import MemoryStore
+from unittest.mock import patch
+import pytest
+
+
+@pytest.fixture
+def bucket():
+    return MemoryStore().bucket('content')
+
+
+def write_page(bucket, name, content):
+    blob = bucket.blob(f'{name}.md')
+    blob.metadata = {'sha256': str(hash(content))}
+    blob.upload_from_string(content)
+    return blob
+
+
+def test_publish_stores_artifact(bucket):
+    source = write_page(bucket, 'pitch', '# Pitch')
+    publisher = Publisher(bucket)
+    assert publisher.publish('pitch', '# Pitch',
+                             source) == '<h1 id="pitch">Pitch</h1>'
+
+    artifact = bucket.get_blob(artifact_name('pitch'))
+    assert artifact.download_as_text() == '<h1 id="pitch">Pitch</h1>'
+    assert artifact.content_type == 'text/html'
+    assert artifact.metadata['render_version'] == RENDER_VERSION
+    assert artifact.metadata['source_generation'] == str(source.generation)
+    assert is_current(artifact, source)
+
+
+def test_html_served_from_current_artifact(bucket):
+    source = write_page(bucket, 'pitch', '# Pitch')
+    publisher = Publisher(bucket)
+    publisher.publish('pitch', '# Pitch', source)
+
+    with patch.object(publisher, 'render') as render:
+        assert publisher.html('pitch', source) == '<h1 id="pitch">Pitch</h1>'
+    render.assert_not_called()
+    assert publisher.served == 1
+
+
+def test_html_republishes_stale_artifact(bucket):
+    publisher = Publisher(bucket)
+    source = write_page(bucket, 'pitch', '# Pitch')
+    publisher.publish('pitch', '# Pitch', source)
+    source = write_page(bucket, 'pitch', '# Pitch 2')
+
+    assert publisher.html('pitch', source) == '<h1 id="pitch-2">Pitch 2</h1>'
+    assert is_current(bucket.get_blob(artifact_name('pitch')), source)
+
+
+def test_html_without_artifact(bucket):
+    publisher = Publisher(bucket)
+    source = write_page(bucket, 'pitch', '# Pitch')
+    assert publisher.html('pitch', source) == '<h1 id="pitch">Pitch</h1>'
+    assert bucket.get_blob(artifact_name('pitch')) is not None
+
+
+def test_same_content_stays_current(bucket):
+    source = write_page(bucket, 'pitch', '# Pitch')
+    Publisher(bucket).publish('pitch', '# Pitch', source)
+    # Rewritten with the same content, e.g. seeded again
+    source = write_page(bucket, 'pitch', '# Pitch')
+    assert is_current(bucket.get_blob(artifact_name('pitch')), source)
+
+
+def test_publish_all_skips_current(bucket):
+    publisher = Publisher(bucket)
+    pitch = write_page(bucket, 'pitch', '# Pitch')
+    chord = write_page(bucket, 'chord', '# Chord')
+    publisher.publish('pitch', '# Pitch', pitch)
+
+    assert publisher.publish_all([pitch, chord]) == 1
+    assert publisher.publish_all([pitch, chord]) == 0
+    assert publisher.publish_all([pitch, chord], force=True) == 2
@@ -0,0 +1,118 @@
+"""
+Markdown to HTML rendering with reusable converters and cached sections.
+
+Each thread keeps its own markdown.Markdown, built once with EXTENSIONS
+and reset between documents, instead of building one per call. Documents
+are split at their headings and each section's HTML is cached by the
+sha256 of its markdown, so editing one section of a long page only
+renders that section again. Documents with reference-style link
+definitions or a [TOC] marker need the whole text at once and are
+rendered in one piece.
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict
+
+import markdown
+
+EXTENSIONS = ('toc', 'tables')
+DEFAULT_MAX_SECTIONS = 1024
+# A line beginning with '#' after a blank line starts a block of its own,
+# without one it can still belong to the block above, e.g. a table
+HEADING = re.compile(r'\n[ \t]*\n(?=#)')
+WHOLE_DOCUMENT = re.compile(r'^ {0,3}\[[^\]]+\]:|^\[TOC\]\s*$', re.MULTILINE)
+
+
+def split_sections(md_content):
+    """
+    Args:
+        - Markdown of a document (str)
+    Returns:
+        - The text before the first heading, if any, then one section
+          per heading that follows a blank line, running up to the
+          next one (list of str)
+    """
+    starts = [0] + [match.end() for match in HEADING.finditer(md_content)]
+    starts.append(len(md_content))
+    return [
+        md_content[start:end]
+        for start, end in zip(starts, starts[1:])
+        if md_content[start:end].strip()
+    ]
+
+
+class MarkdownRenderer:
+    """
+    Renders markdown with a converter per thread and an LRU cache of
+    rendered sections.
+
+    Headings of different sections with the same text get the same id.
+
+    Attributes:
+        extensions: Python-Markdown extensions used (tuple)
+        max_sections: Most sections kept rendered (int)
+        hits: Sections served from the cache (int)
+        misses: Sections that had to be rendered (int)
+    """
+
+    def __init__(self,
+                 extensions=EXTENSIONS,
+                 max_sections=DEFAULT_MAX_SECTIONS):
+        self.extensions = tuple(extensions)
+        self.max_sections = max_sections
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        # sha256 of a section's markdown -> its HTML
+        self._sections = OrderedDict()
+
+    def render(self, md_content):
+        """
+        Args:
+            - Markdown of a document (str)
+        Returns:
+            - HTML content (str)
+        """
+        if WHOLE_DOCUMENT.search(md_content):
+            return self._convert(md_content)
+        return '\n'.join(
+            self._render_section(section)
+            for section in split_sections(md_content))
+
+    def stats(self):
+        """
+        Returns:
+            - Section hits, misses and entries (dict)
+        """
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': len(self._sections)
+            }
+
+    def _render_section(self, section):
+        key = hashlib.sha256(section.encode('utf-8')).hexdigest()
+        with self._lock:
+            html_content = self._sections.get(key)
+            if html_content is not None:
+                self._sections.move_to_end(key)
+                self.hits += 1
+                return html_content
+            self.misses += 1
+
+        html_content = self._convert(section)
+        with self._lock:
+            self._sections[key] = html_content
+            while len(self._sections) > self.max_sections:
+                self._sections.popitem(last=False)
+        return html_content
+
+    def _convert(self, md_content):
+        converter = getattr(self._local, 'converter', None)
+        if converter is None:
+            converter = markdown.Markdown(extensions=list(self.extensions))
+            self._local.converter = converter
+        return converter.reset().convert(md_content)
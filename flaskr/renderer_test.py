@@ -0,0 +1,90 @@
+from flaskr.renderer import MarkdownRenderer, split_sections, EXTENSIONS
+from unittest.mock import patch
+import markdown
+import os
+import threading
+
+DOCUMENT = """Intro before any heading
+
+# Scales
+A scale is
+
+- one
+- two
+
+## Major
+| Degree | Name |
+|---|---|
+| 1 | Tonic |
+### Minor
+text *em*
+
+#No space heading
+
+    code block
+"""
+
+
+def test_split_sections():
+    assert split_sections(DOCUMENT) == [
+        'Intro before any heading\n\n',
+        '# Scales\nA scale is\n\n- one\n- two\n\n',
+        '## Major\n| Degree | Name |\n|---|---|\n| 1 | Tonic |\n### Minor\ntext *em*\n\n',
+        '#No space heading\n\n    code block\n'
+    ]
+    assert split_sections('') == []
+
+
+def test_render_matches_whole_document():
+    renderer = MarkdownRenderer()
+    expected = markdown.markdown(DOCUMENT, extensions=list(EXTENSIONS))
+    assert renderer.render(DOCUMENT) == expected
+    assert '<table>' in expected
+    assert '<h1 id="scales">Scales</h1>' in expected
+
+    directory = os.path.join(os.path.dirname(__file__), 'temp_markdown')
+    for name in os.listdir(directory):
+        with open(os.path.join(directory, name)) as page:
+            md_content = page.read()
+        assert renderer.render(md_content) == markdown.markdown(
+            md_content, extensions=list(EXTENSIONS))
+
+
+def test_edit_renders_only_changed_section():
+    renderer = MarkdownRenderer()
+    renderer.render(DOCUMENT)
+    assert renderer.stats()['misses'] == 4
+
+    edited = DOCUMENT.replace('text *em*', 'text **strong**')
+    html_content = renderer.render(edited)
+    assert '<strong>strong</strong>' in html_content
+    assert renderer.stats() == {'hits': 3, 'misses': 5, 'entries': 5}
+
+
+def test_reference_links_render_whole_document():
+    renderer = MarkdownRenderer()
+    md_content = '# A\nSee [pitch][p]\n\n# B\n\n[p]: /pitch\n'
+    assert '<a href="/pitch">pitch</a>' in renderer.render(md_content)
+    assert renderer.stats()['entries'] == 0
+
+
+def test_converter_reused_per_thread():
+    renderer = MarkdownRenderer()
+    with patch('markdown.Markdown', wraps=markdown.Markdown) as make:
+        renderer.render('# One')
+        renderer.render('# Two')
+        assert make.call_count == 1
+
+        thread = threading.Thread(target=renderer.render, args=('# Three',))
+        thread.start()
+        thread.join()
+        assert make.call_count == 2
+
+
+def test_section_cache_is_bounded():
+    renderer = MarkdownRenderer(max_sections=2)
+    for title in ['A', 'B', 'C']:
+        renderer.render(f'# {title}')
+    assert renderer.stats()['entries'] == 2
+    renderer.render('# A')
+    assert renderer.stats()['misses'] == 4
@@ -0,0 +1,376 @@
+"""
+Full-text search over the wiki pages.
+
+Pages are split into words, lowercased, stripped of stop words and of
+common endings, and kept in an inverted index ranked with BM25. The index
+lives in memory and is saved in the content bucket as search/index.json.
+A page is indexed again only when the generation of its markdown blob
+changes, so searches read storage only after pages were written by
+another process. The headings and links of each page are kept with it,
+for suggestions and the link graph.
+"""
+import itertools
+import json
+import math
+import re
+import threading
+from collections import Counter, namedtuple
+
+from google.api_core.exceptions import PreconditionFailed
+from markupsafe import Markup, escape
+
+from flaskr.links import link_targets
+
+INDEX_BLOB = 'search/index.json'
+INDEX_VERSION = 3
+DEFAULT_RESULTS = 20
+SNIPPET_WIDTH = 160
+K1 = 1.2
+B = 0.75
+WORD = re.compile(r'[a-z0-9]+')
+HEADING = re.compile(r'^#{1,6}(.*?)#*$', re.MULTILINE)
+# Link targets, tags and markdown punctuation, left out of the text
+MARKUP = re.compile(r'\]\([^)]*\)|<[^>]+>|[#*_`>|~\[\]]')
+STOP_WORDS = frozenset(
+    'a an and are as at be but by for from has have in is it its of on or '
+    'that the their this to was were which will with'.split())
+
+SearchResult = namedtuple('SearchResult', ['page', 'score', 'snippet'])
+IndexedPage = namedtuple('IndexedPage',
+                         ['generation', 'length', 'text', 'headings', 'links'])
+# Shared by every index, so an index read again never repeats a version
+_versions = itertools.count(1)
+
+
+def stem(word):
+    """
+    Args:
+        - A lowercased word (str)
+    Returns:
+        - The word without a plural or -ing, -ed, -ly ending, e.g.
+          'scales' and 'scale' both give 'scale' (str)
+    """
+    if word.endswith('sses'):
+        return word[:-2]
+    if word.endswith('ies') and len(word) > 4:
+        return word[:-3] + 'y'
+    for suffix in ('ing', 'ed', 'ly'):
+        if word.endswith(suffix) and len(word) - len(suffix) >= 4:
+            return word[:-len(suffix)]
+    if word.endswith('s') and not word.endswith(('ss', 'us', 'is')):
+        return word[:-1]
+    return word
+
+
+def tokenize(text):
+    """
+    Args:
+        - Text (str)
+    Returns:
+        - Stemmed words that aren't stop words, in order (list of str)
+    """
+    return [
+        stem(word)
+        for word in WORD.findall(text.lower())
+        if word not in STOP_WORDS
+    ]
+
+
+def plain_text(md_content):
+    """
+    Args:
+        - Markdown of a page (str)
+    Returns:
+        - Its text without markup, on one line (str)
+    """
+    return ' '.join(MARKUP.sub(' ', md_content).split())
+
+
+def headings(md_content):
+    """
+    Args:
+        - Markdown of a page (str)
+    Returns:
+        - Text of its headings, in order (list of str)
+    """
+    return [
+        ' '.join(MARKUP.sub(' ', match.group(1)).split())
+        for match in HEADING.finditer(md_content)
+        if match.group(1).strip()
+    ]
+
+
+def snippet(text, terms, width=SNIPPET_WIDTH):
+    """
+    Args:
+        - Text of a page (str), stemmed query terms (set),
+          most characters shown (int)
+    Returns:
+        - HTML of the text around the first match, with matches in
+          <mark> (Markup)
+    """
+    lowered = text.lower()
+    matches = [m for m in WORD.finditer(lowered) if stem(m.group()) in terms]
+    start = max(0, matches[0].start() - width // 3) if matches else 0
+    end = min(len(text), start + width)
+    parts = ['…' if start else '']
+    position = start
+    for match in matches:
+        if match.start() < start:
+            continue
+        if match.end() > end:
+            break
+        parts.append(escape(text[position:match.start()]))
+        parts.append(
+            Markup('<mark>%s</mark>') % text[match.start():match.end()])
+        position = match.end()
+    parts.append(escape(text[position:end]))
+    parts.append('…' if end < len(text) else '')
+    return Markup('').join(parts)
+
+
+class SearchIndex:
+    """
+    Inverted index of pages ranked with BM25.
+
+    Attributes:
+        pages: Page name to IndexedPage (dict)
+        postings: Term to page name to term count (dict)
+        version: Changes whenever a page is added or removed (int)
+    """
+
+    def __init__(self):
+        self.pages = {}
+        self.postings = {}
+        self.version = next(_versions)
+        self._total_length = 0
+
+    def add(self,
+            page_name,
+            md_content,
+            generation=None,
+            page_headings=None,
+            page_links=None):
+        """
+        Indexes a page, replacing what was indexed of it before.\n
+        Args:
+            - Page name (str), its markdown (str), generation of its blob,
+              its headings and the pages it links to if md_content is
+              already plain text (lists)
+        """
+        self.remove(page_name)
+        if page_headings is None:
+            page_headings = headings(md_content)
+        if page_links is None:
+            page_links = link_targets(md_content)
+        text = plain_text(md_content)
+        terms = tokenize(f'{page_name} {text}')
+        for term, count in Counter(terms).items():
+            self.postings.setdefault(term, {})[page_name] = count
+        self.pages[page_name] = IndexedPage(generation, len(terms), text,
+                                            page_headings, page_links)
+        self._total_length += len(terms)
+        self.version = next(_versions)
+
+    def remove(self, page_name):
+        page = self.pages.pop(page_name, None)
+        if page is None:
+            return
+        self._total_length -= page.length
+        for term in set(tokenize(f'{page_name} {page.text}')):
+            postings = self.postings.get(term, {})
+            postings.pop(page_name, None)
+            if not postings:
+                self.postings.pop(term, None)
+        self.version = next(_versions)
+
+    def search(self, query, limit=DEFAULT_RESULTS):
+        """
+        Args:
+            - Words to look for (str), most results (int)
+        Returns:
+            - Best matching pages first (list of SearchResult)
+        """
+        terms = set(tokenize(query))
+        if not terms or not self.pages:
+            return []
+        average = self._total_length / len(self.pages) or 1
+        scores = Counter()
+        for term in terms:
+            postings = self.postings.get(term, {})
+            idf = math.log(1 + (len(self.pages) - len(postings) + 0.5) /
+                           (len(postings) + 0.5))
+            for page_name, count in postings.items():
+                length = self.pages[page_name].length
+                scores[page_name] += idf * count * (K1 + 1) / (
+                    count + K1 * (1 - B + B * length / average))
+        ranked = sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+        return [
+            SearchResult(page_name, score,
+                         snippet(self.pages[page_name].text, terms))
+            for page_name, score in ranked[:limit]
+        ]
+
+    def to_json(self):
+        return json.dumps(
+            {
+                'version': INDEX_VERSION,
+                'pages': {
+                    name:
+                    [page.generation, page.text, page.headings, page.links]
+                    for name, page in self.pages.items()
+                }
+            },
+            separators=(',', ':'))
+
+    @classmethod
+    def from_json(cls, data):
+        """
+        Args:
+            - What to_json returned (str)
+        Returns:
+            - The index, empty if it was saved by another version
+        """
+        index = cls()
+        stored = json.loads(data)
+        if stored.get('version') != INDEX_VERSION:
+            return index
+        for name, page in stored['pages'].items():
+            generation, text, page_headings, page_links = page
+            index.add(name, text, generation, page_headings, page_links)
+        return index
+
+
+class PageSearch:
+    """
+    Search over the markdown pages of the content bucket.
+
+    The saved index is read on the first search and compared with the
+    page catalog: pages that are new or have another generation are
+    downloaded and indexed again, deleted ones are dropped, and the index
+    is saved when anything changed.
+
+    Attributes:
+        bucket: The content bucket
+        catalog: Index of the markdown blobs (BlobCatalog)
+        hidden: Pages left out of the results (set)
+    """
+
+    def __init__(self, bucket, catalog, hidden=()):
+        self.bucket = bucket
+        self.catalog = catalog
+        self.hidden = set(hidden)
+        self._lock = threading.Lock()
+        self._index = None
+        self._generation = None
+
+    def search(self, query, limit=DEFAULT_RESULTS):
+        """
+        Args:
+            - Words to look for (str), most results (int)
+        Returns:
+            - Best matching pages first (list of SearchResult)
+        """
+        with self._lock:
+            self._sync()
+            return self._index.search(query, limit)
+
+    def version(self):
+        """
+        Returns:
+            - Version of the index, after bringing it up to date (int)
+        """
+        with self._lock:
+            self._sync()
+            return self._index.version
+
+    def pages(self):
+        """
+        Returns:
+            - Page name to IndexedPage, as currently indexed (dict)
+        """
+        with self._lock:
+            self._sync()
+            return dict(self._index.pages)
+
+    def snapshot(self):
+        """
+        Returns:
+            - Version of the index and its pages, read together after
+              bringing it up to date (int, dict)
+        """
+        with self._lock:
+            self._sync()
+            return self._index.version, dict(self._index.pages)
+
+    def update(self, page_name, md_content, generation):
+        """
+        Indexes a page that was just written and saves the index.\n
+        Args:
+            - Page name (str), its markdown (str), generation of its blob
+        """
+        if page_name in self.hidden:
+            return
+        with self._lock:
+            if self._generation is None:
+                self._load()
+            self._index.add(page_name, md_content, generation)
+            self._save()
+
+    def rebuild(self):
+        """
+        Indexes every page again and saves the index.\n
+        Returns:
+            - Number of pages indexed (int)
+        """
+        with self._lock:
+            self.catalog.invalidate()
+            if self._generation is None:
+                self._load()
+            self._index = SearchIndex()
+            self._sync()
+            return len(self._index.pages)
+
+    def _sync(self):
+        if self._generation is None:
+            self._load()
+        generations = {
+            name[:-len('.md')]: entry.generation
+            for name, entry in self.catalog.entries().items()
+            if name.endswith('.md') and name[:-len('.md')] not in self.hidden
+        }
+        changed = False
+        for page_name in set(self._index.pages) - set(generations):
+            self._index.remove(page_name)
+            changed = True
+        for page_name, generation in generations.items():
+            page = self._index.pages.get(page_name)
+            if page is not None and page.generation == generation:
+                continue
+            blob = self.bucket.blob(f'{page_name}.md')
+            md_content = blob.download_as_string().decode('utf-8')
+            self._index.add(page_name, md_content, generation)
+            changed = True
+        if changed:
+            self._save()
+
+    def _load(self):
+        blob = self.bucket.get_blob(INDEX_BLOB)
+        if blob is None:
+            self._index, self._generation = SearchIndex(), 0
+            return
+        data = blob.download_as_string().decode('utf-8')
+        self._index = SearchIndex.from_json(data)
+        self._generation = blob.generation
+
+    def _save(self):
+        blob = self.bucket.blob(INDEX_BLOB)
+        try:
+            blob.upload_from_string(self._index.to_json(),
+                                    content_type='application/json',
+                                    if_generation_match=self._generation)
+            self._generation = blob.generation
+        except PreconditionFailed:
+            # Saved by another process meanwhile: theirs is read before
+            # the next sync, which indexes again what it lacks
+            self._generation = None
@@ -0,0 +1,145 @@
+from flaskr.search import SearchIndex, PageSearch, stem, tokenize, plain_text, snippet, INDEX_BLOB
+from flaskr.blobstore import MemoryStore
+from flaskr.catalog import BlobCatalog
+from unittest.mock import patch
+import os
+import pytest
+
+PAGES = {
+    'scales': '# Scales\nA scale is a set of notes ordered by pitch.\n'
+              'Major scales and minor scales are common.',
+    'chord': '# Chord\nA chord is three or more notes played together.',
+    'pitch': '# Pitch\nPitch is how high or low a note sounds.',
+}
+
+
+def test_stem_and_tokenize():
+    assert stem('scales') == stem('scale') == 'scale'
+    assert stem('melodies') == 'melody'
+    assert stem('playing') == stem('played') == 'play'
+    assert stem('chorus') == 'chorus'
+    assert stem('class') == 'class'
+    assert tokenize('The Notes of a Chord') == ['note', 'chord']
+
+
+def test_plain_text_drops_markup():
+    assert plain_text('# Title\nSee [pitch](/pitch) and **bold**') == \
+        'Title See pitch and bold'
+
+
+def test_ranking():
+    index = SearchIndex()
+    for name, content in PAGES.items():
+        index.add(name, content)
+
+    results = index.search('scales')
+    assert [result.page for result in results] == ['scales']
+    # Every page mentions notes once, the longest page ranks last
+    assert [result.page for result in index.search('notes')
+           ] == ['chord', 'pitch', 'scales']
+    assert index.search('pitch')[0].page == 'pitch'
+    assert index.search('the') == []
+    assert index.search('nothing here') == []
+    assert len(index.search('note', limit=1)) == 1
+
+
+def test_snippet_highlights_and_escapes():
+    text = 'Intro <b> ' + 'filler ' * 40 + 'Major scales are common'
+    html = snippet(text, {'scale'}, width=60)
+    assert '<mark>scales</mark>' in html
+    assert html.startswith('…')
+    assert '<b>' not in snippet('a <b> scale', {'scale'})
+    assert '&lt;b&gt;' in snippet('a <b> scale', {'scale'})
+
+
+def test_remove_and_replace():
+    index = SearchIndex()
+    index.add('chord', PAGES['chord'])
+    index.add('chord', '# Chord\nTriads only')
+    assert index.search('played') == []
+    assert index.search('triads')[0].page == 'chord'
+    index.remove('chord')
+    assert index.search('triads') == []
+    assert index.postings == {}
+
+
+def test_json_round_trip():
+    index = SearchIndex()
+    for name, content in PAGES.items():
+        index.add(name, content, generation=1)
+    loaded = SearchIndex.from_json(index.to_json())
+    assert loaded.search('pitch') == index.search('pitch')
+    assert loaded.pages['chord'].generation == 1
+    assert SearchIndex.from_json('{"version": 0}').pages == {}
+
+
+@pytest.fixture
+def bucket():
+    bucket = MemoryStore().bucket('content')
+    for name, content in PAGES.items():
+        bucket.blob(f'{name}.md').upload_from_string(content)
+    bucket.blob('test_url.md').upload_from_string('# Scales test')
+    return bucket
+
+
+def make_search(bucket):
+    catalog = BlobCatalog(bucket, include=lambda name: name.endswith('.md'))
+    return PageSearch(bucket, catalog, hidden=['test_url'])
+
+
+def test_page_search_builds_and_saves(bucket):
+    search = make_search(bucket)
+    assert [result.page for result in search.search('scales')] == ['scales']
+    assert bucket.get_blob(INDEX_BLOB) is not None
+
+    # Another process reads the saved index instead of every page
+    other = make_search(bucket)
+    with patch.object(bucket, 'blob', wraps=bucket.blob) as blob:
+        assert other.search('chord')[0].page == 'chord'
+    assert [call.args[0] for call in blob.call_args_list] == []
+
+
+def test_page_search_update(bucket):
+    search = make_search(bucket)
+    search.search('scales')
+    bucket.blob('form.md').upload_from_string('# Form\nSonata form')
+    search.update('form', '# Form\nSonata form',
+                  bucket.get_blob('form.md').generation)
+    search.catalog.record(bucket.get_blob('form.md'))
+
+    with patch.object(bucket, 'blob', wraps=bucket.blob) as blob:
+        assert search.search('sonata')[0].page == 'form'
+    blob.assert_not_called()
+    assert make_search(bucket).search('sonata')[0].page == 'form'
+
+
+def test_page_search_follows_catalog(bucket):
+    search = make_search(bucket)
+    search.search('pitch')
+    bucket.blob('pitch.md').upload_from_string('# Pitch\nFrequency')
+    bucket.blob('chord.md').delete()
+    search.catalog.invalidate()
+
+    assert search.search('frequency')[0].page == 'pitch'
+    assert search.search('chord') == []
+
+
+def test_page_search_saved_elsewhere(bucket):
+    search = make_search(bucket)
+    other = make_search(bucket)
+    search.search('pitch')
+    other.search('pitch')
+    bucket.blob('form.md').upload_from_string('# Form\nSonata form')
+    form = bucket.get_blob('form.md')
+    other.update('form', '# Form\nSonata form', form.generation)
+
+    # The index this one read is stale, it is read again
+    search.update('form', '# Form\nSonata form', form.generation)
+    search.catalog.record(form)
+    assert search.search('sonata')[0].page == 'form'
+
+
+def test_page_search_rebuild(bucket):
+    search = make_search(bucket)
+    assert search.rebuild() == 3
+    assert search.search('test') == []
@@ -0,0 +1,72 @@
+"""
+Timing of the steps of a cold start: importing flaskr, create_app and
+the first request. The report is logged once the first request is done
+and kept in app.extensions['startup'].
+"""
+import logging
+import threading
+import time
+
+
+class StartupTimer:
+    """
+    Seconds taken by each startup step.
+
+    Attributes:
+        steps: Step name to seconds, in the order they ended (dict)
+    """
+
+    def __init__(self, clock=time.perf_counter):
+        self.steps = {}
+        self._clock = clock
+        self._started = clock()
+        self._lock = threading.Lock()
+        self._request_started = None
+
+    def mark(self, step):
+        """
+        Ends a step that started when the previous one ended.\n
+        Args:
+            - Step name (str)
+        """
+        now = self._clock()
+        self.steps[step] = now - self._started
+        self._started = now
+
+    def time(self, step, seconds):
+        """
+        Args:
+            - Step name (str), seconds it took (float)
+        """
+        self.steps[step] = seconds
+
+    def watch_first_request(self, app):
+        """
+        Times the first request the app handles, then logs the report.\n
+        Args:
+            - Flask instance
+        """
+        app.extensions['startup'] = self
+
+        @app.before_request
+        def first_request_started():
+            with self._lock:
+                if self._request_started is None:
+                    self._request_started = self._clock()
+
+        @app.teardown_request
+        def first_request_done(error=None):
+            with self._lock:
+                if 'first_request' in self.steps:
+                    return
+                self.time('first_request',
+                          self._clock() - self._request_started)
+            logging.info('Startup: %s', self.report())
+
+    def report(self):
+        """
+        Returns:
+            - e.g. 'import 0.412s, create_app 0.021s, first_request 0.300s'
+        """
+        return ', '.join(
+            f'{step} {seconds:.3f}s' for step, seconds in self.steps.items())
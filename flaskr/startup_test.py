@@ -0,0 +1,40 @@
+from flaskr import create_app
+from flaskr.startup import StartupTimer
+from unittest.mock import MagicMock
+import logging
+
+
+class Clock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_mark_times_consecutive_steps():
+    clock = Clock()
+    timer = StartupTimer(clock=clock)
+    clock.now = 0.5
+    timer.mark('import')
+    clock.now = 0.75
+    timer.mark('create_app')
+
+    assert timer.steps == {'import': 0.5, 'create_app': 0.25}
+    assert timer.report() == 'import 0.500s, create_app 0.250s'
+
+
+def test_first_request_is_reported_once(caplog):
+    mock_backend = MagicMock()
+    mock_backend.return_value = mock_backend
+    app = create_app({'TESTING': True}, mock_backend)
+    timer = app.extensions['startup']
+    assert list(timer.steps) == ['import', 'create_app']
+
+    with caplog.at_level(logging.INFO):
+        app.test_client().get('/')
+        app.test_client().get('/')
+    assert list(timer.steps) == ['import', 'create_app', 'first_request']
+    assert [record.getMessage() for record in caplog.records
+           ].count(f'Startup: {timer.report()}') == 1
@@ -0,0 +1,229 @@
+"""
+Timeouts, retries and per-request deadlines for Google Cloud Storage.
+
+Every GCS call made through a PolicyBucket, or a blob it handed out, is
+given a timeout and an exponential backoff retry. Reads and metadata
+patches are always retried; uploads and deletes only when they carry
+if_generation_match, so a retry can't apply a write twice. A request can
+start a deadline: calls made for it then get no more than the time left,
+and once it has passed they fail with DeadlineExceeded before reaching
+GCS. A call timing out in requests also raises DeadlineExceeded. Work a
+request hands to a DeadlinePool keeps the request's deadline.
+
+All GCS buckets share one process-wide client with a connection pool
+sized for the threads serving requests.
+"""
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from google.api_core.exceptions import DeadlineExceeded
+
+DEFAULT_TIMEOUT = 10
+DEFAULT_RETRY_INITIAL = 0.1
+DEFAULT_RETRY_MAXIMUM = 5
+DEFAULT_RETRY_MULTIPLIER = 2
+DEFAULT_RETRY_TIMEOUT = 30
+DEFAULT_REQUEST_DEADLINE = 20
+DEFAULT_POOL_SIZE = 32
+
+READS = ('exists', 'reload', 'download_as_bytes', 'download_as_string',
+         'download_as_text', 'patch')
+WRITES = ('upload_from_string', 'upload_from_file', 'delete')
+
+_deadline = contextvars.ContextVar('storage_deadline', default=None)
+_client_lock = threading.Lock()
+_client = None
+
+
+def start_deadline(seconds):
+    """
+    Bounds the time the current request may spend in storage.\n
+    Args:
+        - Seconds, no deadline if None (float)
+    """
+    _deadline.set(time.monotonic() + seconds if seconds else None)
+
+
+def clear_deadline():
+    _deadline.set(None)
+
+
+def time_left():
+    """
+    Returns:
+        - Seconds left before the deadline, None without one (float)
+    """
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+class DeadlinePool(ThreadPoolExecutor):
+    """
+    Thread pool whose tasks run in a copy of the context they were
+    submitted from, so they keep the storage deadline of the request.
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        context = contextvars.copy_context()
+        return super().submit(context.run, fn, *args, **kwargs)
+
+
+def call_gcs(func, *args, **kwargs):
+    """
+    Makes a GCS call.\n
+    Raises:
+        - DeadlineExceeded if requests timed out
+    """
+    try:
+        return func(*args, **kwargs)
+    except Exception as error:
+        # Loaded with the GCS client, so only imported once it was used
+        from requests.exceptions import Timeout
+        if isinstance(error, Timeout):
+            raise DeadlineExceeded(f'Storage timed out: {error}') from error
+        raise
+
+
+def shared_client(pool_size=DEFAULT_POOL_SIZE):
+    """
+    Args:
+        - Most connections kept open to GCS (int)
+    Returns:
+        - The process-wide google.cloud.storage.Client, made on first call
+    """
+    global _client
+    with _client_lock:
+        if _client is None:
+            import google.auth
+            from google.auth.transport.requests import AuthorizedSession
+            from google.cloud import storage
+            from requests.adapters import HTTPAdapter
+
+            credentials, project = google.auth.default(
+                scopes=storage.Client.SCOPE)
+            session = AuthorizedSession(credentials)
+            adapter = HTTPAdapter(pool_connections=pool_size,
+                                  pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            _client = storage.Client(project=project,
+                                     credentials=credentials,
+                                     _http=session)
+        return _client
+
+
+class StoragePolicy:
+    """
+    Timeout and retry given to every call.
+
+    Attributes:
+        timeout: Seconds one attempt may take (float)
+        retry_initial, retry_maximum, retry_multiplier: First, longest and
+            growth of the waits between attempts
+        retry_timeout: Seconds all attempts of a call may take (float)
+    """
+
+    def __init__(self,
+                 timeout=DEFAULT_TIMEOUT,
+                 retry_initial=DEFAULT_RETRY_INITIAL,
+                 retry_maximum=DEFAULT_RETRY_MAXIMUM,
+                 retry_multiplier=DEFAULT_RETRY_MULTIPLIER,
+                 retry_timeout=DEFAULT_RETRY_TIMEOUT):
+        self.timeout = timeout
+        self.retry_initial = retry_initial
+        self.retry_maximum = retry_maximum
+        self.retry_multiplier = retry_multiplier
+        self.retry_timeout = retry_timeout
+
+    def options(self, retry=True):
+        """
+        Args:
+            - Whether the call may be retried (Boolean)
+        Returns:
+            - timeout and retry keyword arguments for a GCS call (dict)
+        Raises:
+            - DeadlineExceeded if the request's deadline has passed
+        """
+        left = time_left()
+        if left is not None and left <= 0:
+            raise DeadlineExceeded('Storage deadline of the request passed')
+        timeout = self.timeout if left is None else min(self.timeout, left)
+        if not retry:
+            return {'timeout': timeout, 'retry': None}
+
+        from google.cloud.storage.retry import DEFAULT_RETRY
+        retry_timeout = (self.retry_timeout if left is None else min(
+            self.retry_timeout, left))
+        return {
+            'timeout':
+                timeout,
+            'retry':
+                DEFAULT_RETRY.with_delay(initial=self.retry_initial,
+                                         maximum=self.retry_maximum,
+                                         multiplier=self.retry_multiplier
+                                        ).with_timeout(retry_timeout)
+        }
+
+
+class PolicyBucket:
+    """
+    A GCS bucket whose calls, and those of its blobs, follow a policy.
+    """
+
+    def __init__(self, bucket, policy):
+        self._bucket = bucket
+        self._policy = policy
+
+    @property
+    def name(self):
+        return self._bucket.name
+
+    def blob(self, name):
+        return PolicyBlob(self._bucket.blob(name), self._policy)
+
+    def get_blob(self, name):
+        blob = call_gcs(self._bucket.get_blob, name, **self._policy.options())
+        return None if blob is None else PolicyBlob(blob, self._policy)
+
+    def list_blobs(self, **kwargs):
+        blobs = call_gcs(lambda: list(
+            self._bucket.list_blobs(**kwargs, **self._policy.options())))
+        return [PolicyBlob(blob, self._policy) for blob in blobs]
+
+    def __getattr__(self, attr):
+        return getattr(self._bucket, attr)
+
+
+class PolicyBlob:
+    """
+    A GCS blob whose reads and writes follow a policy. Other attributes,
+    set or read, are the blob's own.
+    """
+
+    def __init__(self, blob, policy):
+        object.__setattr__(self, '_blob', blob)
+        object.__setattr__(self, '_policy', policy)
+
+    def __getattr__(self, attr):
+        value = getattr(self._blob, attr)
+        if attr not in READS and attr not in WRITES:
+            return value
+
+        @functools.wraps(value)
+        def call(*args, **kwargs):
+            retry = (attr in READS or
+                     kwargs.get('if_generation_match') is not None)
+            return call_gcs(value, *args, **{
+                **self._policy.options(retry),
+                **kwargs
+            })
+
+        return call
+
+    def __setattr__(self, attr, value):
+        setattr(self._blob, attr, value)
+
+    def __delattr__(self, attr):
+        delattr(self._blob, attr)
@@ -0,0 +1,130 @@
+from flaskr.storage_policy import StoragePolicy, PolicyBucket, DeadlinePool, start_deadline, clear_deadline, time_left
+from google.api_core.exceptions import DeadlineExceeded
+from unittest.mock import MagicMock
+import pytest
+import requests
+
+
+@pytest.fixture
+def policy():
+    yield StoragePolicy(timeout=5, retry_timeout=30)
+    clear_deadline()
+
+
+@pytest.fixture
+def bucket(policy):
+    raw = MagicMock()
+    raw.get_blob.return_value = MagicMock()
+    raw.list_blobs.return_value = [MagicMock(), MagicMock()]
+    return raw, PolicyBucket(raw, policy)
+
+
+def test_options_without_deadline(policy):
+    options = policy.options()
+    assert options['timeout'] == 5
+    assert options['retry'] is not None
+    assert options['retry']._deadline == 30
+    assert policy.options(retry=False) == {'timeout': 5, 'retry': None}
+
+
+def test_options_are_cut_to_the_deadline(policy):
+    start_deadline(2)
+    options = policy.options()
+    assert 0 < options['timeout'] <= 2
+    assert options['retry']._deadline <= 2
+
+    start_deadline(1e-9)
+    with pytest.raises(DeadlineExceeded):
+        policy.options()
+
+    clear_deadline()
+    assert time_left() is None
+
+
+def test_reads_are_retried(bucket):
+    raw, wrapped = bucket
+    blob = wrapped.get_blob('pitch.md')
+    assert raw.get_blob.call_args.kwargs['timeout'] == 5
+
+    blob.download_as_bytes()
+    kwargs = raw.get_blob.return_value.download_as_bytes.call_args.kwargs
+    assert kwargs['timeout'] == 5
+    assert kwargs['retry'] is not None
+
+    blob.download_as_text(timeout=1)
+    kwargs = raw.get_blob.return_value.download_as_text.call_args.kwargs
+    assert kwargs['timeout'] == 1
+
+
+def test_requests_timeouts_raise_deadline_exceeded(bucket):
+    raw, wrapped = bucket
+    raw.get_blob.return_value.download_as_bytes.side_effect = (
+        requests.exceptions.ReadTimeout('slow'))
+    with pytest.raises(DeadlineExceeded):
+        wrapped.get_blob('pitch.md').download_as_bytes()
+
+    raw.list_blobs.side_effect = requests.exceptions.ConnectTimeout('slow')
+    with pytest.raises(DeadlineExceeded):
+        wrapped.list_blobs()
+
+    raw.get_blob.side_effect = ValueError('other')
+    with pytest.raises(ValueError):
+        wrapped.get_blob('pitch.md')
+
+
+def test_pool_tasks_keep_the_deadline(policy):
+    start_deadline(5)
+    with DeadlinePool(max_workers=2) as pool:
+        left = list(pool.map(lambda _: time_left(), range(4)))
+    assert all(0 < seconds <= 5 for seconds in left)
+
+    clear_deadline()
+    with DeadlinePool(max_workers=2) as pool:
+        assert pool.submit(time_left).result() is None
+
+
+def test_writes_retried_only_with_generation(bucket):
+    raw, wrapped = bucket
+    blob = wrapped.blob('counts.json')
+    raw_blob = raw.blob.return_value
+
+    blob.upload_from_string('{}')
+    assert raw_blob.upload_from_string.call_args.kwargs['retry'] is None
+
+    blob.upload_from_string('{}', if_generation_match=3)
+    kwargs = raw_blob.upload_from_string.call_args.kwargs
+    assert kwargs['retry'] is not None
+    assert kwargs['if_generation_match'] == 3
+
+    blob.delete()
+    assert raw_blob.delete.call_args.kwargs['retry'] is None
+
+
+def test_blob_attributes_pass_through(bucket):
+    raw, wrapped = bucket
+    blob = wrapped.blob('a.png')
+    blob.metadata = {'sha256': 'abc'}
+    assert raw.blob.return_value.metadata == {'sha256': 'abc'}
+    assert blob.name is raw.blob.return_value.name
+
+    assert len(wrapped.list_blobs(prefix='a/')) == 2
+    assert raw.list_blobs.call_args.kwargs['prefix'] == 'a/'
+
+    raw.get_blob.return_value = None
+    assert wrapped.get_blob('missing') is None
+
+
+def test_shared_client_is_made_once(monkeypatch):
+    from flaskr import storage_policy
+    monkeypatch.setattr(storage_policy, '_client', None)
+    credentials = MagicMock()
+    monkeypatch.setattr('google.auth.default',
+                        MagicMock(return_value=(credentials, 'project')))
+    client_class = MagicMock()
+    monkeypatch.setattr('google.cloud.storage.Client', client_class)
+
+    client = storage_policy.shared_client(pool_size=4)
+    assert storage_policy.shared_client() is client
+    client_class.assert_called_once()
+    session = client_class.call_args.kwargs['_http']
+    assert session.adapters['https://']._pool_maxsize == 4
@@ -0,0 +1,183 @@
+"""
+Typeahead suggestions of page names and headings.
+
+Every word of every page name and heading is a key of a sorted array, so
+the suggestions for a prefix are one binary search away. They are ranked
+by the page's views, page names before headings. Suggestions are always
+answered from the last array and views read, so typing never waits on
+storage: both are read again in the background once refresh_interval has
+passed, and right after a page is uploaded.
+"""
+import heapq
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import namedtuple
+
+from markdown.extensions.toc import slugify
+
+from flaskr.search import WORD
+
+DEFAULT_RESULTS = 8
+DEFAULT_REFRESH_INTERVAL = 60
+PAGE = 0
+HEADING = 1
+
+Suggestion = namedtuple('Suggestion', ['text', 'page', 'url', 'kind'])
+
+
+def suggestions(pages):
+    """
+    Args:
+        - Page name to IndexedPage (dict)
+    Returns:
+        - A suggestion for every page and every heading other than the
+          page's name, linking to the heading's id (list of Suggestion)
+    """
+    found = []
+    for page_name, page in pages.items():
+        found.append(
+            Suggestion(page_name, page_name, f'/pages/{page_name}', PAGE))
+        for heading in page.headings:
+            if heading.lower() == page_name.lower():
+                continue
+            found.append(
+                Suggestion(heading, page_name,
+                           f'/pages/{page_name}#{slugify(heading, "-")}',
+                           HEADING))
+    return found
+
+
+class PrefixIndex:
+    """
+    Sorted array of the words of suggestions, each running to the end of
+    its suggestion, e.g. 'major scale' and 'scale' for 'Major scale'.
+
+    Attributes:
+        suggestions: Everything that can be suggested (list of Suggestion)
+    """
+
+    def __init__(self, suggestions):
+        self.suggestions = list(suggestions)
+        keys = []
+        for position, suggestion in enumerate(self.suggestions):
+            lowered = suggestion.text.lower()
+            for word in WORD.finditer(lowered):
+                keys.append((lowered[word.start():], position))
+        keys.sort()
+        self._keys = [key for key, _ in keys]
+        self._positions = [position for _, position in keys]
+
+    def matches(self, prefix):
+        """
+        Args:
+            - Start of a word (str)
+        Returns:
+            - Suggestions with a word starting with it (set of Suggestion)
+        """
+        prefix = prefix.lower()
+        start = bisect_left(self._keys, prefix)
+        end = bisect_left(self._keys, prefix + '\uffff', start)
+        return {
+            self.suggestions[position]
+            for position in self._positions[start:end]
+        }
+
+
+class PageSuggest:
+    """
+    Suggestions for what is being typed in the search box.
+
+    Attributes:
+        search: The pages and their headings (PageSearch)
+        popularity: Views by page (PopularityCounter)
+        refresh_interval: Seconds the pages and views are used before
+                          being read again (float)
+    """
+
+    def __init__(self,
+                 search,
+                 popularity,
+                 refresh_interval=DEFAULT_REFRESH_INTERVAL,
+                 clock=time.monotonic):
+        self.search = search
+        self.popularity = popularity
+        self.refresh_interval = refresh_interval
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._index = PrefixIndex([])
+        self._index_version = None
+        self._views = {}
+        self._refreshed_at = None
+        self._refreshing = False
+        self._requested = False
+
+    def suggest(self, prefix, limit=DEFAULT_RESULTS):
+        """
+        Args:
+            - What has been typed (str), most suggestions (int)
+        Returns:
+            - Most viewed pages first, names before headings (list of
+              Suggestion)
+        """
+        prefix = prefix.strip()
+        if not prefix:
+            return []
+        with self._lock:
+            due = (self._refreshed_at is None or
+                   self._clock() - self._refreshed_at >= self.refresh_interval)
+            if due:
+                # Not again before the interval, even if this one fails
+                self._refreshed_at = self._clock()
+            index, views = self._index, self._views
+        if due:
+            self.refresh_in_background()
+
+        def rank(suggestion):
+            return (-views.get(suggestion.page, 0), suggestion.kind,
+                    suggestion.text.lower(), suggestion.url)
+
+        return heapq.nsmallest(limit, index.matches(prefix), key=rank)
+
+    def refresh(self):
+        """
+        Reads the pages and their views, making the prefix index again if
+        the search index changed.
+        """
+        version, pages = self.search.snapshot()
+        with self._lock:
+            rebuild = version != self._index_version
+        index = PrefixIndex(suggestions(pages)) if rebuild else None
+        views = dict(self.popularity.counts())
+        with self._lock:
+            if index is not None:
+                self._index, self._index_version = index, version
+            self._views = views
+            self._refreshed_at = self._clock()
+
+    def refresh_in_background(self):
+        """
+        Refreshes on another thread, once more after the running refresh
+        if one is running already, e.g. when a page was just uploaded.
+        """
+        with self._lock:
+            self._requested = True
+            if self._refreshing:
+                return
+            self._refreshing = True
+
+        def run():
+            while True:
+                with self._lock:
+                    if not self._requested:
+                        self._refreshing = False
+                        return
+                    self._requested = False
+                try:
+                    self.refresh()
+                except Exception:
+                    logging.exception('Suggestion refresh failed')
+
+        threading.Thread(target=run, name='suggest-refresh',
+                         daemon=True).start()
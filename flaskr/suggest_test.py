@@ -0,0 +1,138 @@
+from flaskr.suggest import PageSuggest, PrefixIndex, Suggestion, suggestions, PAGE, HEADING
+from flaskr.search import PageSearch
+from flaskr.blobstore import MemoryStore
+from flaskr.catalog import BlobCatalog
+from google.api_core.exceptions import ServiceUnavailable
+from unittest.mock import MagicMock, patch
+import pytest
+import threading
+
+PAGES = {
+    'scales': '# Scales\n## Major scale\nSteps\n## Minor scale\nSteps',
+    'chord': '# Chord\n## Seventh chords\nFour notes',
+    'melody': '# Melody\n## Scale degrees in melody\nNotes',
+}
+
+
+class Clock:
+
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def search():
+    bucket = MemoryStore().bucket('content')
+    for name, content in PAGES.items():
+        bucket.blob(f'{name}.md').upload_from_string(content)
+    catalog = BlobCatalog(bucket, include=lambda name: name.endswith('.md'))
+    return PageSearch(bucket, catalog)
+
+
+@pytest.fixture
+def popularity():
+    popularity = MagicMock()
+    popularity.counts.return_value = {'melody': 5, 'scales': 2}
+    return popularity
+
+
+def test_suggestions_link_to_headings(search):
+    found = suggestions(search.pages())
+    assert Suggestion('scales', 'scales', '/pages/scales', PAGE) in found
+    assert Suggestion('Major scale', 'scales', '/pages/scales#major-scale',
+                      HEADING) in found
+    # The top heading is the page name already
+    assert not any(suggestion.text == 'Scales' for suggestion in found)
+
+
+def test_prefix_index_matches_any_word():
+    index = PrefixIndex([
+        Suggestion('Major scale', 'scales', '', HEADING),
+        Suggestion('scales', 'scales', '', PAGE),
+        Suggestion('chord', 'chord', '', PAGE),
+    ])
+    assert {s.text for s in index.matches('sca')} == {'Major scale', 'scales'}
+    assert {s.text for s in index.matches('MAJOR S')} == {'Major scale'}
+    assert index.matches('x') == set()
+    assert PrefixIndex([]).matches('a') == set()
+
+
+def wait_for_refresh():
+    for thread in threading.enumerate():
+        if thread.name == 'suggest-refresh':
+            thread.join()
+
+
+def test_suggest_ranked_by_views(search, popularity):
+    suggest = PageSuggest(search, popularity)
+    suggest.refresh()
+    assert [s.text for s in suggest.suggest('sca')] == [
+        'Scale degrees in melody', 'scales', 'Major scale', 'Minor scale'
+    ]
+    assert [s.text for s in suggest.suggest('sca', limit=2)
+           ] == ['Scale degrees in melody', 'scales']
+    assert suggest.suggest('  ') == []
+
+
+def test_first_suggest_refreshes_in_background(search, popularity):
+    suggest = PageSuggest(search, popularity)
+    with patch.object(suggest, 'refresh') as refresh:
+        assert suggest.suggest('sca') == []
+        wait_for_refresh()
+    refresh.assert_called_once_with()
+
+
+def test_suggest_without_storage_calls(search, popularity):
+    suggest = PageSuggest(search, popularity)
+    suggest.refresh()
+    with patch.object(search, 'snapshot') as snapshot:
+        for prefix in ['s', 'se', 'sev', 'seve']:
+            suggest.suggest(prefix)
+    snapshot.assert_not_called()
+    popularity.counts.assert_called_once()
+
+
+def test_suggest_answers_while_storage_fails(search, popularity):
+    clock = Clock()
+    suggest = PageSuggest(search, popularity, clock=clock)
+    suggest.refresh()
+    clock.now += 60
+    with patch.object(search,
+                      'snapshot',
+                      side_effect=ServiceUnavailable('down')):
+        assert suggest.suggest('seven')[0].text == 'Seventh chords'
+        wait_for_refresh()
+        clock.now += 1
+        assert suggest.suggest('seven')[0].text == 'Seventh chords'
+        wait_for_refresh()
+        assert search.snapshot.call_count == 1
+
+
+def test_suggest_follows_updates(search, popularity):
+    suggest = PageSuggest(search, popularity)
+    suggest.refresh()
+    assert suggest.suggest('sonata') == []
+    form = search.bucket.blob('form.md')
+    form.upload_from_string('# Form\n## Sonata form')
+    search.catalog.record(form)
+    search.update('form', '# Form\n## Sonata form', form.generation)
+    suggest.refresh_in_background()
+    wait_for_refresh()
+    assert [s.url for s in suggest.suggest('sonata')
+           ] == ['/pages/form#sonata-form']
+
+
+def test_views_read_again_after_interval(search, popularity):
+    clock = Clock(0)
+    suggest = PageSuggest(search, popularity, refresh_interval=60, clock=clock)
+    suggest.refresh()
+    suggest.suggest('a')
+    wait_for_refresh()
+    assert popularity.counts.call_count == 1
+    clock.now = 61
+    suggest.suggest('a')
+    wait_for_refresh()
+    assert popularity.counts.call_count == 2
@@ -0,0 +1,144 @@
+"""
+Token bucket throttling of login and sign up attempts.
+
+Every attempt takes a token from the bucket of its username and from the
+bucket of its client address. Buckets refill at a steady rate up to a
+burst size, and an attempt finding either bucket empty is rejected before
+any storage read or password check. Bucket state lives in a store, in
+process memory by default; a store shared by several workers only needs
+the take() method of MemoryBucketStore.
+"""
+import threading
+import time
+
+from werkzeug.exceptions import TooManyRequests
+
+DEFAULT_USER_BURST = 5
+DEFAULT_USER_RATE = 1 / 12
+DEFAULT_ADDRESS_BURST = 20
+DEFAULT_ADDRESS_RATE = 1 / 3
+DEFAULT_MAX_KEYS = 10000
+
+
+class Throttled(TooManyRequests):
+    """
+    Too many attempts for a username or from an address.
+
+    Attributes:
+        retry_after: Seconds until the next attempt can pass (float)
+    """
+
+    def __init__(self, retry_after):
+        super().__init__('Too many attempts, try again in '
+                         f'{int(retry_after) + 1} seconds')
+        self.retry_after = retry_after
+
+
+class MemoryBucketStore:
+    """
+    Token buckets of one process.
+
+    Attributes:
+        max_keys: Buckets kept before full ones are forgotten (int)
+    """
+
+    def __init__(self, max_keys=DEFAULT_MAX_KEYS):
+        self.max_keys = max_keys
+        self._lock = threading.Lock()
+        # key -> (tokens, time they were counted)
+        self._buckets = {}
+
+    def take(self, key, burst, rate, now):
+        """
+        Takes a token if there is one.\n
+        Args:
+            - Bucket key (str), most tokens (int),
+              tokens added per second (float), current time (float)
+        Returns:
+            - 0 if a token was taken, else seconds until there is one (float)
+        """
+        with self._lock:
+            tokens, counted = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - counted) * rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) / rate
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now, burst, rate)
+            return 0
+
+    def _prune(self, now, burst, rate):
+        # A bucket that has refilled is the same as no bucket
+        for key, (tokens, counted) in list(self._buckets.items()):
+            if tokens + (now - counted) * rate >= burst:
+                del self._buckets[key]
+
+
+class LoginThrottle:
+    """
+    Limits attempts per username and per client address.
+
+    Attributes:
+        store: Where buckets are kept (MemoryBucketStore or alike)
+        user_burst, user_rate: Bucket size and refill per second by username
+        address_burst, address_rate: Bucket size and refill per second
+            by client address
+        allowed: Attempts let through (int)
+        rejected: Attempts rejected, by 'user' and 'address' (dict)
+    """
+
+    def __init__(self,
+                 store=None,
+                 user_burst=DEFAULT_USER_BURST,
+                 user_rate=DEFAULT_USER_RATE,
+                 address_burst=DEFAULT_ADDRESS_BURST,
+                 address_rate=DEFAULT_ADDRESS_RATE,
+                 clock=time.monotonic):
+        self.store = store if store is not None else MemoryBucketStore()
+        self.user_burst = user_burst
+        self.user_rate = user_rate
+        self.address_burst = address_burst
+        self.address_rate = address_rate
+        self.allowed = 0
+        self.rejected = {'user': 0, 'address': 0}
+        self._clock = clock
+        self._lock = threading.Lock()
+
+    def check(self, username, address=None):
+        """
+        Args:
+            - Username of the attempt (str), client address (str or None)
+        Raises:
+            - Throttled if the attempt has to wait
+        """
+        now = self._clock()
+        if address is not None:
+            wait = self.store.take(f'address:{address}', self.address_burst,
+                                   self.address_rate, now)
+            if wait:
+                self._count('address')
+                raise Throttled(wait)
+        wait = self.store.take(f'user:{username.lower()}', self.user_burst,
+                               self.user_rate, now)
+        if wait:
+            self._count('user')
+            raise Throttled(wait)
+        with self._lock:
+            self.allowed += 1
+
+    def stats(self):
+        """
+        Returns:
+            - Attempts allowed and rejected (dict)
+        """
+        with self._lock:
+            return {
+                'allowed': self.allowed,
+                'rejected_user': self.rejected['user'],
+                'rejected_address': self.rejected['address']
+            }
+
+    def _count(self, kind):
+        with self._lock:
+            self.rejected[kind] += 1
@@ -0,0 +1,71 @@
+from flaskr.throttle import LoginThrottle, MemoryBucketStore, Throttled
+import pytest
+
+
+class Clock:
+
+    def __init__(self, now=0.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_refills():
+    store = MemoryBucketStore()
+    assert store.take('key', 2, 1.0, 0.0) == 0
+    assert store.take('key', 2, 1.0, 0.0) == 0
+    assert store.take('key', 2, 1.0, 0.0) == pytest.approx(1.0)
+    assert store.take('key', 2, 1.0, 0.5) == pytest.approx(0.5)
+    assert store.take('key', 2, 1.0, 1.0) == 0
+
+
+def test_full_buckets_are_pruned():
+    store = MemoryBucketStore(max_keys=2)
+    store.take('a', 1, 1.0, 0.0)
+    store.take('b', 1, 1.0, 0.0)
+    store.take('c', 1, 1.0, 5.0)
+
+    assert list(store._buckets) == ['c']
+
+
+def test_throttle_by_username():
+    clock = Clock()
+    throttle = LoginThrottle(user_burst=2, user_rate=0.1, clock=clock)
+    throttle.check('Sandy', '10.0.0.1')
+    throttle.check('sandy', '10.0.0.2')
+
+    with pytest.raises(Throttled) as error:
+        throttle.check('SANDY', '10.0.0.3')
+    assert error.value.retry_after == pytest.approx(10.0)
+    assert error.value.code == 429
+    throttle.check('bob', '10.0.0.3')
+
+    clock.now = 10.0
+    throttle.check('sandy', '10.0.0.1')
+    assert throttle.stats() == {
+        'allowed': 4,
+        'rejected_user': 1,
+        'rejected_address': 0
+    }
+
+
+def test_throttle_by_address():
+    throttle = LoginThrottle(address_burst=2, clock=Clock())
+    throttle.check('a', '10.0.0.1')
+    throttle.check('b', '10.0.0.1')
+
+    with pytest.raises(Throttled):
+        throttle.check('c', '10.0.0.1')
+    throttle.check('c', '10.0.0.2')
+    assert throttle.stats()['rejected_address'] == 1
+
+
+def test_shared_store():
+    store = MemoryBucketStore()
+    first = LoginThrottle(store=store, user_burst=1, clock=Clock())
+    second = LoginThrottle(store=store, user_burst=1, clock=Clock())
+    first.check('sandy')
+
+    with pytest.raises(Throttled):
+        second.check('sandy')
@@ -0,0 +1,187 @@
+"""
+Background generation of downsized copies of uploaded images.
+
+Derivatives are stored in the images bucket as
+derivatives/<size>/<image name> and the original blob's metadata names
+them. Pillow is needed to resize; without it no derivatives are made and
+pages keep showing the originals.
+"""
+import io
+import logging
+import queue
+import threading
+
+try:
+    from PIL import Image
+except ImportError:  # pragma: no cover
+    Image = None
+
+DERIVATIVE_PREFIX = 'derivatives/'
+THUMB = 'thumb'
+MEDIUM = 'medium'
+SIZES = {THUMB: (200, 200), MEDIUM: (600, 600)}
+DEFAULT_QUEUE_SIZE = 64
+FORMATS = {
+    'png': ('PNG', 'image/png'),
+    'jpg': ('JPEG', 'image/jpeg'),
+    'jpeg': ('JPEG', 'image/jpeg')
+}
+
+
+def derivative_name(size_name, name):
+    """
+    Args:
+        - Size name, e.g. 'thumb' (str), name of the original image (str)
+    Returns:
+        - Name of the derivative blob (str)
+    """
+    return f'{DERIVATIVE_PREFIX}{size_name}/{name}'
+
+
+def resize(data, box, image_format):
+    """
+    Shrinks an image to fit in a box, keeping its aspect ratio.\n
+    Args:
+        - Image file contents (bytes), (width, height) (tuple),
+          Pillow format name (str)
+    Returns:
+        - Resized image file contents (bytes)
+    """
+    with Image.open(io.BytesIO(data)) as image:
+        image.thumbnail(box)
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        out = io.BytesIO()
+        image.save(out, format=image_format)
+        return out.getvalue()
+
+
+class ThumbnailPipeline:
+    """
+    Makes derivatives of images off the request thread.
+
+    Uploaded image names are put on a bounded queue and a single worker
+    thread resizes them. When the queue is full the image is skipped
+    and left for backfill().
+
+    Attributes:
+        bucket: The images bucket
+        catalog: Index of the images bucket, told about new derivatives
+        sizes: Size name to (width, height) box (dict)
+        processed: Images that got their derivatives (int)
+        dropped: Images skipped because the queue was full (int)
+    """
+
+    def __init__(self,
+                 bucket,
+                 catalog=None,
+                 sizes=SIZES,
+                 queue_size=DEFAULT_QUEUE_SIZE):
+        self.bucket = bucket
+        self.catalog = catalog
+        self.sizes = sizes
+        self.processed = 0
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._lock = threading.Lock()
+        self._worker = None
+
+    @property
+    def enabled(self):
+        return Image is not None
+
+    def submit(self, name):
+        """
+        Queues an image for derivatives without waiting for them.\n
+        Args:
+            - Name of the uploaded image (str)
+        Returns:
+            - (Boolean) True if queued
+        """
+        if not self.enabled or name.startswith(DERIVATIVE_PREFIX):
+            return False
+        self._start_worker()
+        try:
+            self._queue.put_nowait(name)
+        except queue.Full:
+            self.dropped += 1
+            logging.warning('Thumbnail queue full, skipping %s', name)
+            return False
+        return True
+
+    def join(self):
+        """
+        Waits until every queued image is processed.
+        """
+        self._queue.join()
+
+    def process(self, name):
+        """
+        Makes every derivative of one image and records them in the
+        original's metadata.\n
+        Args:
+            - Name of the original image (str)
+        Returns:
+            - Size name to derivative name (dict), empty if not an image
+        """
+        image_format, content_type = FORMATS.get(
+            name.split('.')[-1].lower(), (None, None))
+        blob = self.bucket.get_blob(name)
+        if image_format is None or blob is None:
+            return {}
+
+        data = blob.download_as_bytes()
+        derivatives = {}
+        for size_name, box in self.sizes.items():
+            derivative = self.bucket.blob(derivative_name(size_name, name))
+            derivative.upload_from_string(resize(data, box, image_format),
+                                          content_type=content_type)
+            if self.catalog is not None:
+                self.catalog.record(derivative)
+            derivatives[size_name] = derivative.name
+
+        blob.metadata = {**(blob.metadata or {}), **derivatives}
+        blob.patch()
+        self.processed += 1
+        return derivatives
+
+    def backfill(self, names):
+        """
+        Makes derivatives, on the calling thread, for images missing any.\n
+        Args:
+            - Names of every blob in the images bucket (iterable of str)
+        Returns:
+            - Number of images processed (int)
+        """
+        if not self.enabled:
+            return 0
+        names = set(names)
+        count = 0
+        for name in sorted(names):
+            if name.startswith(DERIVATIVE_PREFIX):
+                continue
+            missing = [
+                size_name for size_name in self.sizes
+                if derivative_name(size_name, name) not in names
+            ]
+            if missing and self.process(name):
+                count += 1
+        return count
+
+    def _start_worker(self):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run,
+                                                name='thumbnails',
+                                                daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            name = self._queue.get()
+            try:
+                self.process(name)
+            except Exception:
+                logging.exception('Could not make thumbnails of %s', name)
+            finally:
+                self._queue.task_done()
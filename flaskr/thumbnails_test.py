@@ -0,0 +1,76 @@
+from flaskr.backend_test import storage_client_mock
+from flaskr.catalog import BlobCatalog
+from flaskr.thumbnails import ThumbnailPipeline, derivative_name, resize
+from PIL import Image
+import io
+import pytest
+
+
+def make_image(image_format='PNG', size=(1000, 500)):
+    out = io.BytesIO()
+    Image.new('RGB', size, 'red').save(out, format=image_format)
+    return out.getvalue()
+
+
+@pytest.fixture
+def bucket():
+    bucket = storage_client_mock().bucket('images')
+    bucket.blob('scale.png').upload_from_string(make_image())
+    bucket.blob('chord.jpg').upload_from_string(make_image('JPEG'))
+    return bucket
+
+
+def test_resize_keeps_aspect_ratio():
+    data = resize(make_image(), (200, 200), 'PNG')
+    with Image.open(io.BytesIO(data)) as image:
+        assert image.size == (200, 100)
+
+
+def test_process_writes_derivatives(bucket):
+    catalog = BlobCatalog(bucket)
+    catalog.names()
+    pipeline = ThumbnailPipeline(bucket, catalog)
+
+    derivatives = pipeline.process('scale.png')
+
+    assert derivatives == {
+        'thumb': 'derivatives/thumb/scale.png',
+        'medium': 'derivatives/medium/scale.png'
+    }
+    assert bucket.get_blob('scale.png').metadata == derivatives
+    assert derivative_name('thumb', 'scale.png') in catalog.entries()
+    thumb = bucket.get_blob('derivatives/thumb/scale.png').download_as_bytes()
+    with Image.open(io.BytesIO(thumb)) as image:
+        assert image.size == (200, 100)
+
+
+def test_submit_runs_off_thread(bucket):
+    pipeline = ThumbnailPipeline(bucket)
+    assert pipeline.submit('chord.jpg')
+    pipeline.join()
+
+    assert pipeline.processed == 1
+    assert bucket.get_blob('derivatives/thumb/chord.jpg') is not None
+
+
+def test_submit_ignores_derivatives(bucket):
+    pipeline = ThumbnailPipeline(bucket)
+    assert not pipeline.submit('derivatives/thumb/chord.jpg')
+
+
+def test_submit_drops_when_full(bucket):
+    pipeline = ThumbnailPipeline(bucket, queue_size=1)
+    # A worker that never starts keeps the queue full
+    pipeline._worker = object()
+    assert pipeline.submit('chord.jpg')
+    assert not pipeline.submit('scale.png')
+    assert pipeline.dropped == 1
+
+
+def test_backfill_only_missing(bucket):
+    pipeline = ThumbnailPipeline(bucket)
+    pipeline.process('chord.jpg')
+    names = [blob.name for blob in bucket.list_blobs()]
+
+    assert pipeline.backfill(names) == 1
+    assert bucket.get_blob('derivatives/medium/scale.png') is not None
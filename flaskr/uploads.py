@@ -0,0 +1,185 @@
+"""
+Spooling of uploaded files.
+
+Uploaded file parts are written by the form parser into a SpooledUpload,
+which keeps small files in memory, moves larger ones to a temporary file
+and, while the bytes go by, measures, hashes and finds the markdown
+links of the file. The file is never read back just to check it, and a
+file over the size limit is rejected as soon as the limit is passed.
+"""
+import codecs
+import hashlib
+import re
+import tempfile
+from flask import Request, current_app
+from werkzeug.exceptions import RequestEntityTooLarge
+
+DEFAULT_SPOOL_THRESHOLD = 1024 * 1024
+DEFAULT_MAX_UPLOAD_SIZE = 16 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+LINK_PATTERN = re.compile(r'\[(.*?)\]\((.*?)\)')
+
+
+class UploadTooLarge(RequestEntityTooLarge):
+    """
+    An uploaded file is over the size limit.
+    """
+
+
+class LinkScanner:
+    """
+    Finds [text](url) markdown links in text fed in chunks of bytes.
+
+    Links never span lines, so text is matched a whole line at a time.
+    """
+
+    def __init__(self):
+        self.links = []
+        self._decoder = codecs.getincrementaldecoder('utf-8')('replace')
+        self._line = ''
+
+    def feed(self, data):
+        """
+        Args:
+            - Next chunk of the file (bytes)
+        """
+        text = self._line + self._decoder.decode(data)
+        lines = text.split('\n')
+        self._line = lines.pop()
+        for line in lines:
+            self.links.extend(LINK_PATTERN.findall(line))
+
+    def close(self):
+        """
+        Returns:
+            - Every (text, url) link found (list)
+        """
+        self.feed(self._decoder.decode(b'', final=True).encode('utf-8'))
+        if self._line:
+            self.links.extend(LINK_PATTERN.findall(self._line))
+            self._line = ''
+        return self.links
+
+
+class SpooledUpload:
+    """
+    Readable, writable, seekable spool of one uploaded file.
+
+    Attributes:
+        max_size: Most bytes accepted, no limit if None (int)
+        size: Bytes written so far (int)
+    """
+
+    def __init__(self,
+                 max_size=DEFAULT_MAX_UPLOAD_SIZE,
+                 threshold=DEFAULT_SPOOL_THRESHOLD,
+                 scan_links=False):
+        self.max_size = max_size
+        self.size = 0
+        self._file = tempfile.SpooledTemporaryFile(max_size=threshold)
+        self._hash = hashlib.sha256()
+        self._scanner = LinkScanner() if scan_links else None
+        self._links = None
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size is not None and self.size > self.max_size:
+            raise UploadTooLarge(
+                f'Files are limited to {self.max_size // 1024 // 1024} MB')
+        self._hash.update(data)
+        if self._scanner is not None:
+            self._scanner.feed(data)
+        return self._file.write(data)
+
+    @property
+    def sha256(self):
+        """
+        Returns:
+            - Hex digest of everything written (str)
+        """
+        return self._hash.hexdigest()
+
+    @property
+    def links(self):
+        """
+        Returns:
+            - Markdown (text, url) links written, empty if not scanned (list)
+        """
+        if self._links is None:
+            self._links = self._scanner.close() if self._scanner else []
+        return self._links
+
+    @property
+    def on_disk(self):
+        return self._file._rolled
+
+    def __getattr__(self, name):
+        # read, readline, seek, tell, close, ... of the spool
+        return getattr(self._file, name)
+
+    def __iter__(self):
+        return iter(self._file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self._file.close()
+
+
+def spool(content,
+          max_size=DEFAULT_MAX_UPLOAD_SIZE,
+          threshold=DEFAULT_SPOOL_THRESHOLD,
+          scan_links=False):
+    """
+    Returns the SpooledUpload the form parser already wrote a file into,
+    or copies any other file into a new one, a chunk at a time.\n
+    Args:
+        - Contents of a file (IO or FileStorage), most bytes (int),
+          bytes kept in memory (int), whether to find links (Boolean)
+    Returns:
+        - The spooled file, at position 0 (SpooledUpload)
+    Raises:
+        - UploadTooLarge
+    """
+    stream = getattr(content, 'stream', None)
+    if isinstance(stream, SpooledUpload) and (stream._scanner is not None or
+                                              not scan_links):
+        if max_size is not None and stream.size > max_size:
+            raise UploadTooLarge(
+                f'Files are limited to {max_size // 1024 // 1024} MB')
+        stream.seek(0)
+        return stream
+
+    spooled = SpooledUpload(max_size, threshold, scan_links)
+    while True:
+        chunk = content.read(CHUNK_SIZE)
+        if not chunk:
+            break
+        spooled.write(chunk)
+    spooled.seek(0)
+    return spooled
+
+
+class UploadRequest(Request):
+    """
+    Request whose uploaded files are parsed into SpooledUploads, so
+    they are size checked, hashed and link scanned as they arrive.
+    A .zip is only bound by MAX_CONTENT_LENGTH, its members are
+    checked one by one when they are uploaded.
+    """
+
+    def _get_file_stream(self,
+                         total_content_length,
+                         content_type,
+                         filename=None,
+                         content_length=None):
+        config = current_app.config
+        filename = (filename or '').lower()
+        max_size = config.get('UPLOAD_MAX_SIZE', DEFAULT_MAX_UPLOAD_SIZE)
+        if filename.endswith('.zip'):
+            max_size = None
+        return SpooledUpload(max_size=max_size,
+                             threshold=config.get('UPLOAD_SPOOL_THRESHOLD',
+                                                  DEFAULT_SPOOL_THRESHOLD),
+                             scan_links=filename.endswith('.md'))
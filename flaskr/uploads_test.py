@@ -0,0 +1,52 @@
+from flaskr.uploads import LinkScanner, SpooledUpload, UploadTooLarge, spool
+from werkzeug.datastructures import FileStorage
+import hashlib
+import io
+import pytest
+
+
+def test_link_scanner_across_chunks():
+    scanner = LinkScanner()
+    text = 'Intro [pitch](/pitch)\nthen [chord](/chord) é [x](/y)'.encode()
+    for i in range(0, len(text), 3):
+        scanner.feed(text[i:i + 3])
+
+    assert scanner.close() == [('pitch', '/pitch'), ('chord', '/chord'),
+                               ('x', '/y')]
+
+
+def test_spooled_upload_hashes_and_rolls_to_disk():
+    spooled = SpooledUpload(max_size=100, threshold=8)
+    spooled.write(b'0123456789')
+    spooled.seek(0)
+
+    assert spooled.on_disk
+    assert spooled.size == 10
+    assert spooled.sha256 == hashlib.sha256(b'0123456789').hexdigest()
+    assert spooled.read() == b'0123456789'
+    assert spooled.links == []
+
+
+def test_spooled_upload_rejects_large_files_early():
+    spooled = SpooledUpload(max_size=8)
+    spooled.write(b'0123')
+
+    with pytest.raises(UploadTooLarge):
+        spooled.write(b'456789')
+
+
+def test_spool_copies_plain_files():
+    spooled = spool(io.BytesIO(b'[pitch](/pitch)'), scan_links=True)
+
+    assert spooled.tell() == 0
+    assert spooled.links == [('pitch', '/pitch')]
+
+
+def test_spool_reuses_parsed_upload():
+    parsed = SpooledUpload(scan_links=True)
+    parsed.write(b'[pitch](/pitch)')
+    parsed.seek(0)
+
+    assert spool(FileStorage(parsed), scan_links=True) is parsed
+    with pytest.raises(UploadTooLarge):
+        spool(FileStorage(parsed), max_size=4)
@@ -0,0 +1,101 @@
+"""
+Uploads the images inside a .zip archive in parallel.
+
+Members are streamed straight from the archive to the upload function on
+a bounded pool, with a bounded number in flight, so memory use doesn't
+depend on the size of the archive.
+"""
+import logging
+import os
+import threading
+import zipfile
+from collections import namedtuple
+
+DEFAULT_MAX_MEMBERS = 500
+DEFAULT_MAX_TOTAL_SIZE = 200 * 1024 * 1024
+DEFAULT_WORKERS = 8
+IMAGE_ENDINGS = ('jpg', 'jpeg', 'png')
+
+UPLOADED = 'uploaded'
+DUPLICATE = 'duplicate'
+SKIPPED = 'skipped'
+FAILED = 'failed'
+
+ZipResult = namedtuple('ZipResult', ['name', 'status'])
+
+
+class ZipLimitError(ValueError):
+    """
+    The archive has too many images or they are too large in total.
+    """
+
+
+def ingest_zip(zip_file,
+               upload,
+               pool,
+               max_members=DEFAULT_MAX_MEMBERS,
+               max_total_size=DEFAULT_MAX_TOTAL_SIZE,
+               max_in_flight=DEFAULT_WORKERS * 2):
+    """
+    Uploads every image in an archive, skipping other files and
+    images with a name or content already seen in the archive.
+    Limits are checked before anything is uploaded.\n
+    Args:
+        - The archive (IO), upload function taking (IO, name) and
+          returning a Boolean, pool running the uploads (Executor),
+          most images (int), most uncompressed bytes of images (int),
+          most members read at once (int)
+    Returns:
+        - One ZipResult per member, in archive order (list)
+    Raises:
+        - ZipLimitError, zipfile.BadZipFile
+    """
+    with zipfile.ZipFile(zip_file, 'r') as archive:
+        results = []
+        images = []
+        seen_names = set()
+        seen_contents = set()
+        for info in archive.infolist():
+            name = os.path.basename(info.filename)
+            if info.is_dir() or info.filename.startswith('__MACOSX/'):
+                continue
+            if name.split('.')[-1].lower() not in IMAGE_ENDINGS:
+                results.append(ZipResult(info.filename, SKIPPED))
+            elif (name in seen_names or
+                  (info.CRC, info.file_size) in seen_contents):
+                results.append(ZipResult(info.filename, DUPLICATE))
+            else:
+                seen_names.add(name)
+                seen_contents.add((info.CRC, info.file_size))
+                results.append(None)
+                images.append((len(results) - 1, info))
+
+        if len(images) > max_members:
+            raise ZipLimitError(
+                f'Archive has {len(images)} images, the limit is {max_members}')
+        total_size = sum(info.file_size for _, info in images)
+        if total_size > max_total_size:
+            raise ZipLimitError(f'Archive holds {total_size} bytes of images, '
+                                f'the limit is {max_total_size}')
+
+        # A slot is taken per member read and freed when its upload is done
+        in_flight = threading.BoundedSemaphore(max_in_flight)
+
+        def upload_member(info):
+            try:
+                with archive.open(info) as member:
+                    uploaded = upload(member, info.filename)
+                return UPLOADED if uploaded else FAILED
+            except Exception:
+                logging.exception('Could not upload %s', info.filename)
+                return FAILED
+            finally:
+                in_flight.release()
+
+        futures = []
+        for position, info in images:
+            in_flight.acquire()
+            futures.append((position, info, pool.submit(upload_member, info)))
+        for position, info, future in futures:
+            results[position] = ZipResult(info.filename, future.result())
+        return results
@@ -0,0 +1,108 @@
+from flaskr.zip_ingest import ingest_zip, ZipLimitError, ZipResult
+from concurrent.futures import ThreadPoolExecutor
+import io
+import threading
+import zipfile
+import pytest
+
+
+def make_zip(files):
+    out = io.BytesIO()
+    with zipfile.ZipFile(out, 'w') as archive:
+        for name, data in files:
+            archive.writestr(name, data)
+    out.seek(0)
+    return out
+
+
+@pytest.fixture
+def pool():
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        yield pool
+
+
+class upload_mock:
+
+    def __init__(self, result=True):
+        self.result = result
+        self.uploaded = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, content, filename):
+        with self.lock:
+            self.uploaded[filename] = content.read()
+        return self.result
+
+
+def test_uploads_images_only(pool):
+    upload = upload_mock()
+    archive = make_zip([('a.png', b'a'), ('notes.txt', b'n'),
+                        ('dir/b.JPG', b'b')])
+
+    results = ingest_zip(archive, upload, pool)
+
+    assert results == [
+        ZipResult('a.png', 'uploaded'),
+        ZipResult('notes.txt', 'skipped'),
+        ZipResult('dir/b.JPG', 'uploaded')
+    ]
+    assert upload.uploaded == {'a.png': b'a', 'dir/b.JPG': b'b'}
+
+
+def test_skips_duplicates(pool):
+    upload = upload_mock()
+    archive = make_zip([('a.png', b'a'), ('other/a.png', b'x'),
+                        ('copy.png', b'a')])
+
+    results = ingest_zip(archive, upload, pool)
+
+    assert [result.status for result in results
+           ] == ['uploaded', 'duplicate', 'duplicate']
+    assert list(upload.uploaded) == ['a.png']
+
+
+def test_member_limit(pool):
+    upload = upload_mock()
+    archive = make_zip([('a.png', b'a'), ('b.png', b'b')])
+
+    with pytest.raises(ZipLimitError):
+        ingest_zip(archive, upload, pool, max_members=1)
+    assert upload.uploaded == {}
+
+
+def test_size_limit(pool):
+    upload = upload_mock()
+    archive = make_zip([('a.png', b'a' * 10), ('b.png', b'b' * 10)])
+
+    with pytest.raises(ZipLimitError):
+        ingest_zip(archive, upload, pool, max_total_size=15)
+    assert upload.uploaded == {}
+
+
+def test_failed_upload_reported(pool):
+    archive = make_zip([('a.png', b'a')])
+    results = ingest_zip(archive, upload_mock(result=False), pool)
+    assert results == [ZipResult('a.png', 'failed')]
+
+
+def test_bounded_in_flight(pool):
+    running = []
+    most = []
+    lock = threading.Lock()
+
+    def slow_upload(content, filename):
+        with lock:
+            running.append(filename)
+            most.append(len(running))
+        content.read()
+        with lock:
+            running.remove(filename)
+        return True
+
+    archive = make_zip([
+        (f'{number}.png', bytes([number])) for number in range(20)
+    ])
+    results = ingest_zip(archive, slow_upload, pool, max_in_flight=2)
+
+    assert len(results) == 20
+    assert max(most) <= 2